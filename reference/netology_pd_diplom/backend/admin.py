@@ -1,8 +1,106 @@
+from functools import partial
+
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+from django.db import transaction
+from django.db.models import Q
 
+from backend.caching import catalog_version
 from backend.models import User, Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Order, OrderItem, \
-    Contact, ConfirmEmailToken
+    Contact, ConfirmEmailToken, ImportJob, CatalogOffer, ParameterIndex, FacetCount, ExportJob, ShopOrder
+from backend.services import dictionary
+from backend.services.facets import delete_offers
+from backend.services.stock import release_stock
+from backend.services.totals import update_order_totals
+
+
+class DictionaryAdminMixin:
+    """
+    Сбрасывает словарные кэши после изменения или удаления записей справочника
+    """
+    dictionary_caches = ()
+
+    def invalidate_dictionaries(self):
+        for dictionary_cache in self.dictionary_caches:
+            dictionary_cache.invalidate()
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+
+        if change:
+            transaction.on_commit(self.invalidate_dictionaries)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        transaction.on_commit(self.invalidate_dictionaries)
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        transaction.on_commit(self.invalidate_dictionaries)
+
+
+class CatalogAdminMixin:
+    """
+    Ставит в очередь пересборку каталога магазинов (задача refresh_catalog), затронутых изменением
+    или удалением записей, и увеличивает версию каталога, чтобы сбросить кэш ответов. Задачи ставятся
+    после фиксации транзакции, поэтому в базовых классах примесь стоит перед DictionaryAdminMixin:
+    словари сбрасываются раньше
+    """
+    # путь от записи к id магазинов, предложения которых от нее зависят
+    shop_lookup = 'id'
+    # пути от CatalogOffer к записи, если ее удаление каскадом удаляет предложения
+    offer_lookups = ()
+
+    def get_shop_ids(self, queryset) -> set:
+        return set(queryset.exclude(**{f'{self.shop_lookup}__isnull': True}).values_list(
+            self.shop_lookup, flat=True))
+
+    @staticmethod
+    def refresh_shops(shop_ids: set) -> None:
+        # backend.tasks импортирует приложение Celery, которое настраивает Django, поэтому
+        # импорт откладывается до вызова: модуль admin загружается во время настройки
+        from backend.tasks import refresh_catalog
+
+        # каталог пересобирается в фоне, задача увеличивает версию каталога по завершении
+        for shop_id in sorted(shop_ids):
+            refresh_catalog.delay(shop_id)
+
+        # предложения, удаленные вместе с записями, уже убраны из каталога
+        catalog_version.bump()
+
+    def save_model(self, request, obj, form, change):
+        # при смене магазина или продукта обновляются и прежние, и новые магазины
+        shop_ids = self.get_shop_ids(self.model.objects.filter(pk=obj.pk)) if change else set()
+        super().save_model(request, obj, form, change)
+        shop_ids |= self.get_shop_ids(self.model.objects.filter(pk=obj.pk))
+        transaction.on_commit(partial(self.refresh_shops, shop_ids))
+
+    def delete_model(self, request, obj):
+        shop_ids = self.delete_offers(self.model.objects.filter(pk=obj.pk))
+        super().delete_model(request, obj)
+        transaction.on_commit(partial(self.refresh_shops, shop_ids))
+
+    def delete_queryset(self, request, queryset):
+        shop_ids = self.delete_offers(queryset)
+        super().delete_queryset(request, queryset)
+        transaction.on_commit(partial(self.refresh_shops, shop_ids))
+
+    def delete_offers(self, queryset) -> set:
+        """
+        Удаляет предложения, которые удалились бы каскадом, с вычетом из счетчиков фасетов,
+        и возвращает id затронутых магазинов
+        """
+        shop_ids = self.get_shop_ids(queryset)
+
+        if self.offer_lookups:
+            query = Q()
+
+            for lookup in self.offer_lookups:
+                query |= Q(**{f'{lookup}__in': queryset})
+
+            delete_offers(CatalogOffer.objects.filter(query))
+
+        return shop_ids
 
 
 @admin.register(User)
@@ -24,43 +122,86 @@ class CustomUserAdmin(UserAdmin):
 
 
 @admin.register(Shop)
-class ShopAdmin(admin.ModelAdmin):
-    pass
+class ShopAdmin(CatalogAdminMixin, admin.ModelAdmin):
+    offer_lookups = ('shop',)
 
 
 @admin.register(Category)
-class CategoryAdmin(admin.ModelAdmin):
-    pass
+class CategoryAdmin(CatalogAdminMixin, DictionaryAdminMixin, admin.ModelAdmin):
+    # удаление категории каскадом удаляет ее продукты
+    dictionary_caches = (dictionary.categories, dictionary.products)
+    shop_lookup = 'products__product_infos__shop_id'
+    offer_lookups = ('category', 'product_info__product__category')
 
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
-    pass
+class ProductAdmin(CatalogAdminMixin, DictionaryAdminMixin, admin.ModelAdmin):
+    dictionary_caches = (dictionary.products,)
+    shop_lookup = 'product_infos__shop_id'
+    offer_lookups = ('product_info__product',)
 
 
 @admin.register(ProductInfo)
-class ProductInfoAdmin(admin.ModelAdmin):
-    pass
+class ProductInfoAdmin(CatalogAdminMixin, admin.ModelAdmin):
+    shop_lookup = 'shop_id'
+    offer_lookups = ('product_info',)
 
 
 @admin.register(Parameter)
-class ParameterAdmin(admin.ModelAdmin):
-    pass
+class ParameterAdmin(CatalogAdminMixin, DictionaryAdminMixin, admin.ModelAdmin):
+    dictionary_caches = (dictionary.parameters,)
+    shop_lookup = 'product_parameters__product_info__shop_id'
 
 
 @admin.register(ProductParameter)
-class ProductParameterAdmin(admin.ModelAdmin):
-    pass
+class ProductParameterAdmin(CatalogAdminMixin, admin.ModelAdmin):
+    shop_lookup = 'product_info__shop_id'
 
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    pass
+    """
+    Переносит статус заказа в записи магазинов и возвращает товары на склад при отмене
+    """
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+
+        if change and 'state' in form.changed_data:
+            ShopOrder.objects.filter(order_id=obj.id).update(state=obj.state)
+
+            if obj.state == 'canceled' and form.initial.get('state') not in ('basket', 'canceled'):
+                release_stock([obj.id])
 
 
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
-    pass
+    """
+    Пересчитывает суммы корзин после изменения или удаления позиций. Суммы оформленных
+    заказов и записи магазинов зафиксированы при оформлении и по текущим ценам не пересчитываются
+    """
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        self.update_totals({obj.order_id, form.initial.get('order', obj.order_id)})
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        self.update_totals({obj.order_id})
+
+    def delete_queryset(self, request, queryset):
+        order_ids = set(queryset.values_list('order_id', flat=True))
+        super().delete_queryset(request, queryset)
+        self.update_totals(order_ids)
+
+    @staticmethod
+    def update_totals(order_ids: set):
+        update_order_totals(Order.objects.filter(id__in=order_ids, state='basket'))
+
+
+@admin.register(ShopOrder)
+class ShopOrderAdmin(admin.ModelAdmin):
+    list_display = ('order', 'shop', 'state', 'subtotal', 'item_count', 'dt')
 
 
 @admin.register(Contact)
@@ -68,6 +209,31 @@ class ContactAdmin(admin.ModelAdmin):
     pass
 
 
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('user', 'file_name', 'state', 'rows_processed', 'created_at', 'finished_at',)
+
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('user', 'state', 'updated_since', 'since_version', 'offers', 'size', 'created_at', 'finished_at',)
+
+
 @admin.register(ConfirmEmailToken)
 class ConfirmEmailTokenAdmin(admin.ModelAdmin):
     list_display = ('user', 'key', 'created_at',)
+
+
+@admin.register(CatalogOffer)
+class CatalogOfferAdmin(admin.ModelAdmin):
+    list_display = ('product_info', 'shop', 'category')
+
+
+@admin.register(ParameterIndex)
+class ParameterIndexAdmin(admin.ModelAdmin):
+    list_display = ('parameter', 'value', 'numeric_value', 'offer')
+
+
+@admin.register(FacetCount)
+class FacetCountAdmin(admin.ModelAdmin):
+    list_display = ('parameter', 'value', 'count')
@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class BackendConfig(AppConfig):
@@ -9,3 +10,6 @@ class BackendConfig(AppConfig):
         """
         импортируем сигналы
         """
+        from backend.search import create_search_index
+
+        post_migrate.connect(create_search_index, sender=self)
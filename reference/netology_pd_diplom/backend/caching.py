@@ -0,0 +1,91 @@
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+
+class CatalogVersion:
+    """
+    Счетчик версии каталога в общем кэше.
+
+    Версия увеличивается при любом изменении каталога (импорт, смена статуса
+    магазина, правка в админке) и входит в ключи кэша ответов, поэтому старые
+    ответы просто перестают находиться. Начальное значение берется от текущего
+    времени, чтобы после очистки кэша версии не повторялись.
+    """
+    key = 'catalog:version'
+
+    @property
+    def cache(self):
+        return caches[settings.CATALOG_CACHE]
+
+    def get(self) -> int:
+        version = self.cache.get(self.key)
+
+        if version is None:
+            self.cache.add(self.key, time.time_ns() // 1000000, None)
+            version = self.cache.get(self.key)
+
+        return version
+
+    def bump(self) -> None:
+        try:
+            self.cache.incr(self.key)
+        except ValueError:
+            self.get()
+
+
+catalog_version = CatalogVersion()
+
+
+class CatalogCacheMixin:
+    """
+    Кэш ответов списков каталога.
+
+    Ключ строится из версии каталога, представления, формата ответа и
+    нормализованных параметров запроса, а строгий ETag - из ключа. Поэтому
+    запрос с актуальным If-None-Match получает 304 без обращения к данным,
+    а остальные запросы до смены версии получают сохраненный ответ.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(request, lambda: super(CatalogCacheMixin, self).list(request, *args, **kwargs))
+
+    def get_cached_response(self, request, get_response) -> Response:
+        key = self.get_cache_key(request)
+        etag = f'"{key.rsplit(":", 1)[1]}"'
+        cache = catalog_version.cache
+
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            data = cache.get(key)
+
+            if data is None:
+                response = get_response()
+
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+
+                data = response.data
+                cache.set(key, data, settings.CATALOG_CACHE_TIMEOUT)
+
+            response = Response(data)
+
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def get_cache_key(self, request) -> str:
+        params = urlencode(sorted((name, value) for name, values in request.query_params.lists() for value in values))
+        source = '|'.join((
+            str(catalog_version.get()), self.__class__.__name__, request.get_host(),
+            request.accepted_renderer.format, params,
+        ))
+        return f'catalog:response:{hashlib.sha256(source.encode()).hexdigest()}'
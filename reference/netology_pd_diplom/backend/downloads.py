@@ -0,0 +1,63 @@
+import os
+import re
+from typing import Iterator
+
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework import status
+
+RANGE = re.compile(r'^bytes=(?P<first>\d*)-(?P<last>\d*)$')
+BLOCK_SIZE = 64 * 1024
+
+
+def read_range(path: str, start: int, length: int) -> Iterator[bytes]:
+    with open(path, 'rb') as file:
+        file.seek(start)
+
+        while length > 0:
+            data = file.read(min(BLOCK_SIZE, length))
+
+            if not data:
+                break
+
+            length -= len(data)
+            yield data
+
+
+def get_file_response(request, path: str, file_name: str, etag: str, content_type: str) -> HttpResponse:
+    """
+    Отдает файл потоком с поддержкой докачки: один диапазон из заголовка Range
+    (bytes=a-b, bytes=a- или bytes=-n) отдается с кодом 206. If-Range сравнивается
+    с ETag, и при несовпадении файл отдается целиком. Несколько диапазонов
+    в одном запросе не поддерживаются - в этом случае тоже отдается весь файл.
+    """
+    size = os.path.getsize(path)
+    start, end = 0, size - 1
+    match = RANGE.match(request.headers.get('Range', '').strip())
+    is_partial = bool(match and (match['first'] or match['last'])
+                      and request.headers.get('If-Range', etag) == etag)
+
+    if is_partial:
+        if match['first']:
+            start = int(match['first'])
+            end = min(int(match['last']), size - 1) if match['last'] else size - 1
+        else:
+            start = max(size - int(match['last']), 0)
+
+        if start >= size or start > end:
+            response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    response = StreamingHttpResponse(
+        read_range(path, start, end - start + 1), content_type=content_type,
+        status=status.HTTP_206_PARTIAL_CONTENT if is_partial else status.HTTP_200_OK
+    )
+    response['Content-Length'] = end - start + 1
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Content-Disposition'] = f'attachment; filename="{file_name}"'
+
+    if is_partial:
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    return response
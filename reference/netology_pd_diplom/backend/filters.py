@@ -1,11 +1,92 @@
+import re
+
 from django_filters import rest_framework as filters
-from backend.models import ProductInfo
+from rest_framework.exceptions import ValidationError
+from backend.models import CatalogOffer, ParameterIndex, ShopOrder, STATE_CHOICES
+from backend.search import search
+from backend.services import dictionary
+
+PARAMETER_FILTER = re.compile(r'^param\[(?P<name>.+)\](?:__(?P<lookup>gt|gte|lt|lte))?$')
 
 
 class ProductFilter(filters.FilterSet):
+    """
+    Кроме полей ниже поддерживаются фильтры по параметрам вида param[Цвет]=черный:
+    повторы одного параметра объединяются через ИЛИ, разные параметры - через И.
+    Числовые параметры фильтруются по диапазону: param[Диагональ (дюйм)]__gte=6
+    """
     shop = filters.NumberFilter(field_name="shop")
-    category = filters.NumberFilter(field_name="product__category")
+    category = filters.NumberFilter(field_name="category")
+    search = filters.CharFilter(method="filter_search")
+    min_price = filters.NumberFilter(field_name="price", lookup_expr="gte")
+    max_price = filters.NumberFilter(field_name="price", lookup_expr="lte")
+    in_stock = filters.BooleanFilter(method="filter_in_stock")
+    ordering = filters.OrderingFilter(fields=("price", "price_rrc", "name"))
+
+    class Meta:
+        model = CatalogOffer
+        fields = ["category", "shop"]
+
+    @staticmethod
+    def filter_search(queryset, name, value):
+        return search(queryset, value)
+
+    @staticmethod
+    def filter_in_stock(queryset, name, value):
+        return queryset.filter(quantity__gt=0) if value else queryset.filter(quantity=0)
+
+    def filter_queryset(self, queryset):
+        return self.filter_parameters(super().filter_queryset(queryset))
+
+    def filter_parameters(self, queryset):
+        conditions = {}
+
+        for key in self.data:
+            match = PARAMETER_FILTER.match(key)
+
+            if not match:
+                continue
+
+            values = self.data.getlist(key) if hasattr(self.data, 'getlist') else [self.data[key]]
+            lookups = conditions.setdefault(match['name'], {})
+
+            if match['lookup']:
+                lookups.update({f'numeric_value__{match["lookup"]}': self.parse_number(key, value) for value in values})
+            else:
+                lookups['value__in'] = values
+
+        if not conditions:
+            return queryset
+
+        parameter_ids = dictionary.parameters.get_ids(conditions)
+
+        for name, lookups in conditions.items():
+            if name not in parameter_ids:
+                return queryset.none()
+
+            queryset = queryset.filter(product_info_id__in=ParameterIndex.objects.filter(
+                parameter_id=parameter_ids[name], **lookups).values('offer_id'))
+
+        return queryset
+
+    @staticmethod
+    def parse_number(key: str, value: str) -> float:
+        try:
+            return float(value.replace(',', '.'))
+        except ValueError:
+            raise ValidationError({key: ['Введите число.']})
+
+
+class ShopOrderFilter(filters.FilterSet):
+    """
+    Фильтры списка заказов поставщика: state можно повторять, date_from и date_to
+    ограничивают дату заказа включительно (ISO 8601, дата без времени - полночь)
+    """
+    state = filters.MultipleChoiceFilter(choices=[choice for choice in STATE_CHOICES if choice[0] != "basket"],
+                                         distinct=False)
+    date_from = filters.IsoDateTimeFilter(field_name="dt", lookup_expr="gte")
+    date_to = filters.IsoDateTimeFilter(field_name="dt", lookup_expr="lte")
 
     class Meta:
-        model = ProductInfo
-        fields = ["product__category", "shop"]
+        model = ShopOrder
+        fields = ["state"]
@@ -0,0 +1,146 @@
+import queue
+import random
+import threading
+import time
+import uuid
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+from django.db.models import Max, Sum
+
+from backend.models import User, Shop, Category, Product, ProductInfo, Order, OrderItem, Contact
+from backend.services.order import OrderOperation
+from backend.services.stock import StockError
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет параллельное оформление заказов на общих товарах с ограниченным остатком: '
+        'заказов в секунду, успешных оформлений и отказов по остатку, и проверяет, что '
+        'проданное количество не превышает остаток. Созданные данные удаляются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=200, help='Количество покупателей с корзинами')
+        parser.add_argument('--workers', type=int, default=16, help='Количество параллельных потоков')
+        parser.add_argument('--products', type=int, default=5, help='Количество общих товаров')
+        parser.add_argument('--stock', type=int, default=100, help='Начальный остаток каждого товара')
+        parser.add_argument('--lines', type=int, default=3, help='Количество товаров в корзине')
+        parser.add_argument('--quantity', type=int, default=2, help='Количество каждого товара в корзине')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['lines'] > options['products']:
+            raise CommandError('--lines не может быть больше --products')
+
+        token = uuid.uuid4().hex[:8]
+        shop_user, baskets = self.prepare(token, options)
+
+        try:
+            results, wall_time = self.run_checkouts(baskets, options['workers'])
+            self.report(shop_user, baskets, results, wall_time, options)
+        finally:
+            User.objects.filter(email__startswith=f'bench-{token}-').delete()
+            Category.objects.filter(name=f'bench-{token}').delete()
+
+    @staticmethod
+    def prepare(token: str, options: dict) -> tuple:
+        """
+        Создает магазин с общими товарами и корзины покупателей; товары в корзинах идут
+        в случайном порядке, чтобы заказы пересекались по строкам в разном порядке
+        """
+        rng = random.Random(options['seed'])
+        shop_user = User.objects.create(email=f'bench-{token}-shop@example.com', type='shop', is_active=True,
+                                        password=make_password(None))
+        shop = Shop.objects.create(name=f'bench-{token}', user=shop_user)
+        # id категорий приходят из прайс-листов, поэтому последовательность может отставать
+        category = Category.objects.create(id=(Category.objects.aggregate(id=Max('id'))['id'] or 0) + 1,
+                                           name=f'bench-{token}')
+        product = Product.objects.create(name=f'bench-{token}', category=category)
+        product_info_ids = [
+            ProductInfo.objects.create(product=product, shop=shop, external_id=number, model=f'bench-{number}',
+                                       quantity=options['stock'], price=100, price_rrc=100).id
+            for number in range(options['products'])
+        ]
+
+        buyers = User.objects.bulk_create([
+            User(email=f'bench-{token}-{number}@example.com', is_active=True, password=make_password(None))
+            for number in range(options['buyers'])
+        ])
+        contacts = Contact.objects.bulk_create([
+            Contact(user=buyer, city='-', street='-', phone='-') for buyer in buyers
+        ])
+        orders = Order.objects.bulk_create([Order(user=buyer, state='basket') for buyer in buyers])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product_info_id=product_info_id, quantity=options['quantity'])
+            for order in orders for product_info_id in rng.sample(product_info_ids, options['lines'])
+        ])
+
+        return shop_user, list(zip(buyers, orders, contacts))
+
+    @staticmethod
+    def checkout(basket: tuple) -> str:
+        buyer, order, contact = basket
+
+        try:
+            return 'done' if OrderOperation(buyer).checkout(order.id, contact.id) else 'skipped'
+        except StockError:
+            return 'out_of_stock'
+        except DatabaseError:
+            # например, взаимная блокировка или занятая база SQLite
+            return 'error'
+
+    def run_checkouts(self, baskets: list, workers: int) -> tuple:
+        """
+        Оформляет корзины в workers потоках, у каждого потока свое соединение с базой
+        """
+        tasks = queue.SimpleQueue()
+        results = []
+
+        for basket in baskets:
+            tasks.put(basket)
+
+        def work():
+            try:
+                while True:
+                    try:
+                        basket = tasks.get_nowait()
+                    except queue.Empty:
+                        return
+
+                    results.append(self.checkout(basket))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work) for _ in range(workers)]
+        started = time.perf_counter()
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        return results, time.perf_counter() - started
+
+    def report(self, shop_user: User, baskets: list, results: list, wall_time: float, options: dict) -> None:
+        counts = {result: results.count(result) for result in ('done', 'out_of_stock', 'error', 'skipped')}
+        initial = options['stock'] * options['products']
+        left = ProductInfo.objects.filter(shop__user=shop_user).aggregate(total=Sum('quantity'))['total']
+        sold = OrderItem.objects.filter(
+            order_id__in=[order.id for _, order, _ in baskets], order__state='new').aggregate(
+            total=Sum('quantity'))['total'] or 0
+        demand = len(baskets) * options['lines'] * options['quantity']
+
+        self.stdout.write(
+            f'{len(baskets)} checkouts in {wall_time:.3f} s, {len(baskets) / wall_time:.1f} checkouts/s, '
+            f'{options["workers"]} workers ({connection.vendor})\n'
+            + ' '.join(f'{result}={count}' for result, count in counts.items())
+            + f'\nstock {initial}, demand {demand}, sold {sold}, left {left}'
+        )
+
+        if sold > initial or sold != initial - left:
+            raise CommandError(f'Остаток не сходится с проданным: продано {sold}, списано {initial - left}')
+
+        self.stdout.write(self.style.SUCCESS('Перепродаж нет'))
@@ -0,0 +1,155 @@
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from backend.models import User
+from backend.services.generator import generate_catalog, write_catalog
+from backend.services.loader import get_loader
+from backend.services.tracker import ImportTracker
+
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'benchmarks', 'import_baseline.json')
+
+
+class QueryCounter:
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет импорт синтетических прайс-листов: время, количество запросов, пик памяти '
+        'и товаров в секунду, и сравнивает результаты с сохраненным базовым замером для той же СУБД. '
+        'Все изменения в базе откатываются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000], help='Количества товаров')
+        parser.add_argument('--format', choices=('yaml', 'json', 'ndjson'), default='yaml')
+        parser.add_argument('--parameters', type=int, default=8, help='Количество разных имен параметров')
+        parser.add_argument('--values', type=int, default=20, help='Количество разных значений параметра')
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Файл базового замера')
+        parser.add_argument('--save-baseline', action='store_true', help='Сохранить результаты как базовый замер')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Допустимое ухудшение относительно базового замера (0.2 = 20%%)')
+
+    def handle(self, *args, **options):
+        results = {}
+
+        with tempfile.TemporaryDirectory() as directory:
+            for size in sorted(options['sizes']):
+                file_name = os.path.join(directory, f'catalog_{size}.{options["format"]}')
+                header, goods = generate_catalog(size, parameters=options['parameters'], values=options['values'])
+
+                with open(file_name, 'w', encoding='utf-8') as stream:
+                    write_catalog(stream, header, goods, options['format'])
+
+                for scenario, result in self.run_imports(file_name, size).items():
+                    key = f'{connection.vendor}:{options["format"]}:{size}:{scenario}'
+                    results[key] = result
+                    self.stdout.write(
+                        f'{key:<36} {result["wall_time"]:>9.3f} s {result["queries"]:>8} queries '
+                        f'{result["rows_per_second"]:>10.0f} rows/s {result["peak_memory_mb"]:>8.1f} MB  '
+                        + ' '.join(f'{phase}={value:.3f}' for phase, value in result['timings'].items())
+                    )
+
+        if options['save_baseline']:
+            os.makedirs(os.path.dirname(options['baseline']), exist_ok=True)
+            # замеры других СУБД и размеров в файле сохраняются
+            baseline = self.load_baseline(options['baseline']) if os.path.exists(options['baseline']) else {}
+            baseline.update(results)
+
+            with open(options['baseline'], 'w', encoding='utf-8') as file:
+                json.dump(baseline, file, indent=2, sort_keys=True)
+
+            self.stdout.write(self.style.SUCCESS(f'Базовый замер сохранен в {options["baseline"]}'))
+            return
+
+        self.compare(results, options['baseline'], options['tolerance'])
+
+    def run_imports(self, file_name: str, size: int) -> dict:
+        """
+        Импортирует файл дважды: в пустой магазин и повторно без изменений
+        """
+        results = {}
+
+        with transaction.atomic():
+            user = User.objects.create_user(f'benchmark-{size}@example.com', type='shop', is_active=True)
+
+            for scenario in ('initial', 'reimport'):
+                peak_memory = self.measure_memory(file_name, user)
+                counter = QueryCounter()
+                tracker = ImportTracker()
+                started = time.perf_counter()
+
+                with connection.execute_wrapper(counter), open(file_name, encoding='utf-8') as stream:
+                    get_loader(file_name)(user.id).import_data(stream, tracker)
+
+                wall_time = time.perf_counter() - started
+                results[scenario] = {
+                    'wall_time': wall_time,
+                    'queries': counter.count,
+                    'rows_per_second': size / wall_time,
+                    'peak_memory_mb': peak_memory / 1024 / 1024,
+                    'timings': tracker.timings,
+                }
+
+            transaction.set_rollback(True)
+
+        return results
+
+    @staticmethod
+    def measure_memory(file_name: str, user: User) -> int:
+        """
+        Пик памяти Python-объектов (tracemalloc) при таком же импорте. Прогон идет отдельно
+        от замера времени, чтобы не замедлять его, и откатывается, поэтому следующий
+        прогон начинается с того же состояния базы
+        """
+        tracemalloc.start()
+
+        try:
+            with transaction.atomic(), open(file_name, encoding='utf-8') as stream:
+                get_loader(file_name)(user.id).import_data(stream, ImportTracker())
+                transaction.set_rollback(True)
+
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    @staticmethod
+    def load_baseline(baseline_file: str) -> dict:
+        with open(baseline_file, encoding='utf-8') as file:
+            return json.load(file)
+
+    def compare(self, results: dict, baseline_file: str, tolerance: float) -> None:
+        if not os.path.exists(baseline_file):
+            raise CommandError(f'Базовый замер {baseline_file} не найден; сохраните его с --save-baseline')
+
+        baseline = self.load_baseline(baseline_file)
+        missing = sorted(key for key in results if key not in baseline)
+
+        if missing:
+            raise CommandError(
+                'В базовом замере нет сценариев: ' + ', '.join(missing) + '; сохраните их с --save-baseline')
+
+        regressions = []
+
+        for key, result in results.items():
+            for metric in ('wall_time', 'queries', 'peak_memory_mb'):
+                if result[metric] > baseline[key][metric] * (1 + tolerance):
+                    regressions.append(f'{key} {metric}: {baseline[key][metric]:.3f} -> {result[metric]:.3f}')
+
+        if regressions:
+            raise CommandError('Обнаружены регрессии:\n' + '\n'.join(regressions))
+
+        self.stdout.write(self.style.SUCCESS('Регрессий относительно базового замера нет'))
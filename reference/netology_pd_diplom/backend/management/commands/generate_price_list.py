@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from backend.services.generator import generate_catalog, write_catalog
+
+
+class Command(BaseCommand):
+    help = 'Генерирует синтетический прайс-лист магазина для нагрузочного тестирования импорта'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Путь к создаваемому файлу')
+        parser.add_argument('--goods', type=int, default=1000, help='Количество товаров')
+        parser.add_argument('--format', choices=('yaml', 'json', 'ndjson'), default='yaml')
+        parser.add_argument('--categories', type=int, default=10, help='Количество категорий')
+        parser.add_argument('--parameters', type=int, default=8, help='Количество разных имен параметров')
+        parser.add_argument('--values', type=int, default=20, help='Количество разных значений параметра')
+        parser.add_argument('--parameters-per-good', type=int, default=4)
+        parser.add_argument('--shop', default='Бенчмарк')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        header, goods = generate_catalog(
+            options['goods'], categories=options['categories'], parameters=options['parameters'],
+            values=options['values'], parameters_per_good=options['parameters_per_good'],
+            shop=options['shop'], seed=options['seed']
+        )
+
+        with open(options['output'], 'w', encoding='utf-8') as stream:
+            write_catalog(stream, header, goods, options['format'])
+
+        self.stdout.write(self.style.SUCCESS(f'{options["goods"]} товаров записано в {options["output"]}'))
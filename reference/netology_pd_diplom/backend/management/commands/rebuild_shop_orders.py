@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from backend.models import Order
+from backend.services.importer import BATCH_SIZE, chunked
+from backend.services.totals import write_shop_orders
+
+
+class Command(BaseCommand):
+    help = (
+        'Записывает заказы магазинов (ShopOrder) для оформленных заказов, у которых их еще нет. '
+        'Суммы существующих записей зафиксированы при оформлении и не пересчитываются по текущим ценам'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--order', type=int, action='append', help='ИД заказа; по умолчанию - все заказы')
+
+    def handle(self, *args, **options):
+        orders = Order.objects.exclude(state='basket').filter(shop_orders__isnull=True).order_by('id')
+
+        if options['order']:
+            orders = orders.filter(id__in=options['order'])
+
+        count = sum(write_shop_orders(order_ids) for order_ids in chunked(
+            orders.values_list('id', flat=True).iterator(chunk_size=BATCH_SIZE), BATCH_SIZE))
+
+        self.stdout.write(self.style.SUCCESS(f'Записано заказов магазинов: {count}'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from backend.services.catalog import CatalogOperation
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает каталог предложений (CatalogOffer) по текущим данным магазинов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shop', type=int, action='append', help='ИД магазина; по умолчанию - все магазины')
+
+    def handle(self, *args, **options):
+        operation = CatalogOperation()
+
+        if options['shop']:
+            count = sum(operation.refresh_shop(shop_id) for shop_id in options['shop'])
+        else:
+            count = operation.refresh_all()
+
+        self.stdout.write(self.style.SUCCESS(f'В каталог записано предложений: {count}'))
@@ -2,6 +2,7 @@ from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.validators import UnicodeUsernameValidator
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django_rest_passwordreset.tokens import get_token_generator
 
@@ -15,6 +16,22 @@ STATE_CHOICES = (
     ('canceled', 'Отменен'),
 )
 
+IMPORT_STATE_CHOICES = (
+    ('pending', 'В очереди'),
+    ('running', 'Выполняется'),
+    ('done', 'Завершен'),
+    ('skipped', 'Пропущен'),
+    ('failed', 'Ошибка'),
+)
+
+EXPORT_STATE_CHOICES = (
+    ('pending', 'В очереди'),
+    ('running', 'Выполняется'),
+    ('done', 'Завершен'),
+    ('failed', 'Ошибка'),
+    ('expired', 'Архив удален по сроку хранения'),
+)
+
 USER_TYPE_CHOICES = (
     ('shop', 'Магазин'),
     ('buyer', 'Покупатель'),
@@ -107,6 +124,7 @@ class Shop(models.Model):
                                 blank=True, null=True,
                                 on_delete=models.CASCADE)
     state = models.BooleanField(verbose_name='статус получения заказов', default=True)
+    import_hash = models.CharField(verbose_name='Хэш последнего импорта', max_length=64, blank=True)
 
     # filename
 
@@ -166,6 +184,9 @@ class ProductInfo(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['product', 'shop', 'external_id'], name='unique_product_info'),
         ]
+        indexes = [
+            models.Index(fields=['shop', 'external_id'], name='product_info_shop_external'),
+        ]
 
 
 class Parameter(models.Model):
@@ -189,6 +210,8 @@ class ProductParameter(models.Model):
     parameter = models.ForeignKey(Parameter, verbose_name='Параметр', related_name='product_parameters', blank=True,
                                   on_delete=models.CASCADE)
     value = models.CharField(verbose_name='Значение', max_length=100)
+    numeric_value = models.FloatField(verbose_name='Числовое значение', null=True, blank=True)
+    unit = models.CharField(verbose_name='Единица измерения', max_length=20, blank=True)
 
     class Meta:
         verbose_name = 'Параметр'
@@ -196,6 +219,89 @@ class ProductParameter(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['product_info', 'parameter'], name='unique_product_parameter'),
         ]
+        indexes = [
+            models.Index(fields=['parameter', 'numeric_value'], name='product_parameter_numeric'),
+        ]
+
+
+class CatalogOffer(models.Model):
+    """
+    Предложение активного магазина в готовом для выдачи виде.
+
+    Таблица заполняется после импорта прайс-листа и при смене статуса магазина,
+    поэтому список товаров читается из нее одним запросом без соединений.
+    """
+    objects = models.manager.Manager()
+    product_info = models.OneToOneField(ProductInfo, verbose_name='Информация о продукте', primary_key=True,
+                                        related_name='catalog_offer', on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='catalog_offers', on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, verbose_name='Категория', related_name='catalog_offers',
+                                 on_delete=models.CASCADE)
+    name = models.CharField(max_length=80, verbose_name='Название', blank=True)
+    price = models.PositiveIntegerField(verbose_name='Цена', default=0)
+    price_rrc = models.PositiveIntegerField(verbose_name='Рекомендуемая розничная цена', default=0)
+    quantity = models.PositiveIntegerField(verbose_name='Количество', default=0)
+    data = models.JSONField(verbose_name='Документ предложения')
+    search_text = models.TextField(verbose_name='Текст для поиска', blank=True)
+    updated_at = models.DateTimeField(verbose_name='Изменено', default=timezone.now)
+    version = models.BigIntegerField(verbose_name='Версия каталога', default=0)
+
+    class Meta:
+        verbose_name = 'Предложение каталога'
+        verbose_name_plural = "Каталог предложений"
+        indexes = [
+            models.Index(fields=['shop', 'product_info'], name='catalog_offer_shop'),
+            models.Index(fields=['category', 'product_info'], name='catalog_offer_category'),
+            models.Index(fields=['price', 'product_info'], name='catalog_offer_price'),
+            models.Index(fields=['shop', 'price', 'product_info'], name='catalog_offer_shop_price'),
+            models.Index(fields=['category', 'price', 'product_info'], name='catalog_offer_category_price'),
+            models.Index(fields=['price_rrc', 'product_info'], name='catalog_offer_price_rrc'),
+            models.Index(fields=['name', 'product_info'], name='catalog_offer_name'),
+            models.Index(fields=['updated_at', 'product_info'], name='catalog_offer_updated'),
+            models.Index(fields=['version', 'product_info'], name='catalog_offer_version'),
+        ]
+
+
+class ParameterIndex(models.Model):
+    """
+    Обратный индекс каталога: значение параметра -> предложения с этим значением
+    """
+    objects = models.manager.Manager()
+    parameter = models.ForeignKey(Parameter, verbose_name='Параметр', related_name='index_entries',
+                                  on_delete=models.CASCADE)
+    value = models.CharField(verbose_name='Значение', max_length=100)
+    numeric_value = models.FloatField(verbose_name='Числовое значение', null=True, blank=True)
+    offer = models.ForeignKey(CatalogOffer, verbose_name='Предложение', related_name='index_entries',
+                              on_delete=models.CASCADE)
+
+    class Meta:
+        verbose_name = 'Запись индекса параметров'
+        verbose_name_plural = "Индекс параметров каталога"
+        constraints = [
+            models.UniqueConstraint(fields=['offer', 'parameter'], name='unique_parameter_index'),
+        ]
+        indexes = [
+            models.Index(fields=['parameter', 'value', 'offer'], name='parameter_index_value'),
+            models.Index(fields=['parameter', 'numeric_value', 'offer'], name='parameter_index_numeric'),
+        ]
+
+
+class FacetCount(models.Model):
+    """
+    Количество предложений каталога с каждым значением параметра
+    """
+    objects = models.manager.Manager()
+    parameter = models.ForeignKey(Parameter, verbose_name='Параметр', related_name='facet_counts',
+                                  on_delete=models.CASCADE)
+    value = models.CharField(verbose_name='Значение', max_length=100)
+    count = models.PositiveIntegerField(verbose_name='Количество предложений')
+
+    class Meta:
+        verbose_name = 'Счетчик значения параметра'
+        verbose_name_plural = "Счетчики значений параметров"
+        constraints = [
+            models.UniqueConstraint(fields=['parameter', 'value'], name='unique_facet_count'),
+        ]
 
 
 class Contact(models.Model):
@@ -231,6 +337,8 @@ class Order(models.Model):
                                 blank=True, null=True,
                                 on_delete=models.CASCADE)
     is_sent_notification = models.BooleanField(default=False, verbose_name='Уведомление на почту отправлено')
+    total_sum = models.PositiveBigIntegerField(verbose_name='Сумма заказа', default=0)
+    item_count = models.PositiveIntegerField(verbose_name='Количество товаров', default=0)
 
     class Meta:
         verbose_name = 'Заказ'
@@ -263,6 +371,98 @@ class OrderItem(models.Model):
         ]
 
 
+class ShopOrder(models.Model):
+    """
+    Часть заказа, относящаяся к одному магазину. Записывается при оформлении заказа
+    с суммой и количеством товаров магазина по ценам на момент оформления;
+    по этой таблице строится список заказов поставщика
+    """
+    objects = models.manager.Manager()
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='shop_orders',
+                             on_delete=models.CASCADE)
+    order = models.ForeignKey(Order, verbose_name='Заказ', related_name='shop_orders',
+                              on_delete=models.CASCADE)
+    state = models.CharField(verbose_name='Статус', choices=STATE_CHOICES, max_length=15)
+    dt = models.DateTimeField(verbose_name='Дата заказа')
+    subtotal = models.PositiveBigIntegerField(verbose_name='Сумма по магазину', default=0)
+    item_count = models.PositiveIntegerField(verbose_name='Количество товаров магазина', default=0)
+
+    class Meta:
+        verbose_name = 'Заказ магазина'
+        verbose_name_plural = "Список заказов магазинов"
+        ordering = ('-id',)
+        constraints = [
+            models.UniqueConstraint(fields=['shop', 'order'], name='unique_shop_order'),
+        ]
+        indexes = [
+            models.Index(fields=['shop', 'id'], name='shop_order_shop'),
+            models.Index(fields=['shop', 'state', 'id'], name='shop_order_state'),
+            models.Index(fields=['shop', 'dt'], name='shop_order_dt'),
+        ]
+
+    def __str__(self):
+        return f'{self.order_id} ({self.shop_id})'
+
+
+class ImportJob(models.Model):
+    """
+    Задача импорта прайс-листа с длительностью каждой фазы в секундах
+    """
+    objects = models.manager.Manager()
+    user = models.ForeignKey(User, verbose_name='Пользователь', related_name='import_jobs',
+                             on_delete=models.CASCADE)
+    file_name = models.CharField(verbose_name='Файл', max_length=100)
+    state = models.CharField(verbose_name='Статус', choices=IMPORT_STATE_CHOICES, max_length=15, default='pending')
+    rows_processed = models.PositiveIntegerField(verbose_name='Обработано товаров', default=0)
+    parse_time = models.FloatField(verbose_name='Разбор файла', default=0)
+    resolve_time = models.FloatField(verbose_name='Сопоставление', default=0)
+    write_time = models.FloatField(verbose_name='Запись', default=0)
+    cleanup_time = models.FloatField(verbose_name='Очистка', default=0)
+    summary = models.JSONField(verbose_name='Сводка изменений', default=dict, blank=True)
+    error = models.TextField(verbose_name='Ошибка', blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Импорт прайс-листа'
+        verbose_name_plural = "Список импортов прайс-листов"
+        ordering = ('-created_at',)
+
+    def __str__(self):
+        return f'{self.file_name} ({self.state})'
+
+
+class ExportJob(models.Model):
+    """
+    Задача выгрузки каталога в архив. Если задан updated_since или since_version,
+    в архив попадают только предложения, измененные после этой отметки.
+    Архив хранится EXPORT_TTL секунд, затем его удаляет задача cleanup_exports
+    """
+    objects = models.manager.Manager()
+    user = models.ForeignKey(User, verbose_name='Пользователь', related_name='export_jobs',
+                             on_delete=models.CASCADE)
+    state = models.CharField(verbose_name='Статус', choices=EXPORT_STATE_CHOICES, max_length=15, default='pending')
+    updated_since = models.DateTimeField(verbose_name='Изменены после', null=True, blank=True)
+    since_version = models.BigIntegerField(verbose_name='Изменены начиная с версии', null=True, blank=True)
+    catalog_version = models.BigIntegerField(verbose_name='Версия каталога', null=True, blank=True)
+    file_name = models.CharField(verbose_name='Файл', max_length=100, blank=True)
+    size = models.PositiveBigIntegerField(verbose_name='Размер архива', default=0)
+    offers = models.PositiveIntegerField(verbose_name='Выгружено предложений', default=0)
+    error = models.TextField(verbose_name='Ошибка', blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(verbose_name='Архив хранится до', null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Выгрузка каталога'
+        verbose_name_plural = "Список выгрузок каталога"
+        ordering = ('-created_at',)
+
+    def __str__(self):
+        return f'{self.id} ({self.state})'
+
+
 class ConfirmEmailToken(models.Model):
     objects = models.manager.Manager()
 
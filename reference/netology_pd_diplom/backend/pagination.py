@@ -0,0 +1,102 @@
+import json
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, _reverse_ordering
+
+
+class ProductInfoPagination(CursorPagination):
+    """
+    Постраничный вывод предложений по курсору без COUNT(*) и OFFSET, поэтому глубина листания
+    не влияет на стоимость запроса. Сортировка всегда заканчивается id, а курсор хранит значения
+    всех полей сортировки последнего предложения: следующая страница выбирается условием
+    price > p OR (price = p AND product_info_id > id), так что равные цены не теряются и не повторяются
+    """
+    ordering = ('product_info_id',)
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def get_ordering(self, request, queryset, view):
+        # сортировка из фильтра ordering дополняется id, чтобы порядок был однозначным
+        if queryset.query.order_by:
+            return *queryset.query.order_by, 'product_info_id'
+
+        # результаты поиска идут по убыванию ранга, курсор - по рангу и id
+        if 'search_rank' in queryset.query.annotations:
+            return '-search_rank', 'product_info_id'
+
+        return self.ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse, current_position = (self.cursor.reverse, self.cursor.position) if self.cursor else (False, None)
+
+        # позиция однозначна, поэтому смещение курсора не используется
+        ordering = _reverse_ordering(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+
+        if current_position is not None:
+            queryset = queryset.filter(self.get_position_filter(ordering, current_position))
+
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        following_position = (
+            self._get_position_from_instance(results[-1], self.ordering) if len(results) > len(self.page) else None)
+
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.next_position = current_position is not None, current_position
+            self.has_previous, self.previous_position = following_position is not None, following_position
+        else:
+            self.has_next, self.next_position = following_position is not None, following_position
+            self.has_previous, self.previous_position = current_position is not None, current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def get_position_filter(self, ordering: tuple, position: str) -> Q:
+        """
+        Условие "после позиции" для составного ключа сортировки:
+        f1 > v1 OR (f1 = v1 AND f2 > v2) OR ..., для полей по убыванию - меньше
+        """
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+
+        if not isinstance(values, list) or len(values) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        query, equal = Q(), Q()
+
+        for order, value in zip(ordering, values):
+            field = order.lstrip('-')
+            query |= equal & Q(**{f'{field}__{"lt" if order.startswith("-") else "gt"}': value})
+            equal &= Q(**{field: value})
+
+        return query
+
+    def _get_position_from_instance(self, instance, ordering):
+        # значения всех полей сортировки; ensure_ascii оставляет курсор в ASCII
+        return json.dumps([
+            instance[order.lstrip('-')] if isinstance(instance, dict) else getattr(instance, order.lstrip('-'))
+            for order in ordering
+        ])
+
+
+class ShopOrderPagination(CursorPagination):
+    """
+    Список заказов поставщика по курсору, новые заказы первыми. Страница выбирается
+    по индексу (shop, id), поэтому стоимость запроса зависит только от заказов своего магазина
+    """
+    ordering = ('-id',)
+    page_size_query_param = 'page_size'
+    max_page_size = 100
@@ -0,0 +1,30 @@
+import ujson
+from rest_framework.renderers import JSONRenderer
+
+
+class UJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer на ujson с тем же побайтовым результатом для компактного вывода.
+
+    ujson иначе записывает порядок малых float ("1e-7" вместо "1e-07"), поэтому
+    рендерер подключается только к спискам без дробных чисел. Отступы и значения,
+    которые ujson не сериализует, отдаются стандартному рендереру.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        if not self.compact or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = ujson.dumps(
+                data, ensure_ascii=self.ensure_ascii, escape_forward_slashes=False,
+                allow_nan=not self.strict, default=self.encoder_class().default
+            )
+        except (TypeError, ValueError, OverflowError):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = ret.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+        return ret.encode()
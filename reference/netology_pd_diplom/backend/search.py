@@ -0,0 +1,132 @@
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, FloatField, QuerySet, Value
+from django.db.models.expressions import RawSQL
+
+from backend.models import CatalogOffer
+
+WORD = re.compile(r'\w+')
+FTS_TABLE = 'catalog_offer_search'
+
+
+def tokenize(query: str) -> list:
+    # search_text хранится в нижнем регистре, чтобы поиск не зависел от локали базы
+    return WORD.findall(query.lower())
+
+
+class SearchBackend:
+    """
+    Полнотекстовый поиск по CatalogOffer.search_text без индекса: каждое слово
+    запроса ищется как подстрока. Используется на базах без поддержки
+    полнотекстового поиска; найденные предложения получают одинаковый ранг.
+    """
+
+    def create_index(self) -> None:
+        pass
+
+    def filter(self, queryset: QuerySet, words: list) -> QuerySet:
+        for word in words:
+            queryset = queryset.filter(search_text__icontains=word)
+
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    tsvector с конфигурацией simple и GIN-индекс по выражению; слова запроса
+    ищутся по префиксу, ранг - ts_rank
+    """
+    vector = "to_tsvector('simple', search_text)"
+
+    def create_index(self) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {FTS_TABLE} ON {CatalogOffer._meta.db_table} USING gin ({self.vector})')
+
+    def filter(self, queryset: QuerySet, words: list) -> QuerySet:
+        query = ' & '.join(f'{word}:*' for word in words)
+        return queryset.filter(
+            RawSQL(f"{self.vector} @@ to_tsquery('simple', %s)", [query], output_field=BooleanField())
+        ).annotate(
+            # ts_rank возвращает real; double precision точно переживает курсор страниц и сравнение с ним
+            search_rank=RawSQL(f"ts_rank({self.vector}, to_tsquery('simple', %s))::float8", [query],
+                               output_field=FloatField())
+        )
+
+
+class SqliteSearchBackend(SearchBackend):
+    """
+    Замена для локальной разработки и тестов: внешняя таблица FTS5 поверх
+    CatalogOffer, которую синхронизируют триггеры; ранг - bm25 со знаком минус
+    """
+
+    def create_index(self) -> None:
+        table = CatalogOffer._meta.db_table
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+
+            if cursor.fetchone():
+                return
+
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(search_text, content='{table}', "
+                f"content_rowid='product_info_id')"
+            )
+            cursor.execute(
+                f'CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON {table} BEGIN '
+                f'INSERT INTO {FTS_TABLE}(rowid, search_text) VALUES (new.product_info_id, new.search_text); END'
+            )
+            cursor.execute(
+                f'CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON {table} BEGIN '
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_text) "
+                f"VALUES ('delete', old.product_info_id, old.search_text); END"
+            )
+            cursor.execute(
+                f'CREATE TRIGGER {FTS_TABLE}_update AFTER UPDATE ON {table} BEGIN '
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_text) "
+                f"VALUES ('delete', old.product_info_id, old.search_text); "
+                f'INSERT INTO {FTS_TABLE}(rowid, search_text) VALUES (new.product_info_id, new.search_text); END'
+            )
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+    def filter(self, queryset: QuerySet, words: list) -> QuerySet:
+        query = ' '.join(f'"{word}"*' for word in words)
+        # product_info_id без имени таблицы: CatalogOffer может оказаться в подзапросе под псевдонимом
+        return queryset.filter(
+            product_info_id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [query])
+        ).annotate(
+            search_rank=RawSQL(
+                f'(SELECT -bm25({FTS_TABLE}) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'AND rowid = product_info_id)', [query], output_field=FloatField())
+        )
+
+
+BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SqliteSearchBackend,
+}
+
+
+def get_search_backend() -> SearchBackend:
+    return BACKENDS.get(connection.vendor, SearchBackend)()
+
+
+def search(queryset: QuerySet, query: str) -> QuerySet:
+    """
+    Оставляет предложения, содержащие все слова запроса (по префиксу), и добавляет ранг search_rank
+    """
+    words = tokenize(query)
+
+    if not words:
+        return queryset
+
+    return get_search_backend().filter(queryset, words)
+
+
+def create_search_index(**kwargs) -> None:
+    """
+    Создает полнотекстовый индекс после миграций: его вид зависит от базы, поэтому он не описан в модели
+    """
+    get_search_backend().create_index()
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 
-from backend.models import User, Category, Shop, ProductInfo, Product, ProductParameter, OrderItem, Order, Contact
+from backend.models import User, Category, Shop, ProductInfo, Product, ProductParameter, OrderItem, Order, Contact, \
+    ImportJob, ExportJob
 from backend.validators import validate_password
 
 
@@ -46,12 +47,21 @@ class ProductSerializer(serializers.ModelSerializer):
 
 
 class ProductParameterSerializer(serializers.ModelSerializer):
-    parameter = serializers.StringRelatedField()
+    parameter = serializers.SerializerMethodField()
 
     class Meta:
         model = ProductParameter
         fields = ('parameter', 'value',)
 
+    def get_parameter(self, obj: ProductParameter) -> str:
+        # имена параметров можно передать заранее из словарного кэша, чтобы не читать их из базы
+        parameter_names = self.context.get('parameter_names')
+
+        if parameter_names is None:
+            return str(obj.parameter)
+
+        return parameter_names[obj.parameter_id]
+
 
 class ProductInfoSerializer(serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
@@ -81,12 +91,11 @@ class OrderItemCreateSerializer(OrderItemSerializer):
 class OrderSerializer(serializers.ModelSerializer):
     ordered_items = OrderItemCreateSerializer(read_only=True, many=True)
 
-    total_sum = serializers.IntegerField()
     contact = ContactSerializer(read_only=True)
 
     class Meta:
         model = Order
-        fields = ('id', 'ordered_items', 'state', 'dt', 'total_sum', 'contact',)
+        fields = ('id', 'ordered_items', 'state', 'dt', 'total_sum', 'item_count', 'contact',)
         read_only_fields = ('id',)
 
 
@@ -153,6 +162,45 @@ class PartnerUpdateSerializer(serializers.Serializer):
     file = serializers.FileField(required=True)
 
 
+class ImportJobSerializer(serializers.ModelSerializer):
+    timings = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ImportJob
+        fields = ('id', 'file_name', 'state', 'rows_processed', 'timings', 'summary', 'error',
+                  'created_at', 'started_at', 'finished_at',)
+        read_only_fields = fields
+
+    @staticmethod
+    def get_timings(obj: ImportJob) -> dict:
+        return {
+            'parse': obj.parse_time,
+            'resolve': obj.resolve_time,
+            'write': obj.write_time,
+            'cleanup': obj.cleanup_time,
+        }
+
+
+class ExportJobSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = ExportJob
+        fields = ('id', 'state', 'updated_since', 'since_version', 'catalog_version', 'size', 'offers', 'error',
+                  'created_at', 'finished_at', 'expires_at',)
+        read_only_fields = fields
+
+
+class ExportJobCreateSerializer(serializers.Serializer):
+    updated_since = serializers.DateTimeField(required=False)
+    since_version = serializers.IntegerField(required=False, min_value=0)
+
+    def validate(self, attrs):
+        if 'updated_since' in attrs and 'since_version' in attrs:
+            raise serializers.ValidationError("Укажите либо updated_since, либо since_version")
+
+        return attrs
+
+
 class ContactCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Contact
@@ -167,21 +215,37 @@ class ShopCreateSerializer(serializers.ModelSerializer):
 
 
 class OrderItemsCreateSerializer(serializers.Serializer):
-    product_info = serializers.PrimaryKeyRelatedField(queryset=ProductInfo.objects.all())
-    quantity = serializers.IntegerField()
+    # существование позиций проверяется одним запросом в BasketCreateSerializer
+    product_info = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0)
     order = serializers.IntegerField()
 
 
 class OrderItemsUpdateSerializer(serializers.Serializer):
-    product_info = serializers.PrimaryKeyRelatedField(queryset=ProductInfo.objects.all())
-    quantity = serializers.IntegerField()
-    order = serializers.PrimaryKeyRelatedField(queryset=Order.objects.all())
-    id = serializers.PrimaryKeyRelatedField(queryset=OrderItem.objects.all())
+    # обновляется только quantity позиций корзины пользователя, остальные поля не используются
+    product_info = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0)
+    order = serializers.IntegerField()
+    id = serializers.IntegerField()
 
 
 class BasketCreateSerializer(serializers.Serializer):
     items = OrderItemsCreateSerializer(many=True)
 
+    def validate_items(self, items):
+        product_info_ids = {item['product_info'] for item in items}
+        existing_ids = set(ProductInfo.objects.filter(id__in=product_info_ids).values_list('id', flat=True))
+
+        if product_info_ids - existing_ids:
+            message = serializers.PrimaryKeyRelatedField.default_error_messages['does_not_exist']
+            raise serializers.ValidationError([
+                {} if item['product_info'] in existing_ids else
+                {'product_info': [message.format(pk_value=item['product_info'])]}
+                for item in items
+            ])
+
+        return items
+
 
 class BasketUpdateSerializer(serializers.Serializer):
     items = OrderItemsUpdateSerializer(many=True)
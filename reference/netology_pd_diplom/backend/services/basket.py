@@ -1,57 +1,189 @@
-from backend.models import Order, User, OrderItem
-
-from backend.serializers import OrderItemSerializer
-from django.db.models import Q
 from django.conf import settings
-
+from django.db import connection, transaction
+from django.db.models import Case, When, Value
+
+from backend.models import Order, User, OrderItem, ProductInfo
+from backend.services.basket_cache import BasketCache
+from backend.services.importer import chunked
+from backend.services.order_list import OrderListOperation, PRODUCT_INFO_FIELDS
+from backend.services.totals import update_order_totals
 from backend.tasks import send_email
 
 
+def get_basket_operation_class() -> type['BasketOperation']:
+    """
+    Если задан BASKET_CACHE, корзины хранятся в кэше, иначе - в базе
+    """
+    if settings.BASKET_CACHE:
+        return CacheBasketOperation
+
+    return BasketOperation
+
+
 class BasketOperation:
+    """
+    Изменение корзины за постоянное число запросов независимо от количества позиций.
+
+    Позиции добавляются одним INSERT ... ON CONFLICT по unique_order_item: количество
+    товара, который уже лежит в корзине, складывается с новым. Изменение количества -
+    один UPDATE с CASE, удаление - один DELETE. Существование товаров проверяет
+    BasketCreateSerializer одним запросом.
+    """
 
     def __init__(self, user: User, items: list):
         self.user = user
         self.items = items
 
-    def create(self):
-        order, _ = Order.objects.get_or_create(user_id=self.user.id, state='basket')
-        objects_created = 0
+    def get_basket_items(self):
+        return OrderItem.objects.filter(order__user_id=self.user.id, order__state='basket')
+
+    def list(self) -> list:
+        return OrderListOperation().list(Order.objects.filter(user_id=self.user.id, state='basket'))
+
+    def get_quantities(self) -> dict:
+        """
+        Количества добавляемых товаров, повторы одного товара складываются
+        """
+        quantities = {}
 
         for order_item in self.items:
-            order_item.update({'order': order.pk})
-            serializer = OrderItemSerializer(data=order_item)
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
-            objects_created += 1
-        order = Order.objects.get(id=order.pk)
+            product_info_id = int(order_item['product_info'])
+            quantities[product_info_id] = quantities.get(product_info_id, 0) + order_item['quantity']
+
+        return quantities
+
+    def create(self):
+        quantities = self.get_quantities()
+
+        with transaction.atomic():
+            order, _ = Order.objects.get_or_create(user_id=self.user.id, state='basket')
+            self.upsert_items(order.id, quantities)
+            Order.objects.filter(id=order.id, is_sent_notification=False).update(is_sent_notification=True)
+            update_order_totals([order.id])
+
         send_email.delay('Обновление статуса заказа', 'Заказ сформирован', [self.user.email])
 
-        if not order.is_sent_notification:
-            order.is_sent_notification = True
-            order.save()
+        return len(self.items)
+
+    @staticmethod
+    def upsert_items(order_id: int, quantities: dict) -> None:
+        table = OrderItem._meta.db_table
 
-        return objects_created
+        with connection.cursor() as cursor:
+            for chunk in chunked(quantities.items()):
+                cursor.execute(
+                    f'INSERT INTO {table} (order_id, product_info_id, quantity) '
+                    f'VALUES {", ".join(["(%s, %s, %s)"] * len(chunk))} '
+                    f'ON CONFLICT (order_id, product_info_id) '
+                    f'DO UPDATE SET quantity = {table}.quantity + EXCLUDED.quantity',
+                    [value for product_info_id, quantity in chunk for value in (order_id, product_info_id, quantity)]
+                )
 
     def update(self):
-        basket, _ = Order.objects.get_or_create(user_id=self.user.id, state='basket')
-        objects_updated = 0
+        quantities = {int(order_item['id']): order_item['quantity'] for order_item in self.items}
 
-        for order_item in self.items:
-            objects_updated += OrderItem.objects.filter(
-                order_id=basket.id, id=order_item['id']).update(quantity=order_item['quantity'])
+        if not quantities:
+            return 0
+
+        with transaction.atomic():
+            objects_updated = self.get_basket_items().filter(id__in=quantities).update(quantity=Case(
+                *(When(id=item_id, then=Value(quantity)) for item_id, quantity in quantities.items())))
+            update_order_totals(Order.objects.filter(user_id=self.user.id, state='basket'))
 
         return objects_updated
 
     def delete(self):
-        basket, _ = Order.objects.get_or_create(user_id=self.user.id, state='basket')
-        query = Q()
-        objects_deleted = False
+        if self.items:
+            with transaction.atomic():
+                deleted_count = self.get_basket_items().filter(id__in=self.items).delete()[0]
+                update_order_totals(Order.objects.filter(user_id=self.user.id, state='basket'))
 
-        for order_item_id in self.items:
-            query = query | Q(order_id=basket.id, id=order_item_id)
-            objects_deleted = True
+            return deleted_count
 
-        if objects_deleted:
-            deleted_count = OrderItem.objects.filter(query).delete()[0]
 
-            return deleted_count
+class CacheBasketOperation(BasketOperation):
+    """
+    Корзина в кэше (BasketCache): изменения не обращаются к базе, корзина записывается
+    в нее при оформлении заказа или задачей flush_baskets. Позиции такой корзины
+    идентифицируются id товара, а у корзины, еще не записанной в базу, id равен 0.
+    """
+
+    def __init__(self, user: User, items: list):
+        super().__init__(user, items)
+        self.basket_cache = BasketCache(user.id)
+
+    def list(self) -> list:
+        basket = self.basket_cache.get()
+
+        if not basket:
+            return []
+
+        operation = OrderListOperation()
+        rows = {row[0]: row for row in ProductInfo.objects.filter(
+            id__in=basket['items']).values_list(*PRODUCT_INFO_FIELDS)}
+        parameters = operation.fetch_parameters(set(rows))
+        ordered_items = [
+            {
+                'id': product_info_id,
+                'product_info': operation.product_info_to_representation(rows[product_info_id], parameters),
+                'quantity': quantity,
+            }
+            for product_info_id, quantity in basket['items'].items() if product_info_id in rows
+        ]
+
+        total_sum, item_count = operation.get_totals(ordered_items)
+
+        return [{
+            'id': basket['order_id'] or 0,
+            'ordered_items': ordered_items,
+            'state': 'basket',
+            'dt': operation.dt_field.to_representation(basket['dt']),
+            'total_sum': total_sum,
+            'item_count': item_count,
+            'contact': None,
+        }]
+
+    def create(self):
+        quantities = self.get_quantities()
+
+        with self.basket_cache.lock():
+            basket = self.basket_cache.get() or self.basket_cache.new()
+
+            for product_info_id, quantity in quantities.items():
+                basket['items'][product_info_id] = basket['items'].get(product_info_id, 0) + quantity
+
+            basket['is_sent_notification'] = True
+            self.basket_cache.save(basket)
+
+        send_email.delay('Обновление статуса заказа', 'Заказ сформирован', [self.user.email])
+
+        return len(self.items)
+
+    def update(self):
+        quantities = {int(order_item['id']): order_item['quantity'] for order_item in self.items}
+
+        with self.basket_cache.lock():
+            basket = self.basket_cache.get()
+            updated = [product_info_id for product_info_id in quantities if product_info_id in basket.get('items', {})]
+
+            if updated:
+                basket['items'].update({product_info_id: quantities[product_info_id] for product_info_id in updated})
+                self.basket_cache.save(basket)
+
+        return len(updated)
+
+    def delete(self):
+        if self.items:
+            item_ids = {int(item_id) for item_id in self.items}
+
+            with self.basket_cache.lock():
+                basket = self.basket_cache.get()
+                deleted = [product_info_id for product_info_id in basket.get('items', {}) if product_info_id in item_ids]
+
+                for product_info_id in deleted:
+                    del basket['items'][product_info_id]
+
+                if deleted:
+                    self.basket_cache.save(basket)
+
+            return len(deleted)
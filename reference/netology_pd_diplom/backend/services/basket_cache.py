@@ -0,0 +1,197 @@
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from django.db import transaction
+from django.utils import timezone
+
+from backend.models import Order, OrderItem, ProductInfo
+from backend.services.importer import chunked
+from backend.services.totals import update_order_totals
+
+LOCK_TIMEOUT = 5
+# сколько запрос ждет занятую корзину, секунд
+LOCK_WAIT = 2
+DIRTY_SEQUENCE_KEY = 'basket:dirty:seq'
+FLUSHED_SEQUENCE_KEY = 'basket:dirty:flushed'
+# удаляет ключ блокировки, только если в нем все еще токен владельца
+RELEASE_LOCK_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+
+class BasketLockError(Exception):
+    """
+    Корзину дольше LOCK_WAIT изменяет другой запрос
+    """
+
+    def __init__(self, user_id: int):
+        super().__init__('Корзина изменяется другим запросом, повторите попытку')
+        self.user_id = user_id
+
+
+def basket_cache_enabled() -> bool:
+    return bool(settings.BASKET_CACHE)
+
+
+class BasketCache:
+    """
+    Корзина пользователя в кэше BASKET_CACHE.
+
+    Корзина хранится словарем с позициями {id товара: количество}, пустой словарь
+    означает, что корзины нет. При промахе кэша корзина читается из базы.
+    В базу (Order со статусом basket и OrderItem) корзина записывается при оформлении
+    заказа и задачей flush_baskets (flush_dirty_baskets): при первом изменении после записи корзина получает
+    очередной номер в кэше, и задача записывает корзины с номерами после прошлого запуска.
+    """
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.key = f'basket:{user_id}'
+
+    @property
+    def cache(self):
+        return caches[settings.BASKET_CACHE]
+
+    @contextmanager
+    def lock(self):
+        """
+        Изменения одной корзины выполняются по очереди. Блокировка истекает через LOCK_TIMEOUT,
+        поэтому после падения процесса корзина не останется заблокированной. Ключ блокировки хранит
+        токен владельца: истекшая блокировка, которую уже взял другой запрос, не снимается.
+        Если блокировку не удалось взять за LOCK_WAIT, вызывает BasketLockError
+        """
+        key = f'{self.key}:lock'
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + LOCK_WAIT
+
+        while not self.cache.add(key, token, LOCK_TIMEOUT):
+            if time.monotonic() >= deadline:
+                raise BasketLockError(self.user_id)
+
+            time.sleep(0.01)
+
+        try:
+            yield
+        finally:
+            self.release_lock(key, token)
+
+    def release_lock(self, key: str, token: str) -> None:
+        if isinstance(self.cache, RedisCache):
+            # сравнение и удаление одной командой
+            cache_key = self.cache.make_and_validate_key(key)
+            client = self.cache._cache.get_client(cache_key, write=True)
+            client.eval(RELEASE_LOCK_SCRIPT, 1, cache_key, self.cache._cache._serializer.dumps(token))
+        elif self.cache.get(key) == token:
+            self.cache.delete(key)
+
+    def get(self) -> dict:
+        basket = self.cache.get(self.key)
+
+        if basket is None:
+            basket = self.load()
+            self.cache.set(self.key, basket, settings.BASKET_CACHE_TIMEOUT)
+
+        return basket
+
+    def load(self) -> dict:
+        order = Order.objects.filter(user_id=self.user_id, state='basket').values(
+            'id', 'dt', 'is_sent_notification').first()
+
+        if order is None:
+            return {}
+
+        return {
+            'order_id': order['id'],
+            'dt': order['dt'],
+            'is_sent_notification': order['is_sent_notification'],
+            'items': dict(OrderItem.objects.filter(order_id=order['id']).order_by('id').values_list(
+                'product_info_id', 'quantity')),
+            'dirty': False,
+        }
+
+    @staticmethod
+    def new() -> dict:
+        return {'order_id': None, 'dt': timezone.now(), 'is_sent_notification': False, 'items': {}, 'dirty': False}
+
+    def save(self, basket: dict) -> None:
+        if not basket['dirty']:
+            basket['dirty'] = True
+            self.register_dirty()
+
+        self.cache.set(self.key, basket, settings.BASKET_CACHE_TIMEOUT)
+
+    def register_dirty(self) -> None:
+        try:
+            number = self.cache.incr(DIRTY_SEQUENCE_KEY)
+        except ValueError:
+            self.cache.add(DIRTY_SEQUENCE_KEY, 0, None)
+            number = self.cache.incr(DIRTY_SEQUENCE_KEY)
+
+        self.cache.set(f'basket:dirty:{number}', self.user_id, settings.BASKET_CACHE_TIMEOUT)
+
+    def clear(self) -> None:
+        self.cache.set(self.key, {}, settings.BASKET_CACHE_TIMEOUT)
+
+    def materialize(self) -> int | None:
+        """
+        Записывает измененную корзину в базу и возвращает id заказа-корзины.
+        None - корзины в кэше нет, и база уже содержит актуальное состояние
+        """
+        with self.lock():
+            basket = self.cache.get(self.key)
+
+            if not basket:
+                return None
+
+            if basket['dirty']:
+                basket['order_id'] = self.write(basket)
+                basket['dirty'] = False
+                self.cache.set(self.key, basket, settings.BASKET_CACHE_TIMEOUT)
+
+            return basket['order_id']
+
+    def write(self, basket: dict) -> int:
+        with transaction.atomic():
+            order, _ = Order.objects.get_or_create(user_id=self.user_id, state='basket')
+            # товары, удаленные из каталога, пока корзина была в кэше, не записываются
+            product_info_ids = set(ProductInfo.objects.filter(id__in=basket['items']).values_list('id', flat=True))
+            OrderItem.objects.filter(order_id=order.id).exclude(product_info_id__in=product_info_ids).delete()
+            OrderItem.objects.bulk_create(
+                [OrderItem(order_id=order.id, product_info_id=product_info_id, quantity=quantity)
+                 for product_info_id, quantity in basket['items'].items() if product_info_id in product_info_ids],
+                update_conflicts=True, unique_fields=['order', 'product_info'], update_fields=['quantity']
+            )
+            Order.objects.filter(id=order.id).update(is_sent_notification=basket['is_sent_notification'])
+            update_order_totals([order.id])
+
+        return order.id
+
+
+def flush_dirty_baskets() -> int:
+    """
+    Записывает в базу корзины, измененные после прошлого запуска, и возвращает количество обработанных корзин
+    """
+    cache = caches[settings.BASKET_CACHE]
+    first = cache.get(FLUSHED_SEQUENCE_KEY, 0) + 1
+    last = cache.get(DIRTY_SEQUENCE_KEY, 0)
+    count = 0
+
+    for numbers in chunked(range(first, last + 1)):
+        keys = [f'basket:dirty:{number}' for number in numbers]
+
+        for user_id in set(cache.get_many(keys).values()):
+            basket_cache = BasketCache(user_id)
+
+            try:
+                count += basket_cache.materialize() is not None
+            except BasketLockError:
+                # корзина занята, она будет записана при следующем запуске
+                basket_cache.register_dirty()
+
+        cache.delete_many(keys)
+
+    cache.set(FLUSHED_SEQUENCE_KEY, last, None)
+
+    return count
@@ -0,0 +1,191 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, Prefetch
+from django.utils import timezone
+
+from backend.caching import catalog_version
+from backend.models import Shop, ProductInfo, ProductParameter, CatalogOffer, ParameterIndex, FacetCount
+from backend.serializers import ProductInfoSerializer
+from backend.services import dictionary
+from backend.services.facets import apply_facet_deltas, delete_offers, rebuild_facet_counts
+from backend.services.importer import BATCH_SIZE, chunked
+
+
+class CatalogOperation:
+    """
+    Обновление таблицы CatalogOffer - каталога предложений активных магазинов.
+
+    Документ предложения совпадает с выдачей ProductInfoSerializer. Предложения
+    магазина пересобираются в одной транзакции, поэтому читатели видят либо
+    старый, либо новый каталог магазина. Записываются только новые и изменившиеся
+    предложения, так что полнотекстовый индекс обновляется инкрементально;
+    предложения удаленных позиций удаляются каскадом вместе с ProductInfo.
+
+    Вместе с предложениями обновляется обратный индекс ParameterIndex, а счетчики
+    FacetCount изменяются только для значений переиндексированных и удаленных предложений.
+    """
+    fields = ('category_id', 'name', 'price', 'price_rrc', 'quantity', 'data', 'search_text')
+
+    def __init__(self, batch_size: int = BATCH_SIZE):
+        self.batch_size = batch_size
+
+    def refresh_shop(self, shop_id: int) -> int:
+        """
+        Пересобирает предложения магазина и возвращает их количество
+        """
+        with transaction.atomic():
+            if not Shop.objects.filter(id=shop_id, state=True).exists():
+                self.remove_shop(shop_id)
+                return 0
+
+            product_info_ids = list(
+                ProductInfo.objects.filter(shop_id=shop_id).order_by('id').values_list('id', flat=True))
+            # предложения позиций, перешедших в другой магазин
+            delete_offers(CatalogOffer.objects.filter(shop_id=shop_id).exclude(product_info__shop_id=shop_id))
+
+            for chunk in chunked(product_info_ids, self.batch_size):
+                self.write_offers(self.build_offers(chunk))
+
+        return len(product_info_ids)
+
+    def refresh_offers(self, product_info_ids) -> int:
+        """
+        Пересобирает уже опубликованные предложения отдельных позиций, например после
+        изменения остатков, и возвращает их количество
+        """
+        offer_ids = list(CatalogOffer.objects.filter(product_info_id__in=product_info_ids).order_by(
+            'product_info_id').values_list('product_info_id', flat=True))
+
+        with transaction.atomic():
+            for chunk in chunked(offer_ids, self.batch_size):
+                self.write_offers(self.build_offers(chunk))
+
+        return len(offer_ids)
+
+    def refresh_all(self) -> int:
+        count = sum(self.refresh_shop(shop_id) for shop_id in Shop.objects.values_list('id', flat=True))
+
+        # полная пересборка заодно исправляет счетчики, если они разошлись с индексом
+        with transaction.atomic():
+            rebuild_facet_counts()
+
+        return count
+
+    @staticmethod
+    def remove_shop(shop_id: int) -> None:
+        with transaction.atomic():
+            delete_offers(CatalogOffer.objects.filter(shop_id=shop_id))
+
+    @staticmethod
+    def get_facets(offers) -> dict:
+        """
+        Возвращает {имя параметра: {значение: количество предложений}} для выборки предложений.
+        Без фильтров счетчики берутся из FacetCount, иначе считаются по обратному индексу
+        только для отобранных предложений.
+        """
+        if offers.query.has_filters():
+            rows = list(
+                ParameterIndex.objects.filter(offer_id__in=offers.values('product_info_id'))
+                .values('parameter_id', 'value').annotate(count=Count('offer_id')).order_by()
+            )
+        else:
+            rows = list(FacetCount.objects.values('parameter_id', 'value', 'count'))
+
+        names = dictionary.parameters.get_keys({row['parameter_id'] for row in rows})
+        facets = {}
+
+        for row in sorted(rows, key=lambda row: (names[row['parameter_id']], -row['count'], row['value'])):
+            facets.setdefault(names[row['parameter_id']], {})[row['value']] = row['count']
+
+        return facets
+
+    def write_offers(self, offers: list) -> None:
+        existing = {
+            offer['product_info_id']: offer
+            for offer in CatalogOffer.objects.filter(
+                product_info_id__in=[offer.product_info_id for offer in offers]
+            ).values('product_info_id', 'shop_id', *self.fields)
+        }
+        created = [offer for offer in offers if offer.product_info_id not in existing]
+        updated = [
+            offer for offer in offers
+            if offer.product_info_id in existing and any(
+                getattr(offer, field) != existing[offer.product_info_id][field] for field in ('shop_id', *self.fields))
+        ]
+
+        # отметки для инкрементальной выгрузки: время и версия каталога, при которой предложение изменилось
+        updated_at, version = timezone.now(), catalog_version.get()
+
+        for offer in created + updated:
+            offer.updated_at, offer.version = updated_at, version
+
+        CatalogOffer.objects.bulk_create(created, batch_size=self.batch_size)
+        CatalogOffer.objects.bulk_update(
+            updated, ('shop_id', *self.fields, 'updated_at', 'version'), batch_size=self.batch_size)
+
+        # индекс сверяется отдельно: число параметра может измениться без изменения документа
+        entries = {}
+
+        for offer_id, *entry in ParameterIndex.objects.filter(
+                offer_id__in=[offer.product_info_id for offer in offers if offer.product_info_id in existing]
+        ).values_list('offer_id', 'parameter_id', 'value', 'numeric_value'):
+            entries.setdefault(offer_id, set()).add(tuple(entry))
+
+        reindexed = [
+            offer for offer in offers
+            if offer.product_info_id not in existing
+            or entries.get(offer.product_info_id, set()) != set(offer.parameters)
+        ]
+        deltas = Counter()
+
+        for offer in reindexed:
+            deltas.subtract((parameter_id, value) for parameter_id, value, _ in entries.get(offer.product_info_id, ()))
+            deltas.update((parameter_id, value) for parameter_id, value, _ in offer.parameters)
+
+        ParameterIndex.objects.filter(
+            offer_id__in=[offer.product_info_id for offer in reindexed if offer.product_info_id in existing]).delete()
+        ParameterIndex.objects.bulk_create(
+            [ParameterIndex(offer_id=offer.product_info_id, parameter_id=parameter_id, value=value,
+                            numeric_value=numeric_value)
+             for offer in reindexed for parameter_id, value, numeric_value in offer.parameters],
+            batch_size=self.batch_size
+        )
+        apply_facet_deltas(deltas)
+
+    @staticmethod
+    def build_offers(product_info_ids: list) -> list:
+        product_infos = list(
+            ProductInfo.objects.filter(id__in=product_info_ids).order_by('id')
+            .select_related('product__category')
+            .prefetch_related(Prefetch('product_parameters', queryset=ProductParameter.objects.order_by('id')))
+        )
+        parameter_names = dictionary.parameters.get_keys({
+            product_parameter.parameter_id
+            for product_info in product_infos
+            for product_parameter in product_info.product_parameters.all()
+        })
+        documents = ProductInfoSerializer(product_infos, many=True, context={'parameter_names': parameter_names}).data
+
+        offers = []
+
+        for product_info, document in zip(product_infos, documents):
+            product_parameters = product_info.product_parameters.all()
+            offer = CatalogOffer(
+                product_info_id=product_info.id, shop_id=product_info.shop_id,
+                category_id=product_info.product.category_id, name=product_info.product.name,
+                price=product_info.price, price_rrc=product_info.price_rrc, quantity=product_info.quantity,
+                data=document,
+                search_text=' '.join([
+                    product_info.product.name, product_info.model,
+                    *(product_parameter.value for product_parameter in product_parameters)
+                ]).lower()
+            )
+            # (id параметра, значение, число) для обратного индекса
+            offer.parameters = [
+                (product_parameter.parameter_id, product_parameter.value, product_parameter.numeric_value)
+                for product_parameter in product_parameters
+            ]
+            offers.append(offer)
+
+        return offers
@@ -0,0 +1,222 @@
+import csv
+import io
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from backend.models import Product, ProductInfo, ProductParameter, Parameter, CatalogOffer
+from backend.services.facets import delete_offers
+from backend.services.importer import ImportOperation, chunked, parse_parameter_value
+
+STAGING_TABLES = ('import_goods', 'import_parameters', 'import_values', 'import_changes')
+# временные таблицы удаляются только из схемы сеанса, а не одноименные постоянные
+STAGING_TABLE_NAMES = ', '.join(f'pg_temp.{table}' for table in STAGING_TABLES)
+
+
+def get_import_operation_class() -> type[ImportOperation]:
+    """
+    На PostgreSQL импорт идет через COPY во временные таблицы, на остальных базах - через bulk_create
+    """
+    if settings.IMPORT_USE_COPY and connection.vendor == 'postgresql':
+        return CopyImportOperation
+
+    return ImportOperation
+
+
+class CopyImportOperation(ImportOperation):
+    """
+    Импорт прайс-листа для PostgreSQL.
+
+    Товары и параметры потоком загружаются командой COPY FROM STDIN во временные
+    таблицы, после чего продукты, позиции и значения параметров сливаются
+    с основными таблицами несколькими множественными запросами. Как и в
+    ImportOperation, пишутся только изменившиеся строки.
+    """
+
+    def run(self, shop_name: str, categories: list, goods) -> dict:
+        with transaction.atomic(), connection.cursor() as cursor:
+            self.prepare(shop_name, categories)
+            self.create_staging_tables(cursor)
+            chunks = chunked(goods, self.batch_size)
+
+            while True:
+                with self.tracker.measure('parse'):
+                    chunk = next(chunks, None)
+
+                if chunk is None:
+                    break
+
+                with self.tracker.measure('write'):
+                    self.copy_goods(cursor, chunk)
+
+                self.tracker.add_rows(len(chunk))
+
+            with self.tracker.measure('resolve'):
+                self.resolve_staged(cursor)
+
+            with self.tracker.measure('write'):
+                self.merge_staged(cursor)
+
+            with self.tracker.measure('cleanup'):
+                self.delete_staged_missing(cursor)
+                cursor.execute(f'DROP TABLE IF EXISTS {STAGING_TABLE_NAMES}')
+
+        return self.summary
+
+    @staticmethod
+    def create_staging_tables(cursor) -> None:
+        cursor.execute(f'DROP TABLE IF EXISTS {STAGING_TABLE_NAMES}')
+        cursor.execute(
+            'CREATE TEMP TABLE import_goods (external_id bigint, category_id bigint, name text, model text, '
+            'price bigint, price_rrc bigint, quantity bigint, product_id bigint) ON COMMIT DROP'
+        )
+        cursor.execute(
+            'CREATE TEMP TABLE import_parameters (external_id bigint, name text, value text, '
+            'numeric_value double precision, unit text) ON COMMIT DROP'
+        )
+        cursor.execute('CREATE TEMP TABLE import_changes (product_info_id bigint, created boolean) ON COMMIT DROP')
+
+    def copy_goods(self, cursor, goods: list) -> None:
+        goods_buffer, parameters_buffer = io.StringIO(), io.StringIO()
+        # строки всегда в кавычках: пустая строка без кавычек в CSV означает NULL
+        goods_writer = csv.writer(goods_buffer, quoting=csv.QUOTE_NONNUMERIC)
+        parameters_writer = csv.writer(parameters_buffer, quoting=csv.QUOTE_NONNUMERIC)
+
+        for item in goods:
+            goods_writer.writerow((item['id'], item['category'], str(item['name']), str(item['model']),
+                                   item['price'], item['price_rrc'], item['quantity']))
+
+            for name, value in item['parameters'].items():
+                parameters_writer.writerow((item['id'], str(name), *parse_parameter_value(str(name), value)))
+
+        self.copy(cursor, 'COPY import_goods (external_id, category_id, name, model, price, price_rrc, quantity) '
+                          'FROM STDIN WITH (FORMAT csv)', goods_buffer)
+        # None у нечислового значения пишется как "", FORCE_NULL превращает его в NULL
+        self.copy(cursor, 'COPY import_parameters (external_id, name, value, numeric_value, unit) '
+                          'FROM STDIN WITH (FORMAT csv, FORCE_NULL (numeric_value))', parameters_buffer)
+
+    @staticmethod
+    def copy(cursor, sql: str, buffer: io.StringIO) -> None:
+        buffer.seek(0)
+
+        if hasattr(cursor.cursor, 'copy_expert'):
+            cursor.cursor.copy_expert(sql, buffer)
+        else:
+            with cursor.cursor.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+
+    @staticmethod
+    def tables() -> dict:
+        return {
+            'product': connection.ops.quote_name(Product._meta.db_table),
+            'product_info': connection.ops.quote_name(ProductInfo._meta.db_table),
+            'parameter': connection.ops.quote_name(Parameter._meta.db_table),
+            'product_parameter': connection.ops.quote_name(ProductParameter._meta.db_table),
+        }
+
+    def resolve_staged(self, cursor) -> None:
+        """
+        Создает недостающие имена параметров и продукты и проставляет id продуктов в import_goods
+        """
+        tables = self.tables()
+        cursor.execute('CREATE INDEX ON import_goods (external_id)')
+        cursor.execute('ANALYZE import_goods')
+        cursor.execute('ANALYZE import_parameters')
+        cursor.execute(
+            f'INSERT INTO {tables["parameter"]} (name) '
+            f'SELECT DISTINCT s.name FROM import_parameters s '
+            f'WHERE NOT EXISTS (SELECT 1 FROM {tables["parameter"]} p WHERE p.name = s.name)'
+        )
+        cursor.execute(
+            f'INSERT INTO {tables["product"]} (name, category_id) '
+            f'SELECT DISTINCT s.name, s.category_id FROM import_goods s '
+            f'WHERE NOT EXISTS (SELECT 1 FROM {tables["product"]} p '
+            f'WHERE p.name = s.name AND p.category_id = s.category_id)'
+        )
+        cursor.execute(
+            f'UPDATE import_goods s SET product_id = p.id '
+            f'FROM (SELECT MIN(id) AS id, name, category_id FROM {tables["product"]} '
+            f'WHERE (name, category_id) IN (SELECT name, category_id FROM import_goods) '
+            f'GROUP BY name, category_id) p '
+            f'WHERE p.name = s.name AND p.category_id = s.category_id'
+        )
+
+    def merge_staged(self, cursor) -> None:
+        tables = self.tables()
+        params = {'shop_id': self.shop.id}
+
+        cursor.execute(
+            f'WITH changed AS ('
+            f'UPDATE {tables["product_info"]} pi SET product_id = s.product_id, model = s.model, price = s.price, '
+            f'price_rrc = s.price_rrc, quantity = s.quantity FROM import_goods s '
+            f'WHERE pi.shop_id = %(shop_id)s AND pi.external_id = s.external_id '
+            f'AND (pi.product_id, pi.model, pi.price, pi.price_rrc, pi.quantity) IS DISTINCT FROM '
+            f'(s.product_id, s.model, s.price, s.price_rrc, s.quantity) RETURNING pi.id) '
+            f'INSERT INTO import_changes SELECT id, false FROM changed', params
+        )
+        cursor.execute(
+            f'WITH created AS ('
+            f'INSERT INTO {tables["product_info"]} (product_id, shop_id, external_id, model, price, price_rrc, quantity) '
+            f'SELECT s.product_id, %(shop_id)s, s.external_id, s.model, s.price, s.price_rrc, s.quantity '
+            f'FROM import_goods s WHERE NOT EXISTS (SELECT 1 FROM {tables["product_info"]} pi '
+            f'WHERE pi.shop_id = %(shop_id)s AND pi.external_id = s.external_id) RETURNING id) '
+            f'INSERT INTO import_changes SELECT id, true FROM created', params
+        )
+        cursor.execute(
+            f'CREATE TEMP TABLE import_values ON COMMIT DROP AS '
+            f'SELECT pi.id AS product_info_id, p.id AS parameter_id, s.value, s.numeric_value, s.unit '
+            f'FROM import_parameters s '
+            f'JOIN {tables["product_info"]} pi ON pi.shop_id = %(shop_id)s AND pi.external_id = s.external_id '
+            # имя параметра не уникально: при дублях берется меньший id, как и для продуктов
+            f'JOIN (SELECT MIN(id) AS id, name FROM {tables["parameter"]} '
+            f'WHERE name IN (SELECT name FROM import_parameters) GROUP BY name) p ON p.name = s.name', params
+        )
+        cursor.execute(
+            f'WITH removed AS ('
+            f'DELETE FROM {tables["product_parameter"]} pp USING {tables["product_info"]} pi '
+            f'WHERE pp.product_info_id = pi.id AND pi.shop_id = %(shop_id)s '
+            f'AND EXISTS (SELECT 1 FROM import_goods s WHERE s.external_id = pi.external_id) '
+            f'AND NOT EXISTS (SELECT 1 FROM import_values v '
+            f'WHERE v.product_info_id = pp.product_info_id AND v.parameter_id = pp.parameter_id) '
+            f'RETURNING pp.product_info_id) '
+            f'INSERT INTO import_changes SELECT product_info_id, false FROM removed', params
+        )
+        cursor.execute(
+            f'WITH upserted AS ('
+            f'INSERT INTO {tables["product_parameter"]} AS pp (product_info_id, parameter_id, value, numeric_value, unit) '
+            f'SELECT product_info_id, parameter_id, value, numeric_value, unit FROM import_values '
+            f'ON CONFLICT (product_info_id, parameter_id) DO UPDATE SET value = EXCLUDED.value, '
+            f'numeric_value = EXCLUDED.numeric_value, unit = EXCLUDED.unit '
+            f'WHERE (pp.value, pp.numeric_value, pp.unit) IS DISTINCT FROM '
+            f'(EXCLUDED.value, EXCLUDED.numeric_value, EXCLUDED.unit) RETURNING pp.product_info_id) '
+            f'INSERT INTO import_changes SELECT product_info_id, false FROM upserted'
+        )
+
+        cursor.execute(
+            'SELECT COUNT(*) FILTER (WHERE created), COUNT(*) FILTER (WHERE NOT created) '
+            'FROM (SELECT product_info_id, bool_or(created) AS created FROM import_changes '
+            'GROUP BY product_info_id) c'
+        )
+        created, updated = cursor.fetchone()
+        cursor.execute('SELECT COUNT(*) FROM import_goods')
+        total, = cursor.fetchone()
+
+        self.summary.update(created=created, updated=updated, unchanged=total - created - updated)
+
+    def delete_staged_missing(self, cursor) -> None:
+        """
+        Удаляет позиции, которых нет в прайс-листе, через ORM, чтобы сработали каскадные удаления
+        """
+        cursor.execute(
+            f'SELECT pi.id FROM {self.tables()["product_info"]} pi WHERE pi.shop_id = %s '
+            f'AND NOT EXISTS (SELECT 1 FROM import_goods s WHERE s.external_id = pi.external_id)',
+            [self.shop.id]
+        )
+        missing = [product_info_id for product_info_id, in cursor.fetchall()]
+
+        for chunk in chunked(missing, self.batch_size):
+            # предложения удаляются отдельно, чтобы вычесть их из счетчиков фасетов
+            delete_offers(CatalogOffer.objects.filter(product_info_id__in=chunk))
+            ProductInfo.objects.filter(id__in=chunk).delete()
+
+        self.summary['deleted'] = len(missing)
@@ -0,0 +1,166 @@
+import threading
+from collections import OrderedDict
+from typing import Iterable
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from backend.models import Category, Parameter, Product
+
+
+class DictionaryCache:
+    """
+    Кэш справочника в памяти процесса: ключ (значения fields) <-> id записи.
+
+    Размер ограничен, вытесняются давно не использованные записи (LRU).
+    Версия справочника хранится в общем кэше: invalidate увеличивает ее,
+    и все процессы сбрасывают свои копии при следующем обращении. Отсутствующие
+    в базе ключи не кэшируются, поэтому новые записи не требуют сброса -
+    только переименование и удаление.
+    """
+
+    def __init__(self, model, fields: tuple, max_size: int = None):
+        self.model = model
+        self.fields = fields
+        self.max_size = max_size or settings.DICTIONARY_CACHE_SIZE
+        self.ids = OrderedDict()
+        self.keys = OrderedDict()
+        self.version = None
+        self.lock = threading.Lock()
+
+    @property
+    def version_key(self) -> str:
+        return f'dictionary:{self.model._meta.label_lower}:version'
+
+    def get_ids(self, keys: Iterable) -> dict:
+        """
+        Возвращает словарь ключ -> id для ключей, которые есть в базе
+        """
+        self.sync()
+        found, missing = self.lookup(self.ids, keys)
+
+        if missing:
+            fetched = self.fetch(missing)
+            self.remember_on_commit(fetched)
+            found.update(fetched)
+
+        return found
+
+    def get_keys(self, ids: Iterable) -> dict:
+        """
+        Возвращает словарь id -> ключ для id, которые есть в базе
+        """
+        self.sync()
+        found, missing = self.lookup(self.keys, ids)
+
+        if missing:
+            fetched = {
+                row[0]: self.make_key(row[1:])
+                for row in self.model.objects.filter(id__in=missing).values_list('id', *self.fields)
+            }
+            self.remember_on_commit({key: object_id for object_id, key in fetched.items()})
+            found.update(fetched)
+
+        return found
+
+    def resolve(self, keys: Iterable, batch_size: int = None) -> dict:
+        """
+        Как get_ids, но недостающие записи создаются
+        """
+        keys = set(keys)
+        found = self.get_ids(keys)
+        missing = keys - found.keys()
+
+        if missing:
+            self.model.objects.bulk_create(
+                [self.model(**dict(zip(self.fields, self.split_key(key)))) for key in missing],
+                batch_size=batch_size
+            )
+            created = self.fetch(missing)
+            self.remember_on_commit(created)
+            found.update(created)
+
+        return found
+
+    def remember_on_commit(self, pairs: dict) -> None:
+        """
+        Записи, прочитанные или созданные внутри транзакции, попадают в кэш
+        только после ее фиксации, чтобы откат не оставил в кэше чужие id
+        """
+        transaction.on_commit(lambda: self.remember(pairs))
+
+    def remember(self, pairs: dict) -> None:
+        with self.lock:
+            for key, object_id in pairs.items():
+                self.store(self.ids, key, object_id)
+                self.store(self.keys, object_id, key)
+
+    def store(self, entries: OrderedDict, key, value) -> None:
+        entries[key] = value
+        entries.move_to_end(key)
+
+        while len(entries) > self.max_size:
+            entries.popitem(last=False)
+
+    def lookup(self, entries: OrderedDict, keys: Iterable) -> tuple[dict, set]:
+        found, missing = {}, set()
+
+        with self.lock:
+            for key in keys:
+                if key in entries:
+                    entries.move_to_end(key)
+                    found[key] = entries[key]
+                else:
+                    missing.add(key)
+
+        return found, missing
+
+    def fetch(self, keys: set) -> dict:
+        """
+        Читает id по ключам; при дублях ключа берется запись с меньшим id
+        """
+        filters = {
+            f'{field}__in': {self.split_key(key)[index] for key in keys}
+            for index, field in enumerate(self.fields)
+        }
+        found = {}
+
+        for row in self.model.objects.filter(**filters).order_by('id').values_list('id', *self.fields):
+            key = self.make_key(row[1:])
+
+            if key in keys:
+                found.setdefault(key, row[0])
+
+        return found
+
+    def make_key(self, values: tuple):
+        return values if len(self.fields) > 1 else values[0]
+
+    def split_key(self, key) -> tuple:
+        return key if len(self.fields) > 1 else (key,)
+
+    def sync(self) -> None:
+        version = cache.get(self.version_key)
+
+        if version != self.version:
+            self.clear()
+            self.version = version
+
+    def invalidate(self) -> None:
+        try:
+            cache.incr(self.version_key)
+        except ValueError:
+            cache.set(self.version_key, 1, None)
+
+        self.clear()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.ids.clear()
+            self.keys.clear()
+
+
+categories = DictionaryCache(Category, ('name',))
+parameters = DictionaryCache(Parameter, ('name',))
+products = DictionaryCache(Product, ('name', 'category_id'))
@@ -0,0 +1,184 @@
+import json
+import zipfile
+from datetime import datetime
+from typing import Iterable, Iterator
+
+from django.conf import settings
+from django.utils import timezone
+
+from backend.models import Shop, Category, Product, ProductInfo, ProductParameter, CatalogOffer, ExportJob
+from backend.services import dictionary
+from backend.services.importer import BATCH_SIZE, chunked
+from backend.services.staging import UploadStorage
+
+
+class ZipStream:
+    """
+    Файл только для записи, из которого потоковый ответ забирает накопленные байты.
+    Без seek zipfile пишет размеры записей в дескрипторы после данных.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class ExportOperation:
+    """
+    Потоковая выгрузка каталога в zip-архив с файлами products.json, shops.json и categories.json.
+
+    Продукты читаются пачками по batch_size через iterator(), к каждой пачке
+    двумя запросами подгружаются позиции и параметры. JSON кодируется по пачкам
+    и сразу пишется в запись архива, поэтому память не зависит от размера каталога,
+    а первые байты уходят клиенту до чтения всего каталога.
+    """
+
+    compression = zipfile.ZIP_STORED
+
+    def __init__(self, batch_size: int = BATCH_SIZE):
+        self.batch_size = batch_size
+
+    def get_entries(self) -> list:
+        """
+        Возвращает пары (имя файла в архиве, элементы списка)
+        """
+        return [
+            ('products.json', self.iter_products()),
+            ('shops.json', Shop.objects.values().iterator(chunk_size=self.batch_size)),
+            ('categories.json', Category.objects.values().iterator(chunk_size=self.batch_size)),
+        ]
+
+    def stream(self) -> Iterator[bytes]:
+        buffer = ZipStream()
+
+        with zipfile.ZipFile(buffer, 'w', compression=self.compression) as archive:
+            for name, items in self.get_entries():
+                with archive.open(name, 'w', force_zip64=True) as entry:
+                    for data in self.encode_list(items):
+                        entry.write(data)
+                        yield buffer.drain()
+
+        # центральный каталог архива
+        yield buffer.drain()
+
+    def encode_list(self, items: Iterable[dict]) -> Iterator[bytes]:
+        """
+        Кодирует список так же, как json.dumps(items, ensure_ascii=False), по пачкам элементов
+        """
+        separator = '['
+
+        for chunk in chunked(items, self.batch_size):
+            yield (separator + ', '.join(json.dumps(item, ensure_ascii=False) for item in chunk)).encode()
+            separator = ', '
+
+        yield b'[]' if separator == '[' else b']'
+
+    def iter_products(self) -> Iterator[dict]:
+        products = Product.objects.order_by('id').values_list('id', 'name', 'category__name')
+
+        for chunk in chunked(products.iterator(chunk_size=self.batch_size), self.batch_size):
+            product_infos = self.fetch_product_infos([product_id for product_id, _, _ in chunk])
+
+            for product_id, name, category in chunk:
+                yield {'name': name, 'category': category, 'product_infos': product_infos.get(product_id, [])}
+
+    @staticmethod
+    def fetch_product_infos(product_ids: list) -> dict:
+        """
+        Возвращает словарь id продукта -> список позиций с параметрами
+        """
+        rows = list(ProductInfo.objects.filter(product_id__in=product_ids).order_by('id').values_list(
+            'id', 'product_id', 'model', 'external_id', 'shop__name', 'quantity', 'price', 'price_rrc'))
+        parameter_rows = list(ProductParameter.objects.filter(
+            product_info_id__in=[row[0] for row in rows]).order_by('id').values_list(
+            'product_info_id', 'parameter_id', 'value'))
+        names = dictionary.parameters.get_keys({parameter_id for _, parameter_id, _ in parameter_rows})
+        parameters = {}
+
+        for product_info_id, parameter_id, value in parameter_rows:
+            parameters.setdefault(product_info_id, []).append({'parameter_name': names[parameter_id], 'value': value})
+
+        product_infos = {}
+
+        for product_info_id, product_id, model, external_id, shop_name, quantity, price, price_rrc in rows:
+            product_infos.setdefault(product_id, []).append({
+                'model': model,
+                'external_id': external_id,
+                'shop_name': shop_name,
+                'quantity': quantity,
+                'price': price,
+                'price_rrc': price_rrc,
+                'product_parameters': parameters.get(product_info_id, []),
+            })
+
+        return product_infos
+
+
+class OfferExportOperation(ExportOperation):
+    """
+    Выгрузка каталога предложений для синхронизации.
+
+    offers.json содержит документы предложений в том же виде, что и /products;
+    при заданных updated_since или since_version - только предложения, измененные
+    после отметки. offer_ids.json всегда содержит id всех предложений каталога,
+    чтобы клиент мог удалить у себя остальные.
+    """
+    compression = zipfile.ZIP_DEFLATED
+
+    def __init__(self, updated_since: datetime = None, since_version: int = None, batch_size: int = BATCH_SIZE):
+        super().__init__(batch_size)
+        self.updated_since = updated_since
+        self.since_version = since_version
+        self.offer_count = 0
+
+    def get_entries(self) -> list:
+        return [
+            ('offers.json', self.iter_offers()),
+            ('offer_ids.json', CatalogOffer.objects.order_by('product_info_id').values_list(
+                'product_info_id', flat=True).iterator(chunk_size=self.batch_size)),
+            *super().get_entries()[1:],
+        ]
+
+    def iter_offers(self) -> Iterator[dict]:
+        offers = CatalogOffer.objects.order_by('product_info_id')
+
+        if self.updated_since is not None:
+            offers = offers.filter(updated_at__gte=self.updated_since)
+
+        if self.since_version is not None:
+            offers = offers.filter(version__gte=self.since_version)
+
+        for document in offers.values_list('data', flat=True).iterator(chunk_size=self.batch_size):
+            self.offer_count += 1
+            yield document
+
+
+def delete_expired_exports() -> int:
+    """
+    Удаляет архивы выгрузок с истекшим сроком хранения и возвращает их количество
+    """
+    storage = UploadStorage(settings.EXPORT_ROOT)
+    jobs = list(ExportJob.objects.filter(state='done', expires_at__lte=timezone.now()).values_list('id', 'file_name'))
+
+    for job_id, file_name in jobs:
+        storage.delete(file_name)
+
+    ExportJob.objects.filter(id__in=[job_id for job_id, _ in jobs]).update(state='expired', file_name='')
+
+    return len(jobs)
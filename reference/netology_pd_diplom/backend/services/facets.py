@@ -0,0 +1,85 @@
+from collections import Counter
+
+from django.db import connection
+from django.db.models import Count
+
+from backend.models import CatalogOffer, ParameterIndex, FacetCount
+
+BATCH_SIZE = 1000
+
+
+def apply_facet_deltas(deltas: Counter) -> None:
+    """
+    Применяет изменения счетчиков FacetCount {(id параметра, значение): изменение}.
+
+    Затрагиваются только строки переданных значений: новые добавляются через
+    INSERT ... ON CONFLICT, уменьшенные до нуля удаляются. На PostgreSQL строки
+    сначала блокируются в порядке ключа, чтобы параллельные обновления каталога
+    разных магазинов не попадали во взаимную блокировку на общих значениях.
+    """
+    table = connection.ops.quote_name(FacetCount._meta.db_table)
+    pairs = sorted(pair for pair, delta in deltas.items() if delta)
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(pairs), BATCH_SIZE):
+            chunk = pairs[start:start + BATCH_SIZE]
+            params = [value for pair in chunk for value in (*pair, deltas[pair])]
+            delta = f'WITH delta (parameter_id, value, count) AS (VALUES {", ".join(["(%s, %s, %s)"] * len(chunk))}) '
+            in_delta = '(parameter_id, value) IN (SELECT parameter_id, value FROM delta'
+            current_delta = (f'(SELECT d.count FROM delta d '
+                             f'WHERE d.parameter_id = {table}.parameter_id AND d.value = {table}.value)')
+
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    f'{delta}SELECT 1 FROM {table} WHERE {in_delta}) ORDER BY parameter_id, value FOR UPDATE', params)
+
+            cursor.execute(
+                f'{delta}INSERT INTO {table} (parameter_id, value, count) '
+                f'SELECT parameter_id, value, count FROM delta WHERE count > 0 '
+                f'ON CONFLICT (parameter_id, value) DO UPDATE SET count = {table}.count + EXCLUDED.count', params
+            )
+            # уменьшение не через ON CONFLICT: отрицательная вставляемая строка нарушила бы проверку count >= 0
+            cursor.execute(
+                f'{delta}UPDATE {table} SET count = CASE WHEN count + {current_delta} > 0 '
+                f'THEN count + {current_delta} ELSE 0 END WHERE {in_delta} WHERE count < 0)', params
+            )
+            cursor.execute(f'{delta}DELETE FROM {table} WHERE count = 0 AND {in_delta})', params)
+
+
+def get_index_counts(offers) -> Counter:
+    """
+    Количество записей обратного индекса по (id параметра, значение) для выборки предложений
+    """
+    return Counter({
+        (row['parameter_id'], row['value']): row['count']
+        for row in ParameterIndex.objects.filter(offer_id__in=offers.values('product_info_id'))
+        .values('parameter_id', 'value').annotate(count=Count('offer_id')).order_by()
+    })
+
+
+def delete_offers(offers) -> int:
+    """
+    Удаляет предложения вместе с их записями индекса и вычитает их из FacetCount.
+    Вызывается и перед удалением ProductInfo, которое удалило бы предложения каскадом
+    """
+    deltas = Counter()
+    deltas.subtract(get_index_counts(offers))
+    count = offers.delete()[1].get(CatalogOffer._meta.label, 0)
+    apply_facet_deltas(deltas)
+    return count
+
+
+def rebuild_facet_counts() -> None:
+    """
+    Полностью пересчитывает FacetCount по обратному индексу
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f'LOCK TABLE {FacetCount._meta.db_table} IN SHARE ROW EXCLUSIVE MODE')
+
+    FacetCount.objects.all().delete()
+    counts = ParameterIndex.objects.values('parameter_id', 'value').annotate(count=Count('offer_id')).order_by()
+    rows = list(counts)
+
+    for start in range(0, len(rows), BATCH_SIZE):
+        FacetCount.objects.bulk_create([FacetCount(**row) for row in rows[start:start + BATCH_SIZE]])
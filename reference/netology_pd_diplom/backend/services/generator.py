@@ -0,0 +1,91 @@
+import json
+import random
+from typing import Iterator, TextIO
+
+COLORS = ('черный', 'белый', 'серебристый', 'золотистый', 'красный', 'синий', 'зеленый', 'розовый')
+
+
+def generate_catalog(goods: int, categories: int = 10, parameters: int = 8, values: int = 20,
+                     parameters_per_good: int = 4, shop: str = 'Бенчмарк', seed: int = 0) -> tuple[dict, Iterator[dict]]:
+    """
+    Генерирует синтетический прайс-лист: заголовок и ленивый итератор товаров.
+
+    parameters - количество разных имен параметров, values - количество
+    разных значений каждого параметра, parameters_per_good - сколько
+    параметров у одного товара.
+    """
+    header = {
+        'shop': shop,
+        'categories': [{'id': 1000 + number, 'name': f'Категория {number}'} for number in range(categories)],
+    }
+
+    def iterate_goods():
+        generator = random.Random(seed)
+        names = [f'Параметр {number}' for number in range(parameters)]
+
+        for number in range(goods):
+            price = generator.randrange(500, 200000, 10)
+            item_parameters = {}
+
+            for name in generator.sample(names, min(parameters_per_good, parameters)):
+                value = generator.randrange(values)
+                item_parameters[name] = COLORS[value % len(COLORS)] if value % 3 == 0 else value * 16
+
+            yield {
+                'id': 1000000 + number,
+                'category': header['categories'][number % categories]['id'],
+                'model': f'model/{number % 997}/{number}',
+                'name': f'Товар {number} ({COLORS[number % len(COLORS)]})',
+                'price': price,
+                'price_rrc': price + price // 10,
+                'quantity': generator.randrange(0, 100),
+                'parameters': item_parameters,
+            }
+
+    return header, iterate_goods()
+
+
+def write_catalog(stream: TextIO, header: dict, goods: Iterator[dict], file_format: str = 'yaml') -> None:
+    """
+    Пишет прайс-лист потоком в формате yaml, json или ndjson
+    """
+    def dumps(value) -> str:
+        return json.dumps(value, ensure_ascii=False)
+
+    if file_format == 'ndjson':
+        stream.write(dumps(header) + '\n')
+
+        for item in goods:
+            stream.write(dumps(item) + '\n')
+
+    elif file_format == 'json':
+        stream.write(dumps(header)[:-1] + ', "goods": [')
+
+        for number, item in enumerate(goods):
+            stream.write((',\n' if number else '\n') + dumps(item))
+
+        stream.write('\n]}\n')
+
+    else:
+        # строки JSON являются корректными скалярами YAML в двойных кавычках
+        stream.write(f'shop: {dumps(header["shop"])}\ncategories:\n')
+
+        for category in header['categories']:
+            stream.write(f'  - id: {category["id"]}\n    name: {dumps(category["name"])}\n')
+
+        stream.write('\ngoods:\n')
+
+        for item in goods:
+            stream.write(
+                f'  - id: {item["id"]}\n'
+                f'    category: {item["category"]}\n'
+                f'    model: {dumps(item["model"])}\n'
+                f'    name: {dumps(item["name"])}\n'
+                f'    price: {item["price"]}\n'
+                f'    price_rrc: {item["price_rrc"]}\n'
+                f'    quantity: {item["quantity"]}\n'
+                f'    parameters:{"" if item["parameters"] else " {}"}\n'
+            )
+
+            for name, value in item['parameters'].items():
+                stream.write(f'      {dumps(name)}: {dumps(value)}\n')
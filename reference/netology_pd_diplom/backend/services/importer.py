@@ -0,0 +1,304 @@
+import math
+import re
+from itertools import islice
+
+from django.db import connection, transaction
+
+from backend.models import Shop, Category, ProductInfo, ProductParameter, CatalogOffer
+from backend.services import dictionary
+from backend.services.facets import delete_offers
+from backend.services.tracker import ImportTracker
+
+BATCH_SIZE = 1000
+
+
+def chunked(iterable, size: int = BATCH_SIZE):
+    """
+    Разбивает итерируемый объект на списки длиной не более size
+    """
+    iterator = iter(iterable)
+
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+PRODUCT_INFO_FIELDS = ('product_id', 'model', 'price', 'price_rrc', 'quantity')
+PRODUCT_PARAMETER_FIELDS = ('value', 'numeric_value', 'unit')
+
+NUMBER = re.compile(r'^\s*(?P<number>[-+]?(?:\d+(?:[.,]\d*)?|[.,]\d+))\s*(?P<unit>\D{0,20}?)\s*$')
+NAME_UNIT = re.compile(r'\((?P<unit>[^()]{1,20})\)\s*$')
+
+
+def parse_parameter_value(name: str, value) -> tuple:
+    """
+    Возвращает (строковое значение, число или None, единица измерения).
+
+    Число берется из значения вида "6.5", "6,5" или "512 Гб"; единица - из хвоста
+    значения, а если его нет - из скобок в имени параметра: "Диагональ (дюйм)".
+    """
+    value = str(value)
+
+    if not (match := NUMBER.match(value)):
+        return value, None, ''
+
+    number = float(match['number'].replace(',', '.'))
+
+    if not math.isfinite(number):
+        return value, None, ''
+
+    unit = match['unit'] or (name_match['unit'].strip() if (name_match := NAME_UNIT.search(name)) else '')
+    return value, number, unit
+
+
+class ImportOperation:
+    """
+    Пакетный импорт прайс-листа магазина.
+
+    Категории, продукты и имена параметров сопоставляются с id через словари,
+    которые заполняются несколькими запросами на пачку товаров, а строки
+    пишутся через bulk_create в одной транзакции. Количество запросов растет
+    с количеством пачек, а не с количеством товаров.
+
+    Импорт дифференциальный: товары сопоставляются с существующими строками
+    по (магазин, внешний ИД), и выполняются только нужные вставки, обновления
+    и удаления. run возвращает сводку изменений.
+    """
+
+    def __init__(self, user_id: int, batch_size: int = BATCH_SIZE, tracker: ImportTracker = None):
+        self.user_id = user_id
+        self.batch_size = batch_size
+        self.tracker = tracker or ImportTracker()
+        self.shop = None
+        self.parameters = {}
+        self.seen = set()
+        self.summary = {'created': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0}
+
+    def run(self, shop_name: str, categories: list, goods) -> dict:
+        with transaction.atomic():
+            self.prepare(shop_name, categories)
+            chunks = chunked(goods, self.batch_size)
+
+            while True:
+                with self.tracker.measure('parse'):
+                    chunk = next(chunks, None)
+
+                if chunk is None:
+                    break
+
+                self.apply(self.diff(chunk))
+                self.tracker.add_rows(len(chunk))
+
+            self.finish()
+
+        return self.summary
+
+    def prepare(self, shop_name: str, categories: list) -> None:
+        with self.tracker.measure('resolve'):
+            self.shop, _ = Shop.objects.get_or_create(name=shop_name, user_id=self.user_id)
+            self.import_categories(categories)
+
+    def import_categories(self, categories: list) -> None:
+        existing = dictionary.categories.get_keys([category['id'] for category in categories])
+        Category.objects.bulk_create(
+            [Category(id=category['id'], name=category['name'])
+             for category in categories if category['id'] not in existing],
+            batch_size=self.batch_size
+        )
+
+        through = Category.shops.through
+        through.objects.bulk_create(
+            [through(category_id=category['id'], shop_id=self.shop.id) for category in categories],
+            batch_size=self.batch_size, ignore_conflicts=True
+        )
+
+    def diff(self, goods: list) -> dict:
+        """
+        Сравнивает пачку товаров с позициями магазина и возвращает набор изменений.
+
+        Набор изменений состоит только из простых типов, поэтому его можно
+        сохранить в JSON и применить в другом процессе.
+        """
+        with self.tracker.measure('resolve'):
+            return self.compare(goods)
+
+    def compare(self, goods: list) -> dict:
+        products = self.resolve_products(goods)
+        self.resolve_parameters(goods)
+        existing = self.fetch_product_infos(goods)
+        existing_parameters = self.fetch_product_parameters(
+            [product_info['id'] for product_info in existing.values()])
+
+        changeset = {
+            'summary': {'created': 0, 'updated': 0, 'unchanged': 0},
+            'seen': [],
+            'product_infos_created': [],
+            'product_infos_updated': [],
+            'parameters_created': [],
+            'parameters_updated': [],
+            'parameters_deleted': [],
+        }
+
+        for item in goods:
+            row = {
+                'product_id': products[(item['name'], item['category'])],
+                'external_id': item['id'],
+                'model': item['model'],
+                'price': item['price'],
+                'price_rrc': item['price_rrc'],
+                'quantity': item['quantity'],
+            }
+            parameters = {
+                self.parameters[name]: list(parse_parameter_value(name, value))
+                for name, value in item['parameters'].items()
+            }
+            changeset['seen'].append(row['external_id'])
+            current = existing.get(row['external_id'])
+
+            if current is None:
+                changeset['product_infos_created'].append([row, [[key, *value] for key, value in parameters.items()]])
+                changeset['summary']['created'] += 1
+                continue
+
+            row['id'] = current['id']
+            current_parameters = existing_parameters.get(row['id'], {})
+            is_changed = any(row[field] != current[field] for field in PRODUCT_INFO_FIELDS)
+
+            if is_changed:
+                changeset['product_infos_updated'].append(row)
+
+            for parameter_id, value in parameters.items():
+                if parameter_id not in current_parameters:
+                    changeset['parameters_created'].append([row['id'], parameter_id, *value])
+                    is_changed = True
+                elif current_parameters[parameter_id][1:] != tuple(value):
+                    changeset['parameters_updated'].append([current_parameters[parameter_id][0], *value])
+                    is_changed = True
+
+            for parameter_id, (product_parameter_id, *_) in current_parameters.items():
+                if parameter_id not in parameters:
+                    changeset['parameters_deleted'].append(product_parameter_id)
+                    is_changed = True
+
+            changeset['summary']['updated' if is_changed else 'unchanged'] += 1
+
+        return changeset
+
+    def apply(self, changeset: dict) -> None:
+        with self.tracker.measure('write'):
+            self.write(changeset)
+
+        self.seen.update(changeset['seen'])
+
+        for key, value in changeset['summary'].items():
+            self.summary[key] += value
+
+    def write(self, changeset: dict) -> None:
+        parameters_created = list(changeset['parameters_created'])
+        created = changeset['product_infos_created']
+
+        if created:
+            product_infos = self.create_product_infos(
+                [ProductInfo(shop_id=self.shop.id, **row) for row, _ in created])
+            parameters_created.extend(
+                [product_info.id, *parameter]
+                for product_info, (_, parameters) in zip(product_infos, created)
+                for parameter in parameters
+            )
+
+        ProductInfo.objects.bulk_update(
+            [ProductInfo(**row) for row in changeset['product_infos_updated']],
+            PRODUCT_INFO_FIELDS, batch_size=self.batch_size
+        )
+        ProductParameter.objects.bulk_create(
+            [ProductParameter(product_info_id=product_info_id, parameter_id=parameter_id,
+                              **dict(zip(PRODUCT_PARAMETER_FIELDS, value)))
+             for product_info_id, parameter_id, *value in parameters_created],
+            batch_size=self.batch_size
+        )
+        ProductParameter.objects.bulk_update(
+            [ProductParameter(id=product_parameter_id, **dict(zip(PRODUCT_PARAMETER_FIELDS, value)))
+             for product_parameter_id, *value in changeset['parameters_updated']],
+            PRODUCT_PARAMETER_FIELDS, batch_size=self.batch_size
+        )
+
+        if changeset['parameters_deleted']:
+            ProductParameter.objects.filter(id__in=changeset['parameters_deleted']).delete()
+
+    def finish(self) -> None:
+        """
+        Удаляет позиции магазина, которых нет в загруженном прайс-листе
+        """
+        with self.tracker.measure('cleanup'):
+            self.delete_missing()
+
+    def delete_missing(self) -> None:
+        missing = [
+            product_info_id
+            for product_info_id, external_id in ProductInfo.objects.filter(
+                shop_id=self.shop.id).values_list('id', 'external_id').iterator(chunk_size=self.batch_size)
+            if external_id not in self.seen
+        ]
+
+        for chunk in chunked(missing, self.batch_size):
+            # предложения удаляются отдельно, чтобы вычесть их из счетчиков фасетов
+            delete_offers(CatalogOffer.objects.filter(product_info_id__in=chunk))
+            ProductInfo.objects.filter(id__in=chunk).delete()
+
+        self.summary['deleted'] = len(missing)
+
+    def fetch_product_infos(self, goods: list) -> dict:
+        return {
+            product_info['external_id']: product_info
+            for product_info in ProductInfo.objects.filter(
+                shop_id=self.shop.id, external_id__in={item['id'] for item in goods}
+            ).values('id', 'external_id', *PRODUCT_INFO_FIELDS)
+        }
+
+    @staticmethod
+    def fetch_product_parameters(product_info_ids: list) -> dict:
+        """
+        Возвращает словарь id позиции -> {id параметра: (id значения, значение, число, единица)}
+        """
+        product_parameters = {}
+
+        if not product_info_ids:
+            return product_parameters
+
+        queryset = ProductParameter.objects.filter(product_info_id__in=product_info_ids).values_list(
+            'id', 'product_info_id', 'parameter_id', *PRODUCT_PARAMETER_FIELDS)
+
+        for product_parameter_id, product_info_id, parameter_id, *value in queryset:
+            product_parameters.setdefault(product_info_id, {})[parameter_id] = (product_parameter_id, *value)
+
+        return product_parameters
+
+    def resolve_products(self, goods: list) -> dict:
+        """
+        Возвращает словарь (название, id категории) -> id продукта, создавая недостающие продукты
+        """
+        return dictionary.products.resolve({(item['name'], item['category']) for item in goods}, self.batch_size)
+
+    def resolve_parameters(self, goods: list) -> None:
+        names = {name for item in goods for name in item['parameters']} - self.parameters.keys()
+
+        if names:
+            self.parameters.update(dictionary.parameters.resolve(names))
+
+    def create_product_infos(self, product_infos: list) -> list:
+        created = ProductInfo.objects.bulk_create(product_infos, batch_size=self.batch_size)
+
+        if connection.features.can_return_rows_from_bulk_insert:
+            return created
+
+        ids = {
+            (product_id, external_id): product_info_id
+            for product_info_id, product_id, external_id in ProductInfo.objects.filter(
+                shop_id=self.shop.id,
+                external_id__in={product_info.external_id for product_info in product_infos}
+            ).values_list('id', 'product_id', 'external_id')
+        }
+
+        for product_info in product_infos:
+            product_info.id = ids[(product_info.product_id, product_info.external_id)]
+
+        return product_infos
@@ -1,54 +1,264 @@
 import abc
+import json
+import os
+import re
+from typing import Iterator, TextIO
 
-from yaml import safe_load
-from backend.models import Shop, Category, Product, ProductInfo, ProductParameter, Parameter
-import ruamel.yaml
+from yaml import MappingStartEvent, MappingEndEvent, SequenceStartEvent, SequenceEndEvent, ScalarEvent, AliasEvent, \
+    MappingNode, ScalarNode, SequenceNode, Node
+from yaml.composer import ComposerError
+from backend.services.copy_import import get_import_operation_class
+from backend.services.tracker import ImportTracker
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+CHUNK_SIZE = 64 * 1024
 
 
 class BaseLoader(abc.ABC):
+    """
+    Базовый загрузчик прайс-листа.
+
+    parse читает файл потоком: заголовок (shop, categories) разбирается целиком,
+    а товары отдаются по одному, поэтому расход памяти не зависит от размера файла.
+    Поля заголовка должны идти в файле перед goods.
+    """
 
     def __init__(self, user_id: int):
         self.user_id = user_id
 
-    def import_data(self, url):
+    @abc.abstractmethod
+    def parse(self, stream: TextIO) -> tuple[dict, Iterator[dict]]:
         ...
 
+    def load(self, stream: TextIO) -> tuple[dict, Iterator[dict]]:
+        header, goods = self.parse(stream)
+
+        if 'shop' not in header or 'categories' not in header:
+            raise ValueError("Поля 'shop' и 'categories' должны идти перед 'goods'")
+
+        return header, goods
+
+    def import_data(self, stream: TextIO, tracker: ImportTracker = None) -> dict:
+        header, goods = self.load(stream)
+        operation = get_import_operation_class()(self.user_id, tracker=tracker)
+        return operation.run(header['shop'], header['categories'], goods)
+
 
 class LoaderYaml(BaseLoader):
+    """
+    Потоковый загрузчик YAML поверх событий парсера (libyaml, если доступна).
+
+    Узлы собираются из событий по одному товару, поэтому документ целиком
+    в памяти не строится.
+    """
+
+    def __init__(self, user_id: int):
+        super().__init__(user_id)
+        self.anchors = {}
+
+    def parse(self, stream: TextIO) -> tuple[dict, Iterator[dict]]:
+        loader = SafeLoader(stream)
+        loader.get_event()
+        loader.get_event()
+
+        if not loader.check_event(MappingStartEvent):
+            loader.dispose()
+            raise ValueError('Прайс-лист должен быть словарем')
+
+        loader.get_event()
+        header = {}
+
+        while not loader.check_event(MappingEndEvent):
+            key = self.construct(loader)
+
+            if key == 'goods':
+                return header, self.read_goods(loader)
+
+            header[key] = self.construct(loader)
+
+        loader.dispose()
+        return header, iter(())
+
+    def read_goods(self, loader: SafeLoader) -> Iterator[dict]:
+        try:
+            if not loader.check_event(SequenceStartEvent):
+                self.construct(loader)
+                return
+
+            loader.get_event()
+
+            while not loader.check_event(SequenceEndEvent):
+                yield self.construct(loader)
+        finally:
+            loader.dispose()
+
+    def construct(self, loader: SafeLoader):
+        """
+        Собирает следующий узел документа и сбрасывает кэш построенных объектов
+        """
+        value = loader.construct_object(self.compose(loader), deep=True)
+        loader.constructed_objects = {}
+        loader.recursive_objects = {}
+        return value
+
+    def compose(self, loader: SafeLoader) -> Node:
+        event = loader.get_event()
+
+        if isinstance(event, AliasEvent):
+            if event.anchor not in self.anchors:
+                raise ComposerError(None, None, f'found undefined alias {event.anchor!r}', event.start_mark)
+            return self.anchors[event.anchor]
+
+        if isinstance(event, ScalarEvent):
+            tag = event.tag if event.tag not in (None, '!') else loader.resolve(ScalarNode, event.value, event.implicit)
+            node = ScalarNode(tag, event.value, event.start_mark, event.end_mark, style=event.style)
+        elif isinstance(event, SequenceStartEvent):
+            tag = event.tag if event.tag not in (None, '!') else loader.resolve(SequenceNode, None, event.implicit)
+            node = SequenceNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+
+            while not loader.check_event(SequenceEndEvent):
+                node.value.append(self.compose(loader))
+
+            node.end_mark = loader.get_event().end_mark
+        else:
+            tag = event.tag if event.tag not in (None, '!') else loader.resolve(MappingNode, None, event.implicit)
+            node = MappingNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+
+            while not loader.check_event(MappingEndEvent):
+                node.value.append((self.compose(loader), self.compose(loader)))
+
+            node.end_mark = loader.get_event().end_mark
+
+        if event.anchor is not None:
+            self.anchors[event.anchor] = node
+
+        return node
+
 
-    def import_data(self, data: str) -> None:
-        yaml_str = safe_load(data)
-        yaml = ruamel.yaml.YAML()
-        data = yaml.load(yaml_str)
-
-        shop, _ = Shop.objects.get_or_create(name=data['shop'], user_id=self.user_id)
-
-        for category in data['categories']:
-            category_object, _ = Category.objects.get_or_create(id=category['id'], name=category['name'])
-            category_object.shops.add(shop.id)
-            category_object.save()
-        ProductInfo.objects.filter(shop_id=shop.id).delete()
-
-        for item in data['goods']:
-            product, _ = Product.objects.get_or_create(name=item['name'], category_id=item['category'])
-            product_info = ProductInfo.objects.create(
-                product_id=product.id,
-                external_id=item['id'],
-                model=item['model'],
-                price=item['price'],
-                price_rrc=item['price_rrc'],
-                quantity=item['quantity'],
-                shop_id=shop.id
-            )
-
-            for name, value in item['parameters'].items():
-                parameter_object, _ = Parameter.objects.get_or_create(name=name)
-                ProductParameter.objects.create(
-                    product_info_id=product_info.id,
-                    parameter_id=parameter_object.id,
-                    value=value
-                )
+class JsonStream:
+    """
+    Инкрементальное чтение значений JSON из текстового потока
+    """
+    whitespace = re.compile(r'\s*')
+
+    def __init__(self, stream: TextIO, chunk_size: int = CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.position = 0
+
+    def fill(self) -> bool:
+        chunk = self.stream.read(self.chunk_size)
+
+        if not chunk:
+            return False
+
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            self.position = self.whitespace.match(self.buffer, self.position).end()
+
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+
+            if not self.fill():
+                return ''
+
+    def expect(self, chars: str) -> str:
+        char = self.peek()
+
+        if not char or char not in chars:
+            raise ValueError(f'Ожидался один из символов {chars!r}, получено {char!r}')
+
+        self.position += 1
+        return char
+
+    def value(self):
+        self.peek()
+
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+
+            # число в конце буфера могло быть обрезано на границе чтения
+            if end == len(self.buffer) and self.fill():
+                continue
+
+            self.position = end
+            return value
 
 
 class LoaderJson(BaseLoader):
-    ...
+
+    def parse(self, stream: TextIO) -> tuple[dict, Iterator[dict]]:
+        reader = JsonStream(stream)
+        reader.expect('{')
+        header = {}
+
+        if reader.peek() == '}':
+            return header, iter(())
+
+        while True:
+            key = reader.value()
+            reader.expect(':')
+
+            if key == 'goods':
+                return header, self.read_goods(reader)
+
+            header[key] = reader.value()
+
+            if reader.expect(',}') == '}':
+                return header, iter(())
+
+    @staticmethod
+    def read_goods(reader: JsonStream) -> Iterator[dict]:
+        reader.expect('[')
+
+        if reader.peek() == ']':
+            return
+
+        while True:
+            yield reader.value()
+
+            if reader.expect(',]') == ']':
+                return
+
+
+class LoaderNdjson(BaseLoader):
+    """
+    Прайс-лист в формате NDJSON: первая строка - заголовок с полями shop и categories,
+    каждая следующая непустая строка - один товар
+    """
+
+    def parse(self, stream: TextIO) -> tuple[dict, Iterator[dict]]:
+        lines = (line for line in stream if line.strip())
+        header = json.loads(next(lines, '{}'))
+        return header, (json.loads(line) for line in lines)
+
+
+LOADERS = {
+    '.yaml': LoaderYaml,
+    '.yml': LoaderYaml,
+    '.json': LoaderJson,
+    '.ndjson': LoaderNdjson,
+    '.jsonl': LoaderNdjson,
+}
+
+
+def get_loader(file_name: str) -> type[BaseLoader]:
+    """
+    Выбирает загрузчик по расширению файла, по умолчанию - YAML
+    """
+    return LOADERS.get(os.path.splitext(file_name)[1].lower(), LoaderYaml)
@@ -1,7 +1,10 @@
 from backend.models import Order, User
 
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.http import JsonResponse
+from backend.services.basket_cache import BasketCache, BasketLockError, basket_cache_enabled
+from backend.services.stock import StockError, reserve_stock
+from backend.services.totals import update_order_totals, write_shop_orders
 from backend.tasks import send_email
 
 
@@ -12,10 +15,11 @@ class OrderOperation:
 
     def create(self, data) -> JsonResponse:
         try:
-            is_updated = Order.objects.filter(
-                user_id=self.user.id, id=data['id']).update(
-                contact_id=data['contact'],
-                state='new')
+            is_updated = self.checkout(data['id'], data['contact'])
+        except StockError as error:
+            return JsonResponse({'Status': False, 'Errors': str(error), 'product_info': error.product_info_id})
+        except BasketLockError as error:
+            return JsonResponse({'Status': False, 'Errors': str(error)})
         except IntegrityError as error:
             return JsonResponse({'Status': False, 'Errors': 'Неправильно указаны аргументы'})
         else:
@@ -23,3 +27,40 @@ class OrderOperation:
                 send_email.delay('Обновление статуса заказа', 'Заказ сформирован', [self.user.email])
                 return JsonResponse({'Status': True})
             return JsonResponse({'Status': False})
+
+    def checkout(self, order_id: int, contact_id) -> int:
+        """
+        Оформляет корзину в заказ и возвращает количество оформленных корзин: 0, если order_id
+        не корзина пользователя (например, уже оформленный или отмененный заказ).
+        Если товара не хватает, вызывает StockError, и все изменения откатываются
+        """
+        basket_cache = BasketCache(self.user.id) if basket_cache_enabled() else None
+
+        if basket_cache is not None:
+            # корзина из кэша записывается в базу; у еще не записанной корзины id 0
+            basket_id = basket_cache.materialize()
+
+            if basket_id is not None and order_id == 0:
+                order_id = basket_id
+
+        with transaction.atomic():
+            # оформляется только корзина; условный UPDATE блокирует строку заказа,
+            # поэтому повторная отправка той же корзины получит 0 и ничего не спишет
+            is_updated = Order.objects.filter(
+                user_id=self.user.id, id=order_id, state='basket').update(
+                contact_id=contact_id,
+                state='new')
+
+            if not is_updated:
+                return 0
+
+            # суммы фиксируются по ценам на момент оформления
+            update_order_totals([order_id])
+            write_shop_orders([order_id])
+            # остатки списываются последними, чтобы строки товаров были заблокированы как можно меньше
+            reserve_stock([order_id])
+
+            if basket_cache is not None:
+                transaction.on_commit(basket_cache.clear)
+
+        return is_updated
@@ -0,0 +1,132 @@
+from django.db.models import QuerySet
+from rest_framework import serializers
+
+from backend.models import OrderItem, ProductParameter
+from backend.services import dictionary
+
+CONTACT_FIELDS = ('id', 'city', 'street', 'house', 'structure', 'building', 'apartment', 'phone')
+PRODUCT_INFO_FIELDS = ('id', 'model', 'product__name', 'product__category__name', 'shop_id', 'quantity', 'price',
+                       'price_rrc')
+ITEM_FIELDS = (
+    'order_id', 'id', 'quantity', 'product_info_id', *(f'product_info__{field}' for field in PRODUCT_INFO_FIELDS[1:])
+)
+# ключ строки заказа -> поле в values()
+ORDER_FIELDS = {
+    'id': 'id', 'state': 'state', 'dt': 'dt', 'total_sum': 'total_sum', 'item_count': 'item_count',
+    'contact_id': 'contact_id', **{f'contact__{field}': f'contact__{field}' for field in CONTACT_FIELDS[1:]},
+}
+
+
+class OrderListOperation:
+    """
+    Быстрое чтение списков заказов без OrderSerializer.
+
+    Заказы, позиции и параметры читаются тремя запросами через values_list,
+    а словари собираются напрямую из кортежей, без экземпляров моделей и дерева
+    полей сериализатора. Результат совпадает с выдачей OrderSerializer.
+
+    total_sum и item_count оформленных заказов берутся из полей заказа (зафиксированы
+    при оформлении), а у корзин считаются по позициям и текущим ценам: после импорта
+    цены могли измениться, а корзина при этом не пересчитывалась.
+    """
+    dt_field = serializers.DateTimeField()
+    fields = ORDER_FIELDS
+
+    def list(self, orders: QuerySet) -> list:
+        # списки заказов всегда отдавались в порядке id
+        return self.to_representation(self.get_rows(orders.order_by('id')))
+
+    def get_rows(self, queryset: QuerySet) -> QuerySet:
+        return queryset.values(*self.fields.values())
+
+    def to_representation(self, rows) -> list:
+        rows = [{key: row[field] for key, field in self.fields.items()} for row in rows]
+        items = self.fetch_items([row['id'] for row in rows])
+        data = []
+
+        for row in rows:
+            ordered_items = items.get(row['id'], [])
+            total_sum, item_count = (self.get_totals(ordered_items) if row['state'] == 'basket'
+                                     else (row['total_sum'], row['item_count']))
+            data.append({
+                'id': row['id'],
+                'ordered_items': ordered_items,
+                'state': row['state'],
+                'dt': self.dt_field.to_representation(row['dt']),
+                'total_sum': total_sum,
+                'item_count': item_count,
+                'contact': None if row['contact_id'] is None else {
+                    'id': row['contact_id'],
+                    **{field: row[f'contact__{field}'] for field in CONTACT_FIELDS[1:]},
+                },
+            })
+
+        return data
+
+    @staticmethod
+    def get_totals(ordered_items: list) -> tuple:
+        """
+        Сумма и количество товаров по позициям и текущим ценам
+        """
+        return (sum(item['quantity'] * item['product_info']['price'] for item in ordered_items),
+                sum(item['quantity'] for item in ordered_items))
+
+    def fetch_items(self, order_ids: list) -> dict:
+        """
+        Возвращает словарь id заказа -> список позиций
+        """
+        rows = list(OrderItem.objects.filter(order_id__in=order_ids).order_by('id').values_list(*ITEM_FIELDS))
+        parameters = self.fetch_parameters({row[3] for row in rows})
+        items = {}
+
+        for order_id, item_id, quantity, *product_info in rows:
+            items.setdefault(order_id, []).append({
+                'id': item_id,
+                'product_info': self.product_info_to_representation(product_info, parameters),
+                'quantity': quantity,
+            })
+
+        return items
+
+    @staticmethod
+    def product_info_to_representation(row, parameters: dict) -> dict:
+        """
+        Собирает позицию из значений PRODUCT_INFO_FIELDS
+        """
+        product_info_id, model, name, category, shop_id, quantity, price, price_rrc = row
+
+        return {
+            'id': product_info_id,
+            'model': model,
+            'product': {'name': name, 'category': category},
+            'shop': shop_id,
+            'quantity': quantity,
+            'price': price,
+            'price_rrc': price_rrc,
+            'product_parameters': parameters.get(product_info_id, []),
+        }
+
+    @staticmethod
+    def fetch_parameters(product_info_ids: set) -> dict:
+        rows = list(ProductParameter.objects.filter(product_info_id__in=product_info_ids).order_by('id').values_list(
+            'product_info_id', 'parameter_id', 'value'))
+        names = dictionary.parameters.get_keys({parameter_id for _, parameter_id, _ in rows})
+        parameters = {}
+
+        for product_info_id, parameter_id, value in rows:
+            parameters.setdefault(product_info_id, []).append({'parameter': names[parameter_id], 'value': value})
+
+        return parameters
+
+
+class ShopOrderListOperation(OrderListOperation):
+    """
+    Список заказов поставщика по ShopOrder: статус, сумма и количество товаров
+    берутся из записи магазина, зафиксированной при оформлении заказа
+    """
+    fields = {
+        **{key: f'order__{field}' for key, field in ORDER_FIELDS.items()},
+        'id': 'order_id', 'state': 'state', 'dt': 'dt', 'total_sum': 'subtotal', 'item_count': 'item_count',
+        # id записи нужен курсору постраничного вывода
+        'shop_order_id': 'id',
+    }
@@ -0,0 +1,116 @@
+from django.conf import settings
+from django.db import transaction
+
+from backend.models import Shop
+from backend.services.importer import ImportOperation, chunked
+from backend.services.loader import get_loader
+from backend.services.staging import UploadStorage
+from backend.services.tracker import ImportTracker
+
+
+class ParallelImportOperation:
+    """
+    Импорт большого прайс-листа несколькими воркерами.
+
+    split один раз читает файл, создает магазин, категории, продукты и имена
+    параметров и раскладывает товары по файлам-пачкам. diff_chunk выполняется
+    параллельно и только читает базу, сохраняя набор изменений пачки. merge
+    применяет все наборы изменений в одной транзакции, поэтому новый каталог
+    магазина публикуется атомарно.
+
+    Файлы пачек и наборов изменений удаляются и при ошибке любого шага:
+    split и merge убирают их сами, после упавшей пачки - cleanup.
+    """
+
+    def __init__(self, user_id: int, file_name: str, chunk_size: int = None, tracker: ImportTracker = None):
+        self.user_id = user_id
+        self.file_name = file_name
+        self.chunk_size = chunk_size or settings.IMPORT_CHUNK_SIZE
+        self.tracker = tracker or ImportTracker()
+        self.storage = UploadStorage()
+        # файлы пачек относятся к одной задаче импорта, даже если тот же файл загружен дважды
+        self.prefix = f'{self.storage.get_hash(file_name)}.{self.tracker.job_id or 0}'
+
+    def split(self) -> tuple[dict, list]:
+        """
+        Возвращает общий словарь имен параметров и список файлов-пачек
+        """
+        operation = ImportOperation(self.user_id, tracker=self.tracker)
+        loader = get_loader(self.file_name)(self.user_id)
+        chunk_names = []
+
+        try:
+            with self.storage.open(self.file_name) as stream:
+                with self.tracker.measure('parse'):
+                    header, goods = loader.load(stream)
+
+                operation.prepare(header['shop'], header['categories'])
+                chunks = chunked(goods, self.chunk_size)
+
+                while True:
+                    with self.tracker.measure('parse'):
+                        chunk = next(chunks, None)
+
+                    if chunk is None:
+                        break
+
+                    with self.tracker.measure('resolve'):
+                        for batch in chunked(chunk, operation.batch_size):
+                            operation.resolve_products(batch)
+                            operation.resolve_parameters(batch)
+
+                    chunk_name = f'{self.prefix}.chunk{len(chunk_names)}.json'
+
+                    with self.tracker.measure('parse'):
+                        self.storage.save_json(chunk_name, chunk)
+
+                    chunk_names.append(chunk_name)
+        except Exception:
+            self.cleanup()
+            raise
+
+        return operation.parameters, chunk_names
+
+    def diff_chunk(self, chunk_name: str, parameters: dict) -> str:
+        operation = self.get_operation(parameters)
+
+        with self.tracker.measure('parse'):
+            goods = self.storage.load_json(chunk_name)
+
+        changesets = [operation.diff(batch) for batch in chunked(goods, operation.batch_size)]
+        self.tracker.add_rows(len(goods))
+
+        changeset_name = chunk_name.replace('.chunk', '.changeset')
+        self.storage.save_json(changeset_name, changesets)
+        self.storage.delete(chunk_name)
+
+        return changeset_name
+
+    def merge(self, changeset_names: list) -> dict:
+        operation = self.get_operation()
+
+        try:
+            with transaction.atomic():
+                for changeset_name in changeset_names:
+                    for changeset in self.storage.load_json(changeset_name):
+                        operation.apply(changeset)
+
+                operation.finish()
+        finally:
+            for changeset_name in changeset_names:
+                self.storage.delete(changeset_name)
+
+        return operation.summary
+
+    def cleanup(self) -> None:
+        """
+        Удаляет оставшиеся файлы пачек и наборов изменений задачи
+        """
+        self.storage.delete_matching(f'{self.prefix}.chunk*.json')
+        self.storage.delete_matching(f'{self.prefix}.changeset*.json')
+
+    def get_operation(self, parameters: dict = None) -> ImportOperation:
+        operation = ImportOperation(self.user_id, tracker=self.tracker)
+        operation.shop = Shop.objects.get(user_id=self.user_id)
+        operation.parameters = dict(parameters or {})
+        return operation
@@ -0,0 +1,92 @@
+import glob
+import hashlib
+import json
+import os
+import tempfile
+from typing import Iterable, TextIO
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+
+from backend.services.loader import LOADERS
+
+
+class UploadStorage:
+    """
+    Локальное хранилище загруженных прайс-листов.
+
+    Файл записывается один раз под именем <sha256><расширение>; в задачу
+    импорта передается только это имя, а не содержимое файла.
+    """
+
+    def __init__(self, root: str = None):
+        self.root = root or settings.IMPORT_STAGING_ROOT
+
+    def save(self, file: UploadedFile) -> str:
+        os.makedirs(self.root, exist_ok=True)
+        extension = os.path.splitext(file.name)[1].lower()
+
+        if extension not in LOADERS:
+            extension = '.yaml'
+
+        digest = hashlib.sha256()
+
+        with tempfile.NamedTemporaryFile(dir=self.root, delete=False) as temporary:
+            for chunk in file.chunks():
+                digest.update(chunk)
+                temporary.write(chunk)
+
+        file_name = f'{digest.hexdigest()}{extension}'
+        os.replace(temporary.name, self.path(file_name))
+
+        return file_name
+
+    def save_stream(self, file_name: str, chunks: Iterable[bytes]) -> int:
+        """
+        Записывает поток байтов в файл и возвращает его размер; файл появляется под своим именем только целиком
+        """
+        os.makedirs(self.root, exist_ok=True)
+        size = 0
+
+        with tempfile.NamedTemporaryFile(dir=self.root, delete=False) as temporary:
+            try:
+                for chunk in chunks:
+                    temporary.write(chunk)
+                    size += len(chunk)
+            except BaseException:
+                os.remove(temporary.name)
+                raise
+
+        os.replace(temporary.name, self.path(file_name))
+
+        return size
+
+    def path(self, file_name: str) -> str:
+        return os.path.join(self.root, os.path.basename(file_name))
+
+    def open(self, file_name: str) -> TextIO:
+        return open(self.path(file_name), encoding='utf-8')
+
+    def save_json(self, file_name: str, data) -> None:
+        os.makedirs(self.root, exist_ok=True)
+
+        with open(self.path(file_name), 'w', encoding='utf-8') as file:
+            json.dump(data, file, ensure_ascii=False)
+
+    def load_json(self, file_name: str):
+        with self.open(file_name) as file:
+            return json.load(file)
+
+    def delete(self, file_name: str) -> None:
+        try:
+            os.remove(self.path(file_name))
+        except FileNotFoundError:
+            pass
+
+    def delete_matching(self, pattern: str) -> None:
+        for path in glob.glob(self.path(pattern)):
+            self.delete(path)
+
+    @staticmethod
+    def get_hash(file_name: str) -> str:
+        return os.path.splitext(os.path.basename(file_name))[0]
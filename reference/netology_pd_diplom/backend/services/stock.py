@@ -0,0 +1,70 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F
+
+from backend.caching import catalog_version
+from backend.models import OrderItem, ProductInfo
+from backend.services.catalog import CatalogOperation
+
+
+class StockError(Exception):
+    """
+    Товара на складе меньше, чем в позиции заказа
+    """
+
+    def __init__(self, product_info_id: int):
+        super().__init__(f'Недостаточно товара на складе: позиция {product_info_id}')
+        self.product_info_id = product_info_id
+
+
+def get_stock_lines(order_ids) -> list:
+    # строки всегда обходятся по возрастанию id товара
+    return list(OrderItem.objects.filter(order_id__in=order_ids, quantity__gt=0).order_by(
+        'product_info_id', 'id').values_list('product_info_id', 'quantity'))
+
+
+def reserve_stock(order_ids) -> int:
+    """
+    Списывает остатки ProductInfo.quantity под позиции заказов и возвращает количество строк.
+
+    Каждая строка списывается условным UPDATE ... SET quantity = quantity - n WHERE quantity >= n:
+    проверка и списание атомарны, а строка товара остается заблокированной до конца транзакции,
+    поэтому параллельные заказы не продают больше остатка и не блокируют таблицу целиком.
+    Строки берутся в порядке id товара, чтобы заказы с общими товарами блокировали их
+    в одном порядке и не попадали во взаимную блокировку. Вызывается внутри транзакции
+    оформления: StockError по любой строке откатывает списания по всем строкам.
+    После фиксации транзакции остатки попадают в каталог предложений.
+    """
+    lines = get_stock_lines(order_ids)
+
+    for product_info_id, quantity in lines:
+        if not ProductInfo.objects.filter(id=product_info_id, quantity__gte=quantity).update(
+                quantity=F('quantity') - quantity):
+            raise StockError(product_info_id)
+
+    transaction.on_commit(partial(refresh_stock_offers, [product_info_id for product_info_id, _ in lines]))
+
+    return len(lines)
+
+
+def release_stock(order_ids) -> int:
+    """
+    Возвращает на склад товары из позиций заказов (при отмене)
+    """
+    lines = get_stock_lines(order_ids)
+
+    for product_info_id, quantity in lines:
+        ProductInfo.objects.filter(id=product_info_id).update(quantity=F('quantity') + quantity)
+
+    transaction.on_commit(partial(refresh_stock_offers, [product_info_id for product_info_id, _ in lines]))
+
+    return len(lines)
+
+
+def refresh_stock_offers(product_info_ids: list) -> None:
+    """
+    Переносит остатки позиций в CatalogOffer (колонку quantity и документ) и сбрасывает кэш каталога
+    """
+    if CatalogOperation().refresh_offers(product_info_ids):
+        catalog_version.bump()
@@ -0,0 +1,40 @@
+from django.db.models import F, OuterRef, QuerySet, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from backend.models import Order, OrderItem, ShopOrder
+
+
+def update_order_totals(orders) -> int:
+    """
+    Пересчитывает total_sum и item_count заказов одним запросом по позициям и текущим ценам.
+    orders - queryset заказов или список id
+    """
+    if not isinstance(orders, QuerySet):
+        orders = Order.objects.filter(id__in=orders)
+
+    items = OrderItem.objects.filter(order_id=OuterRef('id')).order_by().values('order_id')
+
+    return orders.update(
+        total_sum=Coalesce(Subquery(items.annotate(
+            total=Sum(F('quantity') * F('product_info__price'))).values('total')), Value(0)),
+        item_count=Coalesce(Subquery(items.annotate(count=Sum('quantity')).values('count')), Value(0)),
+    )
+
+
+def write_shop_orders(order_ids) -> int:
+    """
+    Записывает заказы в разрезе магазинов: сумма и количество товаров каждого магазина
+    считаются одним запросом по позициям и текущим ценам, статус и дата берутся из заказа.
+    Прежние записи этих заказов заменяются
+    """
+    rows = OrderItem.objects.filter(order_id__in=order_ids).order_by().values(
+        'order_id', 'product_info__shop_id', 'order__state', 'order__dt').annotate(
+        subtotal=Sum(F('quantity') * F('product_info__price')), item_count=Sum('quantity'))
+
+    ShopOrder.objects.filter(order_id__in=order_ids).delete()
+
+    return len(ShopOrder.objects.bulk_create([
+        ShopOrder(order_id=row['order_id'], shop_id=row['product_info__shop_id'], state=row['order__state'],
+                  dt=row['order__dt'], subtotal=row['subtotal'], item_count=row['item_count'])
+        for row in rows
+    ]))
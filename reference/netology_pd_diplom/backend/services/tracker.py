@@ -0,0 +1,76 @@
+import time
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from backend.models import ImportJob
+
+PHASES = ('parse', 'resolve', 'write', 'cleanup')
+PROGRESS_TIMEOUT = 24 * 60 * 60
+
+
+class ImportTracker:
+    """
+    Учет хода импорта: обработанные товары и длительность фаз parse, resolve, write и cleanup.
+
+    Импорт пишет в базу внутри одной транзакции, поэтому промежуточный прогресс
+    хранится в кэше (счетчики общие для всех воркеров одной задачи) и переносится
+    в ImportJob по завершении. Без job_id значения копятся только локально.
+    """
+
+    def __init__(self, job_id: int = None):
+        self.job_id = job_id
+        self.rows = 0
+        self.timings = dict.fromkeys(PHASES, 0.0)
+
+    def key(self, name: str) -> str:
+        return f'import_job:{self.job_id}:{name}'
+
+    @contextmanager
+    def measure(self, phase: str):
+        started = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.timings[phase] += elapsed
+            self.increment(phase, round(elapsed * 1000))
+
+    def add_rows(self, count: int) -> None:
+        self.rows += count
+        self.increment('rows', count)
+
+    def increment(self, name: str, value: int) -> None:
+        if self.job_id is None:
+            return
+
+        try:
+            cache.incr(self.key(name), value)
+        except ValueError:
+            cache.add(self.key(name), value, PROGRESS_TIMEOUT)
+
+    def get_progress(self) -> dict:
+        values = cache.get_many([self.key(name) for name in ('rows', *PHASES)])
+        progress = {'rows_processed': values.get(self.key('rows'), 0)}
+        progress.update({f'{phase}_time': values.get(self.key(phase), 0) / 1000 for phase in PHASES})
+        return progress
+
+    def start(self) -> None:
+        cache.set_many({self.key(name): 0 for name in ('rows', *PHASES)}, PROGRESS_TIMEOUT)
+        ImportJob.objects.filter(id=self.job_id).update(state='running', started_at=timezone.now())
+
+    def complete(self, summary: dict) -> None:
+        self.finish('done', summary=summary)
+
+    def skip(self) -> None:
+        ImportJob.objects.filter(id=self.job_id).update(state='skipped', finished_at=timezone.now())
+
+    def fail(self, error) -> None:
+        self.finish('failed', error=str(error))
+
+    def finish(self, state: str, **fields) -> None:
+        ImportJob.objects.filter(id=self.job_id).update(
+            state=state, finished_at=timezone.now(), **self.get_progress(), **fields)
+        cache.delete_many([self.key(name) for name in ('rows', *PHASES)])
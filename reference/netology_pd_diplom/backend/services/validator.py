@@ -0,0 +1,210 @@
+from typing import Callable, Iterable, TextIO
+
+from django.conf import settings
+from jsonschema import Draft7Validator
+from jsonschema.validators import extend
+from yaml import YAMLError
+
+from backend.services.loader import BaseLoader
+
+HEADER_SCHEMA = {
+    'type': 'object',
+    'required': ['shop', 'categories'],
+    'properties': {
+        'shop': {'type': 'string', 'minLength': 1, 'maxLength': 50},
+        'categories': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'required': ['id', 'name'],
+                'properties': {
+                    'id': {'type': 'integer', 'minimum': 1},
+                    'name': {'type': 'string', 'minLength': 1, 'maxLength': 40},
+                },
+            },
+        },
+    },
+}
+
+GOOD_SCHEMA = {
+    'type': 'object',
+    'required': ['id', 'category', 'name', 'model', 'price', 'price_rrc', 'quantity', 'parameters'],
+    'properties': {
+        'id': {'type': 'integer', 'minimum': 0, 'maximum': 2147483647},
+        'category': {'type': 'integer'},
+        'name': {'type': 'string', 'minLength': 1, 'maxLength': 80},
+        'model': {'type': 'string', 'maxLength': 80},
+        'price': {'type': 'integer', 'minimum': 0, 'maximum': 2147483647},
+        'price_rrc': {'type': 'integer', 'minimum': 0, 'maximum': 2147483647},
+        'quantity': {'type': 'integer', 'minimum': 0, 'maximum': 2147483647},
+        'parameters': {
+            'type': 'object',
+            'propertyNames': {'minLength': 1, 'maxLength': 40},
+            'additionalProperties': {'type': ['string', 'number', 'boolean'], 'maxLength': 100},
+        },
+    },
+}
+
+
+TYPES = {
+    # в отличие от JSON Schema, 5.0 не считается целым: импорт записал бы в базу float
+    'integer': lambda value: isinstance(value, int) and not isinstance(value, bool),
+    'number': lambda value: isinstance(value, (int, float)) and not isinstance(value, bool),
+    'string': lambda value: isinstance(value, str),
+    'boolean': lambda value: isinstance(value, bool),
+    'object': lambda value: isinstance(value, dict),
+    'array': lambda value: isinstance(value, list),
+}
+
+
+def compile_schema(schema: dict) -> Callable[[object], bool]:
+    """
+    Собирает из схемы функцию-предикат без обхода схемы на каждом значении.
+
+    Поддерживаются только ключевые слова, которые используются в схемах прайс-листа;
+    подробные сообщения об ошибках строит jsonschema для значений, не прошедших предикат.
+    """
+    checks = []
+
+    if 'type' in schema:
+        types = [TYPES[name] for name in (schema['type'] if isinstance(schema['type'], list) else [schema['type']])]
+        checks.append(lambda value: any(check(value) for check in types))
+
+    if 'minimum' in schema:
+        minimum = schema['minimum']
+        checks.append(lambda value: not TYPES['number'](value) or value >= minimum)
+
+    if 'maximum' in schema:
+        maximum = schema['maximum']
+        checks.append(lambda value: not TYPES['number'](value) or value <= maximum)
+
+    if 'minLength' in schema:
+        min_length = schema['minLength']
+        checks.append(lambda value: not isinstance(value, str) or len(value) >= min_length)
+
+    if 'maxLength' in schema:
+        max_length = schema['maxLength']
+        checks.append(lambda value: not isinstance(value, str) or len(value) <= max_length)
+
+    if 'required' in schema:
+        required = schema['required']
+        checks.append(lambda value: not isinstance(value, dict) or all(name in value for name in required))
+
+    if 'properties' in schema:
+        properties = {name: compile_schema(subschema) for name, subschema in schema['properties'].items()}
+        checks.append(lambda value: not isinstance(value, dict) or all(
+            check(value[name]) for name, check in properties.items() if name in value))
+
+    if 'propertyNames' in schema:
+        check_name = compile_schema(schema['propertyNames'])
+        checks.append(lambda value: not isinstance(value, dict) or all(check_name(name) for name in value))
+
+    if 'additionalProperties' in schema:
+        check_value = compile_schema(schema['additionalProperties'])
+        known = schema.get('properties', {}).keys()
+        checks.append(lambda value: not isinstance(value, dict) or all(
+            check_value(item) for name, item in value.items() if name not in known))
+
+    if 'items' in schema:
+        check_item = compile_schema(schema['items'])
+        checks.append(lambda value: not isinstance(value, list) or all(check_item(item) for item in value))
+
+    return lambda value: all(check(value) for check in checks)
+
+
+# подробные сообщения строятся по тем же правилам типов, что и в compile_schema
+PriceListSchemaValidator = extend(
+    Draft7Validator,
+    type_checker=Draft7Validator.TYPE_CHECKER.redefine('integer', lambda checker, value: TYPES['integer'](value))
+)
+
+
+class PriceListError(ValueError):
+    """
+    Прайс-лист не прошел проверку; errors - список всех найденных ошибок
+    """
+
+    def __init__(self, errors: list):
+        self.errors = errors
+        super().__init__('\n'.join(errors))
+
+
+class PriceListValidator:
+    """
+    Проверка прайс-листа до записи в базу.
+
+    Файл читается потоком за один проход: заголовок и каждый товар проверяются
+    по схеме, а категории товаров и внешние ИД - на ссылочную целостность.
+    Ошибки не прерывают проверку и собираются в один отчет, в котором
+    сохраняется не больше max_errors сообщений.
+    """
+    header_validator = PriceListSchemaValidator(HEADER_SCHEMA)
+    good_validator = PriceListSchemaValidator(GOOD_SCHEMA)
+    is_valid_good = staticmethod(compile_schema(GOOD_SCHEMA))
+
+    def __init__(self, max_errors: int = None):
+        self.max_errors = max_errors or settings.IMPORT_MAX_ERRORS
+        self.errors = []
+        self.error_count = 0
+
+    def check(self, loader: BaseLoader, stream: TextIO) -> None:
+        """
+        Проверяет файл и выбрасывает PriceListError, если найдены ошибки
+        """
+        try:
+            header, goods = loader.load(stream)
+            self.validate(header, goods)
+        except (YAMLError, ValueError) as error:
+            self.add_error(f'Ошибка разбора файла: {error}')
+
+        if self.error_count:
+            if self.error_count > len(self.errors):
+                self.errors.append(f'... и еще ошибок: {self.error_count - len(self.errors)}')
+
+            raise PriceListError(self.errors)
+
+    def validate(self, header: dict, goods: Iterable[dict]) -> list:
+        self.validate_item(self.header_validator, header, '')
+        categories = {
+            category['id'] for category in header.get('categories') or []
+            if isinstance(category, dict) and 'id' in category
+        }
+        external_ids = set()
+
+        for index, item in enumerate(goods):
+            path = f'goods[{index}]'
+
+            if not self.is_valid_good(item) and not self.validate_item(self.good_validator, item, path):
+                continue
+
+            if item['category'] not in categories:
+                self.add_error(f'{path}.category: категории {item["category"]} нет в списке categories')
+
+            if item['id'] in external_ids:
+                self.add_error(f'{path}.id: товар с ИД {item["id"]} уже есть в прайс-листе')
+
+            external_ids.add(item['id'])
+
+        return self.errors
+
+    def validate_item(self, validator: Draft7Validator, item, path: str) -> bool:
+        is_valid = True
+
+        for error in validator.iter_errors(item):
+            is_valid = False
+            self.add_error(f'{self.format_path(path, error.absolute_path) or "/"}: {error.message}')
+
+        return is_valid
+
+    def add_error(self, message: str) -> None:
+        self.error_count += 1
+
+        if len(self.errors) < self.max_errors:
+            self.errors.append(message)
+
+    @staticmethod
+    def format_path(path: str, parts: Iterable) -> str:
+        for part in parts:
+            path += f'[{part}]' if isinstance(part, int) else f'.{part}' if path else str(part)
+
+        return path
@@ -1,7 +1,21 @@
+import os
+from datetime import timedelta
+
+from celery import chord
 from django.core.mail import EmailMultiAlternatives
 from django.conf import settings
+from django.utils import timezone
+from backend.caching import catalog_version
 from backend.celery import app
-from backend.services.loader import LoaderYaml
+from backend.models import Shop, ImportJob, ExportJob
+from backend.services.basket_cache import flush_dirty_baskets
+from backend.services.catalog import CatalogOperation
+from backend.services.export import OfferExportOperation, delete_expired_exports
+from backend.services.loader import get_loader
+from backend.services.parallel import ParallelImportOperation
+from backend.services.staging import UploadStorage
+from backend.services.tracker import ImportTracker
+from backend.services.validator import PriceListValidator, PriceListError
 
 
 @app.task(bind=True, name="send_email")
@@ -11,6 +25,144 @@ def send_email(self, title: str, message: str,  to_email: list):
 
 
 @app.task(bind=True, name="do_import")
-def do_import(self, user_id: int, file_name: str) -> None:
-    LoaderYaml(user_id).import_data(file_name)
+def do_import(self, job_id: int) -> dict:
+    job = ImportJob.objects.get(id=job_id)
+    tracker = ImportTracker(job_id)
+    storage = UploadStorage()
+
+    if Shop.objects.filter(user_id=job.user_id, import_hash=storage.get_hash(job.file_name)).exists():
+        storage.delete(job.file_name)
+        tracker.skip()
+        return {}
+
+    tracker.start()
+
+    loader_class = get_loader(job.file_name)
+
+    try:
+        with storage.open(job.file_name) as stream, tracker.measure('parse'):
+            PriceListValidator().check(loader_class(job.user_id), stream)
+
+        if os.path.getsize(storage.path(job.file_name)) >= settings.IMPORT_PARALLEL_THRESHOLD:
+            operation = ParallelImportOperation(job.user_id, job.file_name, tracker=tracker)
+            parameters, chunk_names = operation.split()
+
+            try:
+                chord(
+                    [import_chunk.s(job_id, chunk_name, parameters) for chunk_name in chunk_names],
+                    finish_import.s(job_id).on_error(fail_import.s(job_id))
+                ).delay()
+            except Exception:
+                # задачи не поставлены в очередь (или выполнены сразу и упали), и fail_import не вызывается
+                operation.cleanup()
+                raise
+
+            return {'chunks': len(chunk_names)}
+
+        with storage.open(job.file_name) as stream:
+            summary = loader_class(job.user_id).import_data(stream, tracker)
+
+        complete_import(job, summary)
+    except PriceListError as error:
+        # ошибки в самом файле: задача завершается штатно, отчет сохраняется в ImportJob
+        tracker.fail(error)
+        return {'errors': len(error.errors)}
+    except Exception as error:
+        tracker.fail(error)
+        raise
+    finally:
+        # после импорта или разбиения на пачки загруженный файл больше не нужен, в том числе при ошибке
+        storage.delete(job.file_name)
+
+    return summary
+
+
+@app.task(bind=True, name="import_chunk")
+def import_chunk(self, job_id: int, chunk_name: str, parameters: dict) -> str:
+    job = ImportJob.objects.get(id=job_id)
+    operation = ParallelImportOperation(job.user_id, job.file_name, tracker=ImportTracker(job_id))
+    return operation.diff_chunk(chunk_name, parameters)
+
+
+@app.task(bind=True, name="finish_import")
+def finish_import(self, changeset_names: list, job_id: int) -> dict:
+    job = ImportJob.objects.get(id=job_id)
+    operation = ParallelImportOperation(job.user_id, job.file_name, tracker=ImportTracker(job_id))
+
+    try:
+        summary = operation.merge(changeset_names)
+        complete_import(job, summary)
+    except Exception as error:
+        operation.tracker.fail(error)
+        raise
+
+    return summary
+
+
+@app.task(bind=True, name="fail_import")
+def fail_import(self, request, exc, traceback, job_id: int) -> None:
+    job = ImportJob.objects.get(id=job_id)
+    tracker = ImportTracker(job_id)
+    # пачки, которые не успели обработать, и наборы изменений уже обработанных
+    ParallelImportOperation(job.user_id, job.file_name, tracker=tracker).cleanup()
+    tracker.fail(exc)
+
+
+@app.task(bind=True, name="refresh_catalog")
+def refresh_catalog(self, shop_id: int) -> int:
+    count = CatalogOperation().refresh_shop(shop_id)
+    catalog_version.bump()
+    return count
+
+
+@app.task(bind=True, name="export_catalog")
+def export_catalog(self, job_id: int) -> int:
+    """
+    Пишет архив выгрузки в EXPORT_ROOT. Версия каталога запоминается до чтения,
+    поэтому следующая выгрузка с since_version=catalog_version не пропустит изменений
+    """
+    job = ExportJob.objects.get(id=job_id)
+    ExportJob.objects.filter(id=job_id).update(state='running')
+    version = catalog_version.get()
+    operation = OfferExportOperation(job.updated_since, job.since_version)
+    file_name = f'export_{job_id}.zip'
+
+    try:
+        size = UploadStorage(settings.EXPORT_ROOT).save_stream(file_name, operation.stream())
+    except Exception as error:
+        ExportJob.objects.filter(id=job_id).update(state='failed', error=str(error), finished_at=timezone.now())
+        raise
+
+    finished_at = timezone.now()
+    ExportJob.objects.filter(id=job_id).update(
+        state='done', catalog_version=version, file_name=file_name, size=size, offers=operation.offer_count,
+        finished_at=finished_at, expires_at=finished_at + timedelta(seconds=settings.EXPORT_TTL)
+    )
+    return size
+
+
+@app.task(bind=True, name="cleanup_exports")
+def cleanup_exports(self) -> int:
+    return delete_expired_exports()
+
+
+@app.task(bind=True, name="flush_baskets")
+def flush_baskets(self) -> int:
+    return flush_dirty_baskets()
+
+
+def complete_import(job: ImportJob, summary: dict) -> None:
+    """
+    Запоминает хэш успешно импортированного файла, удаляет его из хранилища,
+    обновляет каталог предложений магазина и закрывает задачу
+    """
+    storage = UploadStorage()
+    Shop.objects.filter(user_id=job.user_id).update(import_hash=storage.get_hash(job.file_name))
+    storage.delete(job.file_name)
+
+    for shop_id in Shop.objects.filter(user_id=job.user_id).values_list('id', flat=True):
+        CatalogOperation().refresh_shop(shop_id)
+
+    catalog_version.bump()
 
+    ImportTracker(job.id).complete(summary)
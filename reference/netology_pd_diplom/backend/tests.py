@@ -1,3 +1,923 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+import zipfile
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import yaml
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from backend.caching import catalog_version
+from backend.celery import app
+from backend.models import User, Shop, Category, Product, ProductInfo, ProductParameter, Parameter, Order, OrderItem, \
+    Contact, ShopOrder, ImportJob, ExportJob, CatalogOffer, ParameterIndex, FacetCount
+from backend.services import dictionary
+from backend.services.basket_cache import BasketCache, flush_dirty_baskets
+from backend.services.catalog import CatalogOperation
+from backend.services.copy_import import CopyImportOperation, get_import_operation_class
+from backend.services.export import delete_expired_exports
+from backend.services.importer import ImportOperation
+from backend.services.loader import get_loader
+from backend.services.order import OrderOperation
+from backend.services.parallel import ParallelImportOperation
+from backend.services.staging import UploadStorage
+from backend.services.stock import StockError, reserve_stock, release_stock
+from backend.services.validator import PriceListValidator, PriceListError
+
+PRICE_LIST = """
+shop: Тестовый магазин
+categories:
+  - id: 1
+    name: Смартфоны
+goods:
+  - id: 1
+    category: 1
+    model: apple/iphone/xr
+    name: Смартфон Apple iPhone XR
+    price: 65000
+    price_rrc: 69990
+    quantity: 9
+    parameters:
+      "Цвет": красный
+      "Диагональ (дюйм)": 6.1
+      "Встроенная память": 256 Гб
+  - id: 2
+    category: 1
+    model: apple/iphone/xs
+    name: Смартфон Apple iPhone XS
+    price: 80000
+    price_rrc: 84990
+    quantity: 4
+    parameters:
+      "Цвет": черный
+      "Диагональ (дюйм)": 5.8
+      "Встроенная память": 512 Гб
+  - id: 3
+    category: 1
+    model: apple/iphone/se
+    name: Смартфон Apple iPhone SE
+    price: 30000
+    price_rrc: 32990
+    quantity: 7
+    parameters:
+      "Цвет": белый
+      "Диагональ (дюйм)": 4.7
+      "Встроенная память": 128 Гб
+"""
+
+
+def make_price_list(prices: list, quantity: int = 5) -> str:
+    """
+    Прайс-лист с товарами по указанным ценам; товары с равными ценами различаются только ИД
+    """
+    return yaml.safe_dump({
+        'shop': 'Тестовый магазин',
+        'categories': [{'id': 1, 'name': 'Смартфоны'}],
+        'goods': [
+            {'id': index, 'category': 1, 'model': f'model-{index}', 'name': f'Смартфон {index}', 'price': price,
+             'price_rrc': price, 'quantity': quantity, 'parameters': {'Цвет': 'черный'}}
+            for index, price in enumerate(prices, start=1)
+        ],
+    }, allow_unicode=True, sort_keys=False)
+
+
+class CatalogTestCase(TestCase):
+    """
+    Магазин загружает прайс-листы через API. Задачи Celery выполняются сразу,
+    загруженные файлы пишутся во временный каталог, кэш очищается перед каждым тестом
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shop_user = User.objects.create_user('shop@example.com', 'password', type='shop', is_active=True)
+        cls.buyer = User.objects.create_user('buyer@example.com', 'password', is_active=True)
+
+    def setUp(self):
+        self.staging = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(
+            IMPORT_STAGING_ROOT=self.staging,
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        ))
+        task_always_eager = app.conf.task_always_eager
+        app.conf.task_always_eager = True
+        self.addCleanup(setattr, app.conf, 'task_always_eager', task_always_eager)
+        cache.clear()
+
+        self.shop_client = APIClient()
+        self.shop_client.force_authenticate(self.shop_user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def upload(self, content: str, file_name: str = 'shop.yaml') -> dict:
+        return self.shop_client.post(
+            '/api/v1/partner/update', {'file': SimpleUploadedFile(file_name, content.encode())}, format='multipart'
+        ).json()
+
+    def get_products(self, **params) -> dict:
+        response = self.client.get('/api/v1/products', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def get_all_products(self, **params) -> list:
+        """
+        Обходит все страницы списка предложений по ссылкам next
+        """
+        page = self.get_products(**params)
+        results = page['results']
+
+        while page['next']:
+            response = self.client.get(page['next'])
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            results.extend(page['results'])
+
+        return results
+
+
+class ImportSummaryTests(TestCase):
+    """
+    Повторный импорт прайс-листа пишет только отличия и считает их в сводке
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('shop@example.com', 'password', type='shop', is_active=True)
+
+    def import_price_list(self, content: str) -> dict:
+        document = yaml.safe_load(content)
+        return ImportOperation(self.user.id).run(document['shop'], document['categories'], document['goods'])
+
+    def test_first_import_creates_all_positions(self):
+        summary = self.import_price_list(PRICE_LIST)
+
+        self.assertEqual(summary, {'created': 3, 'updated': 0, 'unchanged': 0, 'deleted': 0})
+        self.assertEqual(ProductInfo.objects.count(), 3)
+
+    def test_reimport_writes_only_differences(self):
+        self.import_price_list(PRICE_LIST)
+        # цена первой позиции изменилась, вторая позиция исчезла, добавлена новая
+        content = PRICE_LIST.replace('price: 65000', 'price: 64000').replace('  - id: 2\n', '  - id: 4\n')
+
+        summary = self.import_price_list(content)
+
+        self.assertEqual(summary, {'created': 1, 'updated': 1, 'unchanged': 1, 'deleted': 1})
+        self.assertEqual(
+            list(ProductInfo.objects.order_by('external_id').values_list('external_id', 'price')),
+            [(1, 64000), (3, 30000), (4, 80000)]
+        )
+
+    def test_identical_reimport_changes_nothing(self):
+        self.import_price_list(PRICE_LIST)
+
+        summary = self.import_price_list(PRICE_LIST)
+
+        self.assertEqual(summary, {'created': 0, 'updated': 0, 'unchanged': 3, 'deleted': 0})
+
+    def test_changed_parameter_updates_position(self):
+        self.import_price_list(PRICE_LIST)
+
+        summary = self.import_price_list(PRICE_LIST.replace('"Цвет": белый', '"Цвет": серый'))
+
+        self.assertEqual(summary, {'created': 0, 'updated': 1, 'unchanged': 2, 'deleted': 0})
+
+
+@override_settings(IMPORT_PARALLEL_THRESHOLD=0, IMPORT_CHUNK_SIZE=2)
+class ParallelImportTests(CatalogTestCase):
+    """
+    Прайс-лист от IMPORT_PARALLEL_THRESHOLD делится на пачки, которые обрабатывают отдельные задачи
+    """
+
+    def get_positions(self) -> list:
+        return list(ProductInfo.objects.order_by('external_id').values_list(
+            'external_id', 'product__name', 'price', 'quantity'))
+
+    def get_parameters(self) -> list:
+        return list(ProductParameter.objects.order_by('product_info__external_id', 'parameter__name').values_list(
+            'product_info__external_id', 'parameter__name', 'value'))
+
+    def test_parallel_import_matches_sequential(self):
+        job_id = self.upload(PRICE_LIST)['job_id']
+        job = self.shop_client.get(f'/api/v1/partner/import/{job_id}').json()
+
+        self.assertEqual((job['state'], job['rows_processed']), ('done', 3))
+        self.assertEqual(job['summary'], {'created': 3, 'updated': 0, 'unchanged': 0, 'deleted': 0})
+        positions, parameters = self.get_positions(), self.get_parameters()
+
+        ProductInfo.objects.all().delete()
+        get_loader('shop.yaml')(self.shop_user.id).import_data(io.StringIO(PRICE_LIST))
+
+        self.assertEqual(len(positions), 3)
+        self.assertEqual(self.get_positions(), positions)
+        self.assertEqual(self.get_parameters(), parameters)
+
+    def test_parallel_reimport_writes_only_differences(self):
+        self.upload(PRICE_LIST)
+        content = PRICE_LIST.replace('price: 65000', 'price: 64000').replace('  - id: 2\n', '  - id: 4\n')
+
+        job = ImportJob.objects.get(id=self.upload(content)['job_id'])
+
+        self.assertEqual(job.summary, {'created': 1, 'updated': 1, 'unchanged': 1, 'deleted': 1})
+        self.assertEqual(
+            list(ProductInfo.objects.order_by('external_id').values_list('external_id', 'price')),
+            [(1, 64000), (3, 30000), (4, 80000)]
+        )
+
+    def test_merge_returns_summary(self):
+        file_name = UploadStorage().save(SimpleUploadedFile('shop.yaml', PRICE_LIST.encode()))
+        operation = ParallelImportOperation(self.shop_user.id, file_name)
+        parameters, chunk_names = operation.split()
+
+        summary = operation.merge([operation.diff_chunk(chunk_name, parameters) for chunk_name in chunk_names])
+
+        self.assertEqual(len(chunk_names), 2)
+        self.assertEqual(summary, {'created': 3, 'updated': 0, 'unchanged': 0, 'deleted': 0})
+
+    def test_chunk_files_are_removed(self):
+        self.upload(PRICE_LIST)
+
+        self.assertEqual(os.listdir(self.staging), [])
+
+    def test_failed_chunk_removes_chunk_files(self):
+        with mock.patch.object(ParallelImportOperation, 'diff_chunk', side_effect=RuntimeError('сбой пачки')):
+            job_id = self.upload(PRICE_LIST)['job_id']
+
+        job = ImportJob.objects.get(id=job_id)
+        self.assertEqual((job.state, job.error), ('failed', 'сбой пачки'))
+        self.assertFalse(ProductInfo.objects.exists())
+        self.assertEqual(os.listdir(self.staging), [])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'COPY есть только в PostgreSQL')
+class CopyImportTests(TestCase):
+    """
+    На PostgreSQL прайс-лист загружается через COPY во временные таблицы
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('shop@example.com', 'password', type='shop', is_active=True)
+
+    def setUp(self):
+        for dictionary_cache in (dictionary.categories, dictionary.parameters, dictionary.products):
+            dictionary_cache.clear()
+
+    def import_price_list(self, content: str) -> dict:
+        return get_loader('shop.yaml')(self.user.id).import_data(io.StringIO(content))
+
+    def test_copy_import_is_used(self):
+        self.assertIs(get_import_operation_class(), CopyImportOperation)
+
+    def test_copy_import_summary(self):
+        self.assertEqual(self.import_price_list(PRICE_LIST), {'created': 3, 'updated': 0, 'unchanged': 0, 'deleted': 0})
+        content = PRICE_LIST.replace('price: 65000', 'price: 64000').replace('  - id: 2\n', '  - id: 4\n')
+
+        summary = self.import_price_list(content)
+
+        self.assertEqual(summary, {'created': 1, 'updated': 1, 'unchanged': 1, 'deleted': 1})
+        self.assertEqual(
+            list(ProductInfo.objects.order_by('external_id').values_list('external_id', 'price')),
+            [(1, 64000), (3, 30000), (4, 80000)]
+        )
+        self.assertEqual(self.import_price_list(content), {'created': 0, 'updated': 0, 'unchanged': 3, 'deleted': 0})
+
+    def test_changed_parameter_updates_position(self):
+        self.import_price_list(PRICE_LIST)
+
+        summary = self.import_price_list(PRICE_LIST.replace('"Цвет": белый', '"Цвет": серый'))
+
+        self.assertEqual(summary, {'created': 0, 'updated': 1, 'unchanged': 2, 'deleted': 0})
+        self.assertEqual(ProductParameter.objects.get(product_info__external_id=3, parameter__name='Цвет').value,
+                         'серый')
+
+    def test_numeric_values(self):
+        self.import_price_list(PRICE_LIST)
+
+        self.assertEqual(
+            list(ProductParameter.objects.filter(product_info__external_id=1).order_by('parameter__name').values_list(
+                'parameter__name', 'value', 'numeric_value', 'unit')),
+            [('Встроенная память', '256 Гб', 256, 'Гб'), ('Диагональ (дюйм)', '6.1', 6.1, 'дюйм'),
+             ('Цвет', 'красный', None, '')]
+        )
+
+    def test_duplicate_parameter_names(self):
+        # имя параметра не уникально: значения пишутся один раз, к записи с меньшим id
+        Parameter.objects.bulk_create([Parameter(name='Цвет'), Parameter(name='Цвет')])
+        first_id = Parameter.objects.filter(name='Цвет').order_by('id').first().id
+
+        self.import_price_list(PRICE_LIST)
+
+        self.assertEqual(
+            list(ProductParameter.objects.filter(parameter__name='Цвет').values_list('parameter_id', flat=True)),
+            [first_id] * 3
+        )
+        self.assertEqual(self.import_price_list(PRICE_LIST), {'created': 0, 'updated': 0, 'unchanged': 3, 'deleted': 0})
+
+    def test_permanent_table_with_staging_name_is_kept(self):
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE TABLE import_goods (id integer)')
+
+        self.import_price_list(PRICE_LIST)
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('public.import_goods') IS NOT NULL")
+            self.assertTrue(cursor.fetchone()[0])
+
+
+class PriceListValidatorTests(CatalogTestCase):
+    """
+    Прайс-лист проверяется до записи в базу, все ошибки собираются в один отчет
+    """
+
+    def check(self, content: str, max_errors: int = None) -> list:
+        try:
+            PriceListValidator(max_errors).check(get_loader('shop.yaml')(self.shop_user.id), io.StringIO(content))
+        except PriceListError as error:
+            return error.errors
+
+        return []
+
+    def test_valid_price_list(self):
+        self.assertEqual(self.check(PRICE_LIST), [])
+
+    def test_report_collects_all_errors(self):
+        content = (PRICE_LIST.replace('    price: 65000\n', '')
+                   .replace('category: 1\n    model: apple/iphone/xs', 'category: 7\n    model: apple/iphone/xs')
+                   .replace('  - id: 3\n', '  - id: 2\n'))
+
+        errors = self.check(content)
+
+        self.assertEqual(errors, [
+            "goods[0]: 'price' is a required property",
+            'goods[1].category: категории 7 нет в списке categories',
+            'goods[2].id: товар с ИД 2 уже есть в прайс-листе',
+        ])
+
+    def test_report_is_limited(self):
+        content = PRICE_LIST.replace('quantity: 9', 'quantity: -1').replace('quantity: 4', 'quantity: -1') \
+            .replace('quantity: 7', 'quantity: -1')
+
+        errors = self.check(content, max_errors=2)
+
+        self.assertEqual(errors, [
+            'goods[0].quantity: -1 is less than the minimum of 0',
+            'goods[1].quantity: -1 is less than the minimum of 0',
+            '... и еще ошибок: 1',
+        ])
+
+    def test_missing_header(self):
+        errors = self.check(PRICE_LIST.replace('shop: Тестовый магазин\n', ''))
+
+        self.assertEqual(errors, ["Ошибка разбора файла: Поля 'shop' и 'categories' должны идти перед 'goods'"])
+
+    def test_integral_float_is_not_integer(self):
+        errors = self.check(PRICE_LIST.replace('price: 65000', 'price: 65000.0'))
+
+        self.assertEqual(errors, ["goods[0].price: 65000.0 is not of type 'integer'"])
+
+    def test_invalid_price_list_is_not_imported(self):
+        job = ImportJob.objects.get(id=self.upload(PRICE_LIST.replace('quantity: 4', 'quantity: -1'))['job_id'])
+
+        self.assertEqual(job.state, 'failed')
+        self.assertIn('goods[1].quantity', job.error)
+        self.assertFalse(ProductInfo.objects.exists())
+
+
+class ProductPaginationTests(CatalogTestCase):
+    """
+    Список предложений листается по курсору без пропусков и повторов
+    """
+
+    def test_pages_cover_all_offers(self):
+        self.upload(make_price_list([100] * 7))
+        first_page = self.get_products(page_size=3)
+
+        offers = self.get_all_products(page_size=3)
+
+        self.assertEqual(len(first_page['results']), 3)
+        self.assertIsNone(first_page['previous'])
+        self.assertEqual([offer['id'] for offer in offers],
+                         list(ProductInfo.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_previous_page(self):
+        self.upload(make_price_list([100] * 5))
+        first_page = self.get_products(page_size=2)
+        second_page = self.client.get(first_page['next']).json()
+
+        previous_page = self.client.get(second_page['previous']).json()
+
+        self.assertEqual(previous_page['results'], first_page['results'])
+
+    def test_ordering_with_equal_prices(self):
+        # курсор хранит цену и id, поэтому равные цены на границе страниц не теряются и не повторяются
+        self.upload(make_price_list([300, 100, 200, 100, 300, 100, 200]))
+        positions = list(ProductInfo.objects.values_list('price', 'id'))
+
+        for ordering, expected in (('price', sorted(positions)),
+                                   ('-price', sorted(positions, key=lambda position: (-position[0], position[1])))):
+            with self.subTest(ordering=ordering):
+                offers = self.get_all_products(page_size=2, ordering=ordering)
+
+                self.assertEqual([(offer['price'], offer['id']) for offer in offers], expected)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/v1/products', {'cursor': 'invalid'})
+
+        self.assertEqual(response.status_code, 404)
+
+
+class CatalogCacheTests(CatalogTestCase):
+    """
+    Ответы списков каталога кэшируются до смены версии каталога и отдаются с ETag
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.upload(PRICE_LIST)
+
+    def test_not_modified(self):
+        response = self.client.get('/api/v1/products')
+
+        cached_response = self.client.get('/api/v1/products', HTTP_IF_NONE_MATCH=response['ETag'])
+
+        self.assertEqual(cached_response.status_code, 304)
+        self.assertEqual(cached_response['ETag'], response['ETag'])
+
+    def test_query_changes_etag(self):
+        response = self.client.get('/api/v1/products')
+
+        filtered_response = self.client.get('/api/v1/products', {'category': 1},
+                                            HTTP_IF_NONE_MATCH=response['ETag'])
+
+        self.assertEqual(filtered_response.status_code, 200)
+        self.assertNotEqual(filtered_response['ETag'], response['ETag'])
+
+    def test_import_bumps_version(self):
+        version = catalog_version.get()
+        response = self.client.get('/api/v1/products')
+
+        self.upload(PRICE_LIST.replace('price: 65000', 'price: 64000'))
+        updated_response = self.client.get('/api/v1/products', HTTP_IF_NONE_MATCH=response['ETag'])
+
+        self.assertGreater(catalog_version.get(), version)
+        self.assertEqual(updated_response.status_code, 200)
+        self.assertIn(64000, [offer['price'] for offer in updated_response.json()['results']])
+
+    def test_partner_state_bumps_version(self):
+        response = self.client.get('/api/v1/shops')
+
+        self.shop_client.post('/api/v1/partner/state', {'state': 'off'})
+        updated_response = self.client.get('/api/v1/shops', HTTP_IF_NONE_MATCH=response['ETag'])
+
+        self.assertEqual(updated_response.status_code, 200)
+        self.assertEqual(updated_response.json()['results'], [])
+        self.assertEqual(self.get_products()['results'], [])
+
+
+class SearchTests(CatalogTestCase):
+    """
+    Поиск находит предложения, содержащие все слова запроса, по префиксу слова
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.upload(PRICE_LIST)
+
+    def search(self, query: str, **params) -> list:
+        return [offer['model'] for offer in self.get_all_products(search=query, **params)]
+
+    def test_search_by_prefix(self):
+        self.assertEqual(sorted(self.search('iphon')), ['apple/iphone/se', 'apple/iphone/xr', 'apple/iphone/xs'])
+        self.assertEqual(self.search('смартф XR'), ['apple/iphone/xr'])
+
+    def test_search_by_parameter_value(self):
+        self.assertEqual(self.search('iphone Черный'), ['apple/iphone/xs'])
+
+    def test_all_words_must_match(self):
+        self.assertEqual(self.search('iphone samsung'), [])
+
+    def test_search_pages(self):
+        self.assertEqual(sorted(self.search('iphone', page_size=1)),
+                         ['apple/iphone/se', 'apple/iphone/xr', 'apple/iphone/xs'])
+
+    def test_search_follows_import(self):
+        self.upload(PRICE_LIST.replace('Смартфон Apple iPhone SE', 'Смартфон Apple iPhone SE 2020'))
+
+        self.assertEqual(self.search('2020'), ['apple/iphone/se'])
+
+
+class ParameterFilterTests(CatalogTestCase):
+    """
+    Фильтры по значениям и диапазонам параметров и счетчики значений (фасеты)
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.upload(PRICE_LIST)
+
+    def filter_models(self, params: dict) -> list:
+        return sorted(offer['model'] for offer in self.get_all_products(**params))
+
+    def get_facets(self, **params) -> dict:
+        response = self.client.get('/api/v1/products/facets', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_parameter_values(self):
+        self.assertEqual(self.filter_models({'param[Цвет]': 'черный'}), ['apple/iphone/xs'])
+        self.assertEqual(self.filter_models({'param[Цвет]': ['черный', 'белый']}),
+                         ['apple/iphone/se', 'apple/iphone/xs'])
+        self.assertEqual(self.filter_models({'param[Цвет]': ['черный', 'белый'], 'param[Встроенная память]': '128 Гб'}),
+                         ['apple/iphone/se'])
+        self.assertEqual(self.filter_models({'param[Вес]': '100'}), [])
+
+    def test_numeric_values(self):
+        self.assertEqual(
+            list(ProductParameter.objects.filter(product_info__external_id=1).order_by('parameter__name').values_list(
+                'parameter__name', 'numeric_value', 'unit')),
+            [('Встроенная память', 256, 'Гб'), ('Диагональ (дюйм)', 6.1, 'дюйм'), ('Цвет', None, '')]
+        )
+
+    def test_parameter_ranges(self):
+        self.assertEqual(self.filter_models({'param[Диагональ (дюйм)]__gte': '5.8'}),
+                         ['apple/iphone/xr', 'apple/iphone/xs'])
+        self.assertEqual(self.filter_models({'param[Диагональ (дюйм)]__gt': '5,8', 'param[Цвет]': 'красный'}),
+                         ['apple/iphone/xr'])
+        self.assertEqual(self.filter_models({'param[Встроенная память]__lt': '512',
+                                             'param[Встроенная память]__gte': '200'}), ['apple/iphone/xr'])
+
+    def test_invalid_range(self):
+        response = self.client.get('/api/v1/products', {'param[Диагональ (дюйм)]__gte': 'пять'})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_facets(self):
+        facets = self.get_facets()
+
+        self.assertEqual(facets['Цвет'], {'белый': 1, 'красный': 1, 'черный': 1})
+        self.assertEqual(facets['Диагональ (дюйм)'], {'4.7': 1, '5.8': 1, '6.1': 1})
+
+    def test_facets_of_filtered_offers(self):
+        facets = self.get_facets(**{'param[Диагональ (дюйм)]__gte': '5.8'})
+
+        self.assertEqual(facets['Цвет'], {'красный': 1, 'черный': 1})
+
+    def test_facet_counts_follow_catalog_changes(self):
+        self.upload(PRICE_LIST.replace('"Цвет": белый', '"Цвет": черный').replace('  - id: 3\n', '  - id: 4\n'))
+
+        self.assertEqual(self.get_facets()['Цвет'], {'черный': 2, 'красный': 1})
+        self.assertEqual(self.get_counts(), self.get_index_counts())
+
+        self.shop_client.post('/api/v1/partner/state', {'state': 'off'})
+
+        self.assertEqual(self.get_facets(), {})
+        self.assertFalse(FacetCount.objects.exists())
+
+    @staticmethod
+    def get_counts() -> list:
+        return sorted(FacetCount.objects.values_list('parameter_id', 'value', 'count'))
+
+    @staticmethod
+    def get_index_counts() -> list:
+        counts = {}
+
+        for key in ParameterIndex.objects.values_list('parameter_id', 'value'):
+            counts[key] = counts.get(key, 0) + 1
+
+        return sorted((*key, count) for key, count in counts.items())
+
+
+class PriceFilterTests(CatalogTestCase):
+    """
+    Фильтры по цене и наличию и сортировка списка предложений
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.upload(PRICE_LIST.replace('quantity: 4', 'quantity: 0'))
+
+    def filter_prices(self, **params) -> list:
+        return [offer['price'] for offer in self.get_all_products(**params)]
+
+    def test_price_range(self):
+        self.assertEqual(self.filter_prices(min_price=40000, ordering='price'), [65000, 80000])
+        self.assertEqual(self.filter_prices(max_price=65000, ordering='-price'), [65000, 30000])
+
+    def test_in_stock(self):
+        self.assertEqual(self.filter_prices(in_stock='true', ordering='price'), [30000, 65000])
+        self.assertEqual(self.filter_prices(in_stock='false'), [80000])
+
+
+class ExportTests(CatalogTestCase):
+    """
+    Выгрузка каталога отдается zip-архивом потоком
+    """
+
+    def get_archive(self, response) -> zipfile.ZipFile:
+        return zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+
+    def test_export_streams_archive(self):
+        self.upload(PRICE_LIST)
+
+        response = self.client.get('/api/v1/export')
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = self.get_archive(response)
+        products = {product['name']: product for product in json.loads(archive.read('products.json'))}
+        self.assertEqual(sorted(products), ['Смартфон Apple iPhone SE', 'Смартфон Apple iPhone XR',
+                                            'Смартфон Apple iPhone XS'])
+        product = products['Смартфон Apple iPhone XR']
+        self.assertEqual(product['category'], 'Смартфоны')
+        self.assertEqual(
+            {key: product['product_infos'][0][key] for key in ('external_id', 'shop_name', 'quantity', 'price')},
+            {'external_id': 1, 'shop_name': 'Тестовый магазин', 'quantity': 9, 'price': 65000}
+        )
+        self.assertIn({'parameter_name': 'Цвет', 'value': 'красный'}, product['product_infos'][0]['product_parameters'])
+        self.assertEqual([shop['name'] for shop in json.loads(archive.read('shops.json'))], ['Тестовый магазин'])
+        self.assertEqual([category['id'] for category in json.loads(archive.read('categories.json'))], [1])
+
+    def test_export_of_empty_catalog(self):
+        archive = self.get_archive(self.client.get('/api/v1/export'))
+
+        self.assertEqual(json.loads(archive.read('products.json')), [])
+        self.assertEqual(json.loads(archive.read('shops.json')), [])
+
+
+class ExportJobTests(CatalogTestCase):
+    """
+    Фоновая выгрузка каталога: архив пишется в EXPORT_ROOT и скачивается с докачкой
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.export_root = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(EXPORT_ROOT=self.export_root))
+        self.upload(PRICE_LIST)
+
+    def create_job(self, **data) -> ExportJob:
+        response = self.client.post('/api/v1/export/jobs', data, format='json')
+        return ExportJob.objects.get(id=response.json()['job_id'])
+
+    def download(self, job: ExportJob, **headers):
+        return self.client.get(f'/api/v1/export/jobs/{job.id}/download', **headers)
+
+    def get_offers(self, job: ExportJob) -> list:
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(self.download(job).streaming_content)))
+        return json.loads(archive.read('offers.json'))
+
+    def test_export_job(self):
+        job = self.create_job()
+
+        self.assertEqual(self.client.get(f'/api/v1/export/jobs/{job.id}').json()['state'], 'done')
+        self.assertEqual(job.offers, 3)
+        self.assertEqual(self.get_offers(job), self.get_all_products())
+
+    def test_incremental_export(self):
+        job = self.create_job()
+
+        self.upload(PRICE_LIST.replace('price: 80000', 'price: 79000'))
+        incremental_job = self.create_job(since_version=job.catalog_version)
+
+        self.assertEqual([offer['price'] for offer in self.get_offers(incremental_job)], [79000])
+
+    def test_download_range(self):
+        job = self.create_job()
+        content = b''.join(self.download(job).streaming_content)
+
+        response = self.download(job, HTTP_RANGE='bytes=10-19')
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(content)}')
+        self.assertEqual(b''.join(response.streaming_content), content[10:20])
+
+        response = self.download(job, HTTP_RANGE='bytes=-5')
+
+        self.assertEqual(b''.join(response.streaming_content), content[-5:])
+
+    def test_download_range_of_changed_file(self):
+        job = self.create_job()
+
+        response = self.download(job, HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"outdated"')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(int(response['Content-Length']), job.size)
+
+    def test_unsatisfiable_range(self):
+        job = self.create_job()
+
+        response = self.download(job, HTTP_RANGE=f'bytes={job.size}-')
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{job.size}')
+
+    def test_expired_archives_are_deleted(self):
+        job = self.create_job()
+        ExportJob.objects.filter(id=job.id).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(delete_expired_exports(), 1)
+
+        self.assertEqual(ExportJob.objects.get(id=job.id).state, 'expired')
+        self.assertEqual(os.listdir(self.export_root), [])
+        self.assertEqual(self.download(job).status_code, 404)
+
+
+class StockReservationTests(TestCase):
+    """
+    Оформление корзины списывает остатки условным UPDATE и откатывает все списания,
+    если товара не хватает хотя бы по одной строке
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        shop_user = User.objects.create_user('shop@example.com', 'password', type='shop', is_active=True)
+        cls.shop = Shop.objects.create(name='Магазин', user=shop_user)
+        product = Product.objects.create(name='Смартфон', category=Category.objects.create(id=1, name='Смартфоны'))
+        cls.first = ProductInfo.objects.create(product=product, shop=cls.shop, external_id=1, quantity=5, price=100,
+                                               price_rrc=110)
+        cls.second = ProductInfo.objects.create(product=product, shop=cls.shop, external_id=2, quantity=2, price=200,
+                                                price_rrc=210)
+        cls.buyer = User.objects.create_user('buyer@example.com', 'password', is_active=True)
+        cls.contact = Contact.objects.create(user=cls.buyer, city='Москва', street='Тверская', phone='+70000000000')
+        cls.order = Order.objects.create(user=cls.buyer, state='basket')
+        OrderItem.objects.bulk_create([
+            OrderItem(order=cls.order, product_info=cls.first, quantity=3),
+            OrderItem(order=cls.order, product_info=cls.second, quantity=2),
+        ])
+
+    def get_quantities(self) -> list:
+        return list(ProductInfo.objects.order_by('id').values_list('quantity', flat=True))
+
+    def test_checkout_reserves_stock(self):
+        self.assertEqual(OrderOperation(self.buyer).checkout(self.order.id, self.contact.id), 1)
+
+        self.assertEqual(self.get_quantities(), [2, 0])
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.state, self.order.total_sum, self.order.item_count), ('new', 700, 5))
+        self.assertEqual(ShopOrder.objects.get(order=self.order).subtotal, 700)
+
+    def test_reserve_stock_reports_short_line(self):
+        ProductInfo.objects.filter(id=self.second.id).update(quantity=1)
+
+        with self.assertRaises(StockError) as context:
+            reserve_stock([self.order.id])
+
+        self.assertEqual(context.exception.product_info_id, self.second.id)
+        # первая строка уже списана: откатывает ее транзакция оформления
+        self.assertEqual(self.get_quantities(), [2, 1])
+
+    def test_insufficient_stock_rolls_back_checkout(self):
+        ProductInfo.objects.filter(id=self.second.id).update(quantity=1)
+
+        with self.assertRaises(StockError):
+            OrderOperation(self.buyer).checkout(self.order.id, self.contact.id)
+
+        self.assertEqual(self.get_quantities(), [5, 1])
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.state, 'basket')
+        self.assertFalse(ShopOrder.objects.filter(order=self.order).exists())
+
+    def test_insufficient_stock_response(self):
+        ProductInfo.objects.filter(id=self.second.id).update(quantity=1)
+
+        response = OrderOperation(self.buyer).create({'id': self.order.id, 'contact': self.contact.id})
+
+        self.assertEqual(json.loads(response.content)['product_info'], self.second.id)
+        self.assertFalse(json.loads(response.content)['Status'])
+
+    def test_repeated_checkout_does_not_reserve_again(self):
+        OrderOperation(self.buyer).checkout(self.order.id, self.contact.id)
+
+        response = OrderOperation(self.buyer).create({'id': self.order.id, 'contact': self.contact.id})
+
+        self.assertEqual(json.loads(response.content), {'Status': False})
+        self.assertEqual(self.get_quantities(), [2, 0])
+
+    def test_canceled_order_is_not_checked_out(self):
+        Order.objects.filter(id=self.order.id).update(state='canceled')
+
+        self.assertEqual(OrderOperation(self.buyer).checkout(self.order.id, self.contact.id), 0)
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.state, 'canceled')
+        self.assertEqual(self.get_quantities(), [5, 2])
+
+    def test_stock_is_published_to_catalog(self):
+        CatalogOperation().refresh_shop(self.shop.id)
+        version = catalog_version.get()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            OrderOperation(self.buyer).checkout(self.order.id, self.contact.id)
+
+        self.assertEqual(
+            list(CatalogOffer.objects.order_by('product_info_id').values_list('quantity', 'data__quantity')),
+            [(2, 2), (0, 0)]
+        )
+        self.assertGreater(catalog_version.get(), version)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            release_stock([self.order.id])
+
+        self.assertEqual(list(CatalogOffer.objects.order_by('product_info_id').values_list('quantity', flat=True)),
+                         [5, 2])
+
+    def test_rebuild_keeps_placed_order_totals(self):
+        OrderOperation(self.buyer).checkout(self.order.id, self.contact.id)
+        ProductInfo.objects.update(price=1000)
+
+        call_command('rebuild_shop_orders', stdout=io.StringIO())
+
+        self.assertEqual(ShopOrder.objects.get(order=self.order).subtotal, 700)
+
+        ShopOrder.objects.all().delete()
+        call_command('rebuild_shop_orders', stdout=io.StringIO())
+
+        self.assertTrue(ShopOrder.objects.filter(order=self.order).exists())
+
+
+@override_settings(BASKET_CACHE='default')
+class BasketCacheTests(CatalogTestCase):
+    """
+    Корзина в кэше: изменения не пишутся в базу до оформления заказа или задачи flush_baskets
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.upload(PRICE_LIST)
+        self.product_info_ids = list(ProductInfo.objects.order_by('external_id').values_list('id', flat=True))
+        self.contact = Contact.objects.create(user=self.buyer, city='Москва', street='Тверская', phone='+70000000000')
+
+    def add_items(self, *items) -> dict:
+        return self.client.post('/api/v1/basket', {'items': [
+            {'product_info': product_info_id, 'quantity': quantity, 'order': 0} for product_info_id, quantity in items
+        ]}, format='json').json()
+
+    def get_basket(self) -> list:
+        return self.client.get('/api/v1/basket/0').json()
+
+    def test_basket_changes_stay_in_cache(self):
+        self.add_items((self.product_info_ids[0], 1), (self.product_info_ids[1], 2))
+        self.add_items((self.product_info_ids[0], 1))
+
+        basket, = self.get_basket()
+
+        self.assertEqual((basket['id'], basket['total_sum'], basket['item_count']), (0, 65000 * 2 + 80000 * 2, 4))
+        self.assertFalse(Order.objects.exists())
+
+    def test_flush_writes_changed_baskets(self):
+        self.add_items((self.product_info_ids[0], 2))
+
+        self.assertEqual(flush_dirty_baskets(), 1)
+
+        order = Order.objects.get(user=self.buyer, state='basket')
+        self.assertEqual(list(order.ordered_items.values_list('product_info_id', 'quantity')),
+                         [(self.product_info_ids[0], 2)])
+        self.assertEqual(order.total_sum, 130000)
+        self.assertEqual(flush_dirty_baskets(), 0)
+
+    def test_checkout_writes_basket(self):
+        self.add_items((self.product_info_ids[2], 3))
+
+        response = self.client.post('/api/v1/order', {'id': 0, 'contact': self.contact.id}, format='json')
+
+        self.assertEqual(response.json(), {'Status': True})
+        order = Order.objects.get(user=self.buyer)
+        self.assertEqual((order.state, order.total_sum), ('new', 90000))
+        self.assertEqual(ProductInfo.objects.get(id=self.product_info_ids[2]).quantity, 4)
+
+    @mock.patch('backend.services.basket_cache.LOCK_WAIT', 0.05)
+    def test_busy_basket(self):
+        lock_key = f'basket:{self.buyer.id}:lock'
+        cache.add(lock_key, 'other', 5)
+
+        response = self.add_items((self.product_info_ids[0], 1))
+
+        self.assertFalse(response['Status'])
+        self.assertEqual(cache.get(lock_key), 'other')
+
+    def test_expired_lock_is_not_released(self):
+        basket_cache = BasketCache(self.buyer.id)
+        lock_key = f'basket:{self.buyer.id}:lock'
+
+        with basket_cache.lock():
+            # блокировка истекла, и корзину заблокировал другой запрос
+            cache.set(lock_key, 'other', 5)
+
+        self.assertEqual(cache.get(lock_key), 'other')
+
+    @mock.patch('backend.services.basket_cache.LOCK_WAIT', 0.05)
+    def test_flush_skips_busy_basket(self):
+        self.add_items((self.product_info_ids[0], 2))
+        cache.add(f'basket:{self.buyer.id}:lock', 'other', 5)
+
+        self.assertEqual(flush_dirty_baskets(), 0)
+
+        cache.delete(f'basket:{self.buyer.id}:lock')
+        self.assertEqual(flush_dirty_baskets(), 1)
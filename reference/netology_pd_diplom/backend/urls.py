@@ -4,7 +4,8 @@ from django_rest_passwordreset.views import reset_password_request_token, reset_
 
 from backend.views import PartnerUpdate, RegisterAccount, LoginAccount, CategoryView, ShopView, ProductInfoView, \
     BasketView, \
-    AccountDetails, ContactView, OrderView, PartnerState, PartnerOrders, ConfirmAccount, ExportView
+    AccountDetails, ContactView, OrderView, PartnerState, PartnerOrders, ConfirmAccount, ExportView, PartnerImportJob, \
+    ProductFacetView, ExportJobCreate, ExportJobView, ExportJobDownload
 
 details_methods = {"get": "retrieve", "put": "update", "delete": "destroy"}
 list_create_methods = {"get": "list", "post": "create"}
@@ -24,6 +25,7 @@ urlpatterns = [
     path('user/contact', ContactView.as_view(list_create_methods), name='user-contact'),
 
     path('partner/update', PartnerUpdate.as_view(), name='partner-update'),
+    path('partner/import/<int:pk>', PartnerImportJob.as_view(), name='partner-import'),
     path('partner/state', PartnerState.as_view(), name='partner-state'),
     path('partner/orders', PartnerOrders.as_view(), name='partner-orders'),
 
@@ -33,6 +35,10 @@ urlpatterns = [
     path('categories', CategoryView.as_view(), name='categories'),
     path('shops', ShopView.as_view(), name='shops'),
     path('products', ProductInfoView.as_view({"get": "list"}), name='products'),
+    path('products/facets', ProductFacetView.as_view(), name='product-facets'),
     path('order', OrderView.as_view(list_create_methods), name='order'),
-    path('export', ExportView.as_view(), name='export')
+    path('export', ExportView.as_view(), name='export'),
+    path('export/jobs', ExportJobCreate.as_view(), name='export-jobs'),
+    path('export/jobs/<int:pk>', ExportJobView.as_view(), name='export-job'),
+    path('export/jobs/<int:pk>/download', ExportJobDownload.as_view(), name='export-job-download'),
 ]
@@ -1,15 +1,14 @@
-import io
-import json
-import zipfile
 
 from distutils.util import strtobool
+from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import OpenApiParameter, extend_schema, inline_serializer
 from rest_framework.request import Request
 from rest_framework import serializers
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
-from django.db.models import Sum, F, Prefetch
-from django.http import JsonResponse, HttpResponse
+from rest_framework.renderers import BrowsableAPIRenderer
+from django.http import JsonResponse, StreamingHttpResponse
 from rest_framework import generics
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.authtoken.models import Token
@@ -18,17 +17,27 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import GenericViewSet
 
-from backend.models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Order, OrderItem, \
-    Contact, ConfirmEmailToken
+from backend.models import Shop, Category, Order, Contact, ConfirmEmailToken, ImportJob, CatalogOffer, ExportJob, \
+    ShopOrder
 from backend.serializers import UserSerializer, CategorySerializer, ShopSerializer, ProductInfoSerializer, \
-    OrderItemSerializer, OrderSerializer, ContactSerializer, UserRegisterSerializer, UserLoginSerializer, PartnerUpdateSerializer, OrderCreateSerializer, ContactCreateSerializer, ShopCreateSerializer, BasketCreateSerializer, ConfirmAccountSerializer, AccountDetailsCreateSerializer, BasketDeleteSerializer, BasketUpdateSerializer
-from backend.filters import ProductFilter
-from backend.services.basket import BasketOperation
+    OrderSerializer, ContactSerializer, UserRegisterSerializer, UserLoginSerializer, PartnerUpdateSerializer, OrderCreateSerializer, ContactCreateSerializer, ShopCreateSerializer, BasketCreateSerializer, ConfirmAccountSerializer, AccountDetailsCreateSerializer, BasketDeleteSerializer, BasketUpdateSerializer, ImportJobSerializer, \
+    ExportJobSerializer, ExportJobCreateSerializer
+from backend.caching import CatalogCacheMixin, catalog_version
+from backend.downloads import get_file_response
+from backend.filters import ProductFilter, ShopOrderFilter
+from backend.pagination import ProductInfoPagination, ShopOrderPagination
+from backend.renderers import UJSONRenderer
+from backend.services.basket import get_basket_operation_class
+from backend.services.basket_cache import BasketLockError
+from backend.services.catalog import CatalogOperation
 from backend.services.contacts import ContactOperation
-from backend.services.product import ProductOperation
+from backend.services.export import ExportOperation
 from backend.services.order import OrderOperation
+from backend.services.order_list import OrderListOperation, ShopOrderListOperation
+from backend.services.staging import UploadStorage
+from backend.services.tracker import ImportTracker
 from backend.permissions import ShopsOnly
-from backend.tasks import do_import
+from backend.tasks import do_import, refresh_catalog, export_catalog
 
 
 class RegisterAccount(generics.CreateAPIView):
@@ -158,7 +167,7 @@ class LoginAccount(APIView):
             return JsonResponse({'Status': False, 'Errors': e})
 
 
-class CategoryView(ListAPIView):
+class CategoryView(CatalogCacheMixin, ListAPIView):
     """
     Класс для просмотра категорий
     """
@@ -167,7 +176,7 @@ class CategoryView(ListAPIView):
     permission_classes = (IsAuthenticated,)
 
 
-class ShopView(ListAPIView):
+class ShopView(CatalogCacheMixin, ListAPIView):
     """
     Класс для просмотра списка магазинов
     """
@@ -176,10 +185,12 @@ class ShopView(ListAPIView):
     permission_classes = (IsAuthenticated,)
 
 
-class ProductInfoView(GenericViewSet):
+class ProductInfoView(CatalogCacheMixin, GenericViewSet):
     permission_classes = (IsAuthenticated,)
     serializer_class = ProductInfoSerializer
     filterset_class = ProductFilter
+    pagination_class = ProductInfoPagination
+    renderer_classes = (UJSONRenderer, BrowsableAPIRenderer)
     """
     A class for searching products.
 
@@ -191,12 +202,8 @@ class ProductInfoView(GenericViewSet):
     """
 
     def get_queryset(self):
-        return (
-            ProductInfo.objects
-            .filter(shop__state=True)
-            .select_related('shop', 'product__category')
-            .prefetch_related('product_parameters__parameter').distinct()
-        )
+        # поля сортировки нужны курсору для позиции следующей страницы
+        return CatalogOffer.objects.values('product_info_id', 'name', 'price', 'price_rrc', 'data')
 
     @extend_schema(
         parameters=[
@@ -206,6 +213,19 @@ class ProductInfoView(GenericViewSet):
             OpenApiParameter(
                 name="shop", description="shop_id", required=False
             ),
+            OpenApiParameter(
+                name="min_price", description="Minimum price", required=False
+            ),
+            OpenApiParameter(
+                name="max_price", description="Maximum price", required=False
+            ),
+            OpenApiParameter(
+                name="in_stock", description="Only offers in stock (true) or out of stock (false)", required=False
+            ),
+            OpenApiParameter(
+                name="ordering", description="price, price_rrc or name, prefixed with - for descending order",
+                required=False
+            ),
         ],
     )
     def list(self, request: Request, *args, **kwargs):
@@ -218,15 +238,48 @@ class ProductInfoView(GenericViewSet):
         Returns:
         - Response: The response containing the product information.
         """
-        serializer = ProductInfoSerializer(
-            self.filter_queryset(self.get_queryset()), many=True
-        )
+        return self.get_cached_response(request, self.get_offers_response)
 
-        return Response(serializer.data)
+    def get_offers_response(self) -> Response:
+        offers = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+
+        return self.get_paginated_response([offer['data'] for offer in offers])
+
+
+class ProductFacetView(CatalogCacheMixin, generics.GenericAPIView):
+    permission_classes = (IsAuthenticated,)
+    queryset = CatalogOffer.objects.all()
+    filterset_class = ProductFilter
+    """
+    A class for counting offers by parameter values.
+
+    Methods:
+    - get: Retrieve the number of offers for every parameter value within the specified filters.
+
+    Attributes:
+    - None
+    """
+
+    @extend_schema(responses={200: OpenApiTypes.OBJECT})
+    def get(self, request: Request, *args, **kwargs):
+        """
+        Retrieve the number of offers for every parameter value within the specified filters.
+
+        Args:
+        - request (Request): The Django request object.
+
+        Returns:
+        - Response: The response containing {parameter name: {value: number of offers}}.
+        """
+        return self.get_cached_response(request, self.get_facets_response)
+
+    def get_facets_response(self) -> Response:
+        return Response(CatalogOperation.get_facets(self.filter_queryset(self.get_queryset())))
 
 
 class BasketView(ModelViewSet):
     permission_classes = (IsAuthenticated,)
+    renderer_classes = (UJSONRenderer, BrowsableAPIRenderer)
 
     """
     A class for managing the user's shopping basket.
@@ -242,11 +295,7 @@ class BasketView(ModelViewSet):
     """
 
     def get_queryset(self):
-        return Order.objects.filter(
-            user_id=self.request.user.id, state='basket').prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
+        return Order.objects.filter(user_id=self.request.user.id, state='basket')
 
     def get_serializer_class(self):
         if self.request.method == "POST":
@@ -267,17 +316,18 @@ class BasketView(ModelViewSet):
         Returns:
         - Response: The response containing the items in the user's basket.
         """
-        serializer = OrderSerializer(self.get_queryset(), many=True)
-
-        return Response(serializer.data)
+        return Response(get_basket_operation_class()(request.user, []).list())
 
     def create(self, request, *args, **kwargs):
         serializer_class = self.get_serializer_class()
         serializer = serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
         items = serializer.data.get("items")
-        basket_operation = BasketOperation(self.request.user, items)
-        objects_created = basket_operation.create()
+        basket_operation = get_basket_operation_class()(self.request.user, items)
+        try:
+            objects_created = basket_operation.create()
+        except BasketLockError as error:
+            return JsonResponse({'Status': False, 'Errors': str(error)})
 
         return JsonResponse({'Status': True, 'Создано объектов': objects_created})
 
@@ -286,8 +336,11 @@ class BasketView(ModelViewSet):
         serializer = serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
         items = serializer.data.get('items')
-        basket_operation = BasketOperation(self.request.user, items)
-        deleted_count = basket_operation.delete()
+        basket_operation = get_basket_operation_class()(self.request.user, items)
+        try:
+            deleted_count = basket_operation.delete()
+        except BasketLockError as error:
+            return JsonResponse({'Status': False, 'Errors': str(error)})
 
         return JsonResponse({'Status': True, 'Удалено объектов': deleted_count})
 
@@ -305,8 +358,11 @@ class BasketView(ModelViewSet):
         serializer = serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
         items = serializer.data.get('items')
-        basket_operation = BasketOperation(self.request.user, items)
-        updated_basket_items = basket_operation.update()
+        basket_operation = get_basket_operation_class()(self.request.user, items)
+        try:
+            updated_basket_items = basket_operation.update()
+        except BasketLockError as error:
+            return JsonResponse({'Status': False, 'Errors': str(error)})
 
         return JsonResponse({'Status': True, 'Обновлено объектов': updated_basket_items})
 
@@ -334,12 +390,54 @@ class PartnerUpdate(generics.CreateAPIView):
         Returns:
         - JsonResponse: The response indicating the status of the operation and any errors.
         """
-        bytes_io_content = request.FILES.get("file").file.getvalue()
-        serialized_content = bytes_io_content.decode('utf-8')
-        json_data = json.dumps(serialized_content)
-        do_import.delay(self.request.user.id, json_data)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        storage = UploadStorage()
+        file_name = storage.save(serializer.validated_data['file'])
 
-        return JsonResponse({'Status': True})
+        if Shop.objects.filter(user_id=request.user.id, import_hash=storage.get_hash(file_name)).exists():
+            storage.delete(file_name)
+            return JsonResponse({'Status': True, 'Skipped': True})
+
+        job = ImportJob.objects.create(user_id=request.user.id, file_name=file_name)
+        do_import.delay(job.id)
+
+        return JsonResponse({'Status': True, 'job_id': job.id})
+
+
+class PartnerImportJob(generics.RetrieveAPIView):
+    permission_classes = (IsAuthenticated, ShopsOnly)
+    serializer_class = ImportJobSerializer
+    """
+    A class for tracking partner price list imports.
+
+    Methods:
+    - get: Retrieve the state, progress and phase timings of an import job.
+
+    Attributes:
+    - None
+    """
+
+    def get_queryset(self):
+        return ImportJob.objects.filter(user_id=self.request.user.id)
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Retrieve the state of an import job. Progress of a running job is read from the cache.
+
+        Args:
+        - request (Request): The Django request object.
+
+        Returns:
+        - Response: The response containing the import job state.
+        """
+        job = self.get_object()
+
+        if job.state == 'running':
+            for field, value in ImportTracker(job.id).get_progress().items():
+                setattr(job, field, value)
+
+        return Response(self.get_serializer(job).data)
 
 
 class PartnerState(ListCreateAPIView):
@@ -391,7 +489,18 @@ class PartnerState(ListCreateAPIView):
 
         state = serializer.data.get('state')
         try:
-            Shop.objects.filter(user_id=request.user.id).update(state=strtobool(state))
+            # ShopCreateSerializer уже приводит state к bool
+            is_active = state if isinstance(state, bool) else strtobool(state)
+            Shop.objects.filter(user_id=request.user.id).update(state=is_active)
+
+            for shop_id in Shop.objects.filter(user_id=request.user.id).values_list('id', flat=True):
+                if is_active:
+                    refresh_catalog.delay(shop_id)
+                else:
+                    CatalogOperation.remove_shop(shop_id)
+
+            catalog_version.bump()
+
             return JsonResponse({'Status': True})
         except ValueError as error:
             return JsonResponse({'Status': False, 'Errors': str(error)})
@@ -400,24 +509,31 @@ class PartnerState(ListCreateAPIView):
 class PartnerOrders(ListAPIView):
     permission_classes = (IsAuthenticated, ShopsOnly)
     serializer_class = OrderSerializer
+    renderer_classes = (UJSONRenderer, BrowsableAPIRenderer)
+    pagination_class = ShopOrderPagination
+    filterset_class = ShopOrderFilter
     """
     Класс для получения заказов поставщиками
      Methods:
-    - get: Retrieve the orders associated with the authenticated partner.
+    - get: Retrieve the orders associated with the authenticated partner, newest first.
+
+    Query parameters:
+    - state: Order state, may be repeated.
+    - date_from, date_to: Order date range, inclusive.
+    - cursor, page_size: Cursor pagination.
 
     Attributes:
     - None
     """
 
     def get_queryset(self):
-        return Order.objects.filter(
-            ordered_items__product_info__shop__user_id=self.request.user.id).exclude(state='basket').prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').select_related('contact').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
+        return ShopOrder.objects.filter(shop__user_id=self.request.user.id)
 
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        operation = ShopOrderListOperation()
+        page = self.paginate_queryset(operation.get_rows(self.filter_queryset(self.get_queryset())))
+
+        return self.get_paginated_response(operation.to_representation(page))
 
 
 class ContactView(ModelViewSet):
@@ -512,6 +628,7 @@ class ContactView(ModelViewSet):
 
 class OrderView(ModelViewSet):
     permission_classes = (IsAuthenticated,)
+    renderer_classes = (UJSONRenderer, BrowsableAPIRenderer)
     """
     Класс для получения и размешения заказов пользователями
     Methods:
@@ -531,11 +648,7 @@ class OrderView(ModelViewSet):
             return OrderCreateSerializer
 
     def get_queryset(self):
-        return Order.objects.filter(
-            user_id=self.request.user.id).exclude(state='basket').prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').select_related('contact').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
+        return Order.objects.filter(user_id=self.request.user.id).exclude(state='basket')
 
     # получить мои заказы
     def list(self, request, *args, **kwargs):
@@ -548,10 +661,7 @@ class OrderView(ModelViewSet):
         Returns:
         - Response: The response containing the details of the order.
         """
-        serializer_class = self.get_serializer_class()
-        serializer = serializer_class(self.get_queryset(), many=True)
-
-        return Response(serializer.data)
+        return Response(OrderListOperation().list(self.get_queryset()))
 
     # разместить заказ из корзины
     def create(self, request, *args, **kwargs):
@@ -577,26 +687,91 @@ class OrderView(ModelViewSet):
 class ExportView(ListAPIView):
 
     def list(self, request, *args, **kwargs):
-        products = Product.objects.select_related('category').prefetch_related(
-            Prefetch('product_infos', queryset=ProductInfo.objects.select_related('shop').prefetch_related('product_parameters')),
-            'product_infos__product_parameters__parameter'
-        )
+        response = StreamingHttpResponse(ExportOperation().stream(), content_type='application/zip')
+        response['Content-Disposition'] = 'attachment; filename="exported_data.zip"'
+        return response
+
+
+class ExportJobCreate(generics.CreateAPIView):
+    permission_classes = (IsAuthenticated,)
+    serializer_class = ExportJobCreateSerializer
+    """
+    A class for starting background catalog exports.
+
+    Methods:
+    - post: Create an export job. With updated_since or since_version only offers changed after that mark are exported.
+
+    Attributes:
+    - None
+    """
 
-        products_data = ProductOperation.convert_queryset_to_list(products)
-        shops_data = list(Shop.objects.values())
-        categories_data = list(Category.objects.values())
+    def post(self, request, *args, **kwargs):
+        """
+        Create an export job and queue the archive build.
 
-        buffer = io.BytesIO()
+        Args:
+        - request (Request): The Django request object.
 
-        with zipfile.ZipFile(buffer, 'w') as zipf:
-            zipf.writestr('products.json', json.dumps(products_data, ensure_ascii=False))
-            zipf.writestr('shops.json', json.dumps(shops_data, ensure_ascii=False))
-            zipf.writestr('categories.json', json.dumps(categories_data, ensure_ascii=False))
+        Returns:
+        - JsonResponse: The response containing the export job id.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        job = ExportJob.objects.create(user_id=request.user.id, **serializer.validated_data)
+        export_catalog.delay(job.id)
 
-        buffer.seek(0)
+        return JsonResponse({'Status': True, 'job_id': job.id})
 
-        response = HttpResponse(buffer, content_type='application/zip')
-        response['Content-Disposition'] = 'attachment; filename="exported_data.zip"'
-        return response
+
+class ExportJobView(generics.RetrieveAPIView):
+    permission_classes = (IsAuthenticated,)
+    serializer_class = ExportJobSerializer
+    """
+    A class for tracking background catalog exports.
+
+    Methods:
+    - get: Retrieve the state of an export job. catalog_version of a finished job is the since_version for the next
+      incremental export.
+
+    Attributes:
+    - None
+    """
+
+    def get_queryset(self):
+        return ExportJob.objects.filter(user_id=self.request.user.id)
+
+
+class ExportJobDownload(generics.RetrieveAPIView):
+    permission_classes = (IsAuthenticated,)
+    serializer_class = ExportJobSerializer
+    """
+    A class for downloading export archives.
+
+    Methods:
+    - get: Download the archive of a finished export job. A single byte range (Range, If-Range) is supported to resume
+      interrupted downloads.
+
+    Attributes:
+    - None
+    """
+
+    def get_queryset(self):
+        return ExportJob.objects.filter(user_id=self.request.user.id, state='done')
+
+    @extend_schema(responses={(200, 'application/zip'): OpenApiTypes.BINARY})
+    def get(self, request, *args, **kwargs):
+        """
+        Download the export archive.
+
+        Args:
+        - request (Request): The Django request object.
+
+        Returns:
+        - StreamingHttpResponse: The archive or the requested part of it.
+        """
+        job = self.get_object()
+        path = UploadStorage(settings.EXPORT_ROOT).path(job.file_name)
+
+        return get_file_response(request, path, job.file_name, f'"{job.id}-{job.size}"', 'application/zip')
 
 
@@ -170,5 +170,47 @@ SPECTACULAR_SETTINGS = {
     "VERSION": "1.0.0",
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.redis.RedisCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'redis://redis:6379/1'),
+    }
+}
+
+# алиас кэша для версии каталога и кэша ответов каталога
+CATALOG_CACHE = os.getenv('CATALOG_CACHE', 'default')
+CATALOG_CACHE_TIMEOUT = int(os.getenv('CATALOG_CACHE_TIMEOUT', 60 * 60))
+
+IMPORT_STAGING_ROOT = os.getenv('IMPORT_STAGING_ROOT', os.path.join(BASE_DIR, 'staging'))
+# прайс-листы от этого размера (в байтах) импортируются параллельно пачками по IMPORT_CHUNK_SIZE товаров
+IMPORT_PARALLEL_THRESHOLD = int(os.getenv('IMPORT_PARALLEL_THRESHOLD', 20 * 1024 * 1024))
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', 20000))
+# на PostgreSQL последовательный импорт идет через COPY во временные таблицы
+IMPORT_USE_COPY = os.getenv('IMPORT_USE_COPY', 'true').lower() in ('1', 'true', 'yes')
+# сколько ошибок проверки прайс-листа сохраняется в отчете
+IMPORT_MAX_ERRORS = int(os.getenv('IMPORT_MAX_ERRORS', 1000))
+
+# каталог для архивов фоновых выгрузок каталога
+EXPORT_ROOT = os.getenv('EXPORT_ROOT', os.path.join(BASE_DIR, 'exports'))
+# сколько хранится архив выгрузки и как часто удаляются просроченные архивы, секунд
+EXPORT_TTL = int(os.getenv('EXPORT_TTL', 24 * 60 * 60))
+EXPORT_CLEANUP_INTERVAL = int(os.getenv('EXPORT_CLEANUP_INTERVAL', 60 * 60))
+
+# алиас кэша для корзин покупателей (Redis; для тестов подойдет LocMemCache).
+# Пустое значение - корзины хранятся в базе как заказы со статусом basket
+BASKET_CACHE = os.getenv('BASKET_CACHE', '')
+BASKET_CACHE_TIMEOUT = int(os.getenv('BASKET_CACHE_TIMEOUT', 30 * 24 * 60 * 60))
+# как часто измененные корзины из кэша записываются в базу, секунд
+BASKET_FLUSH_INTERVAL = int(os.getenv('BASKET_FLUSH_INTERVAL', 5 * 60))
+
+# размер кэша справочников (имена категорий, параметров и продуктов) в памяти процесса
+DICTIONARY_CACHE_SIZE = int(os.getenv('DICTIONARY_CACHE_SIZE', 10000))
+
 CELERY_BROKER_URL = 'redis://redis:6379/0'
 CELERY_RESULT_BACKEND = 'redis://redis:6379/0'
+CELERY_BEAT_SCHEDULE = {
+    'cleanup-exports': {'task': 'cleanup_exports', 'schedule': EXPORT_CLEANUP_INTERVAL},
+}
+
+if BASKET_CACHE:
+    CELERY_BEAT_SCHEDULE['flush-baskets'] = {'task': 'flush_baskets', 'schedule': BASKET_FLUSH_INTERVAL}